@@ -10,43 +10,74 @@ from util import Util
 from environment import Environment; Environment('shell')
 from processing import ProcessHandling
 
-def main(args):
+def get_queues(P, args):
+    """ Queues the books as they are found, so the first ones start while
+        the rest of the root directories are still being searched.
+    """
+    found = False
     try:
-        books = Environment.get_books(args.root_dir, args, stage='process')
+        for descriptor in Environment.discover(args.root_dir):
+            book = descriptor.open('process')
+            if args.log_level:
+                book.set_log_level(args.log_level)
+            found = True
+            yield queue_book(P, book, args)
     except Exception as e:
         Util.bail(str(e))
+    if not found:
+        Util.bail('No valid directories found for processing...')
+
 
-    P = ProcessHandling()
+def queue_book(P, book, args):
     queue = P.new_queue()
+    queue.add(book, cls='FeatureDetection', mth='pipeline')
+         
+    if args.derive_all or args.derive:
+        if args.derive:
+            formats = args.derive
+        else:
+            formats = ('djvu', 'pdf', 'epub', 'text')
+            
+        if book.settings['respawn']:
+            queue.add(book, cls='Crop', mth='cropper_pipeline', 
+                      kwargs={'crop': 'standardCrop'})
+
+            queue.add(book, cls='OCR', mth='tesseract_hocr_pipeline',
+                      kwargs={'lang': args.language})
+            
+        if 'djvu' in formats:
+            queue.add(book, cls='Djvu', mth='make_djvu_with_c44')
+                                          
+        if 'pdf' in formats:
+            queue.add(book, cls='PDF', mth='make_pdf_with_hocr2pdf')
+                          
+        if 'epub' in formats:
+            queue.add(book, cls='EPUB', mth='make_epub')
+                                          
+        if 'text' in formats:
+            queue.add(book, cls='PlainText', mth='make_full_plain_text')
+    return queue
 
-    for book in books:
-        queue.add(book, cls='FeatureDetection', mth='pipeline')
-             
-        if args.derive_all or args.derive:
-            if args.derive:
-                formats = args.derive
-            else:
-                formats = ('djvu', 'pdf', 'epub', 'text')
-                
-            if book.settings['respawn']:
-                queue.add(book, cls='Crop', mth='cropper_pipeline', 
-                          kwargs={'crop': 'standardCrop'})
-
-                queue.add(book, cls='OCR', mth='tesseract_hocr_pipeline',
-                          kwargs={'lang': args.language})
-                
-            if 'djvu' in formats:
-                queue.add(book, cls='Djvu', mth='make_djvu_with_c44')
-                                              
-            if 'pdf' in formats:
-                queue.add(book, cls='PDF', mth='make_pdf_with_hocr2pdf')
-                              
-            if 'epub' in formats:
-                queue.add(book, cls='EPUB', mth='make_epub')
-                                              
-            if 'text' in formats:
-                queue.add(book, cls='PlainText', mth='make_full_plain_text')
-        queue.drain('sync')
+
+def main(args):
+    P = ProcessHandling(executor=args.executor,
+                        scheduling=args.scheduling,
+                        batch_size=args.batch_size,
+                        jobs=args.jobs,
+                        spool_dir=args.spool_dir,
+                        resume=args.resume,
+                        incremental=args.incremental,
+                        adaptive=args.adaptive,
+                        speculate=args.speculate,
+                        memory_budget=args.memory_budget * 1024 * 1024 
+                        if args.memory_budget else None)
+
+    if args.progress:
+        publishing = P.progress.publish(args.progress)
+    P.drain_queues(get_queues(P, args), 'stream' if args.stream else 'sync')
+    if args.progress:
+        publishing.set()
+        P.progress.write(args.progress)
 
 
 
@@ -65,6 +96,43 @@ if __name__ == "__main__":
                       help='Files/Data will be re-created (default)')
     proc.add_argument('--no-respawn', action='store_true', 
                       help='Files/Data will be not be re-created')
+    proc.add_argument('--incremental', action='store_true',
+                      help='Re-create only what is out of date: work whose '
+                      'images, crops or tool arguments changed')
+    proc.add_argument('--resume', action='store_true',
+                      help='Pick up an interrupted run where it left off, '
+                      'skipping the leaves it finished')
+    proc.add_argument('--jobs', type=int, default=None,
+                      help='Leaf chunks to run at once across all books '
+                      '(default: number of cores)')
+    proc.add_argument('--executor', choices=('thread', 'process', 'spool'), 
+                      default='thread',
+                      help='Run leaf chunks on threads (default), in '
+                      'forked processes, or on ./bookmaker-worker processes '
+                      'reading from --spool-dir')
+    proc.add_argument('--spool-dir', default=None,
+                      help='Spool directory shared with the workers')
+    proc.add_argument('--scheduling', choices=('static', 'dynamic'), 
+                      default='static',
+                      help='Split leaves into equal slices up front (default) '
+                      'or have threads pull leaves from a shared queue')
+    proc.add_argument('--adaptive', action='store_true',
+                      help='Tune how many leaves each stage runs at once '
+                      'from throughput, CPU use and iowait')
+    proc.add_argument('--speculate', action='store_true',
+                      help='Start a second attempt at leaves that take far '
+                      'longer than the rest once threads run out of work')
+    proc.add_argument('--memory-budget', type=int, default=None,
+                      help='Megabytes the tools run on leaves may use at '
+                      'once (default: memory available at startup)')
+    proc.add_argument('--batch-size', type=int, default=1,
+                      help='Leaves pulled at a time with dynamic scheduling')
+    proc.add_argument('--progress', default=None, metavar='FILE',
+                      help='Keep FILE updated with the progress and estimated '
+                      'time remaining of each book, as JSON')
+    proc.add_argument('--stream', action='store_true',
+                      help='Pass each leaf on to the next stage as soon as '
+                      'it is done, instead of finishing every leaf first')
 
     ocr = parser.add_argument_group('OCR')
     ocr.add_argument('--language', nargs='?', default='English')
@@ -77,6 +145,10 @@ if __name__ == "__main__":
                         help='Derive all formats')
 
     debug = parser.add_argument_group('Debug')
+    debug.add_argument('--log-level', default=None,
+                       choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                       help='Lowest level each book logs at, overriding '
+                       'log_level in its settings.yaml (default: DEBUG)')
     debug.add_argument('--make-cornered-scaled', 
                        action='store_true', default=None)
     debug.add_argument('--draw-clusters', 
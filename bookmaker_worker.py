@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+""" Worker entry point; runs the leaf work that './bookmaker --executor spool'
+    queues in a spool directory.
+"""
+
+import os, time, argparse, socket
+import multiprocessing
+
+from util import Util
+from environment import Environment; Environment('shell')
+from processing import ProcessHandling
+from spool import Spool
+from buildcache import BuildCache
+from logwriter import LogWriter
+
+
+class Worker(ProcessHandling):
+    """ Claims tasks from a spool and runs them with the same operations and
+        components as a single node run would, sending back the leaf state
+        and exec_times the coordinator merges into its book.
+    """
+    def __init__(self, spool, name):
+        super(Worker, self).__init__(jobs=1)
+        self.spool = spool
+        self.name = name
+        self.books = {}
+        self._crops = {}
+
+    def join(self, e):
+        """ Operations hand their exceptions to the ProcessHandler; a worker
+            sends them back with the task instead.
+        """
+        pid, (exception, tb) = e
+        raise exception
+
+    def get_journal(self, book):
+        """ The coordinator journals the results it gets back. """
+        return None
+
+    def get_book(self, task):
+        root_dir = task['root_dir']
+        if root_dir not in self.books:
+            self.books[root_dir] = Environment.get_books(root_dir, None,
+                                                         stage='worker')[0]
+        book = self.books[root_dir]
+        book.settings = task['settings']
+        if task['incremental'] and book.build_cache is None:
+            book.build_cache = BuildCache(book)
+        self.set_crops(book, task['import_crops'])
+        return book
+
+    def set_crops(self, book, import_crops):
+        """ (Re)loads the book's crops when the scandata they come from has
+            changed since the last task.
+        """
+        if import_crops:
+            stamp = os.stat(book.scandata_file).st_mtime_ns
+        else:
+            stamp = None
+        if book.identifier in self._crops and \
+                self._crops[book.identifier] == stamp:
+            return
+        if import_crops:
+            book.scandata.new_from_file(book.scandata_file)
+            book.init_crops(import_from_scandata=True, strict=False)
+        else:
+            book.init_crops(strict=True)
+        self._crops[book.identifier] = stamp
+
+    def run_task(self, task):
+        book = self.get_book(task)
+        cls, kwargs = task['operation'], task['kwargs']
+        method = self._get_operation_method(cls, task['method'], book)
+        operation = self.OperationObjects[book.identifier][cls]
+        book.logger.debug('Worker ' + self.name + ' running ' + cls + '.' +
+                          task['method'] + ' on leaves ' +
+                          str(kwargs['start']) + '-' + str(kwargs['end']))
+        return operation.run_leaves(method.leafwise, [operation, ], kwargs)
+
+    def serve(self):
+        self.spool.requeue(self.name)
+        while True:
+            claimed = self.spool.claim(self.name)
+            if claimed is None:
+                time.sleep(Spool.poll_interval)
+                continue
+            name, task = claimed
+            try:
+                with self.spool.holding(self.name, name):
+                    result = self.run_task(task)
+            except (Exception, SystemExit):
+                exception, tb = Util.exception_info()
+                result = {'completed': {}, 'leaves': {},
+                          'exception': (str(exception), tb)}
+            self.spool.finish(self.name, name, result)
+
+
+def serve(spool_dir, name):
+    try:
+        Worker(Spool(spool_dir), name).serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        LogWriter.shared().stop()
+
+
+def main(args):
+    name = args.name or socket.gethostname() + '-' + str(os.getpid())
+    if args.workers < 2:
+        serve(args.spool_dir, name)
+        return
+    context = multiprocessing.get_context('fork')
+    workers = []
+    for num in range(0, args.workers):
+        worker = context.Process(target=serve,
+                                 args=(args.spool_dir, name + '-' + str(num)))
+        worker.start()
+        workers.append(worker)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('./bookmaker-worker')
+    argu = parser.add_argument_group('Required')
+    argu.add_argument('--spool-dir', required=True,
+                      help='Spool directory shared with ./bookmaker')
+
+    worker = parser.add_argument_group('Worker')
+    worker.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes to run')
+    worker.add_argument('--name', default=None,
+                        help='Worker name; restarting a worker under the same '
+                        'name requeues the tasks it left unfinished '
+                        '(default: hostname-pid)')
+
+    args = parser.parse_args()
+    main(args)
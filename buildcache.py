@@ -0,0 +1,113 @@
+import os
+import pickle
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+
+
+class BuildCache(object):
+    """ Make-style up-to-date checks for a book's component runs.
+
+        A run is keyed by a hash of its full command line (tool arguments,
+        crop box, skew angle and so on) and the contents of every existing
+        file named on it, other than its outputs. Once it has succeeded, the
+        key, the tool's output and the size and mtime of the files it wrote
+        are recorded. Running it again with the same key while those files
+        are untouched hands back the recorded output instead.
+
+        Records are kept one file per output under <identifier>_buildcache,
+        so forked children and spool workers can share the cache. A record
+        that can't be written is only logged: the run itself succeeded.
+
+        File digests are remembered for the 'max_digests' files hashed most
+        recently, over all books.
+    """
+    _digests = OrderedDict()
+    _digests_lock = Lock()
+    max_digests = 100000
+
+    def __init__(self, book):
+        self.book = book
+        self.dir = book.root_dir + '/' + book.identifier + '_buildcache'
+        os.makedirs(self.dir, exist_ok=True)
+
+    @staticmethod
+    def file_digest(path):
+        """ Content hash of a file, remembered while its size and mtime
+            stay the same.
+        """
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with BuildCache._digests_lock:
+            if path in BuildCache._digests and \
+                    BuildCache._digests[path][0] == stamp:
+                BuildCache._digests.move_to_end(path)
+                return BuildCache._digests[path][1]
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        with BuildCache._digests_lock:
+            BuildCache._digests[path] = (stamp, digest)
+            BuildCache._digests.move_to_end(path)
+            while len(BuildCache._digests) > BuildCache.max_digests:
+                BuildCache._digests.popitem(last=False)
+        return digest
+
+    def get_key(self, cmd, outputs):
+        sha1 = hashlib.sha1()
+        for arg in cmd:
+            sha1.update(arg.encode('utf-8') + b'\0')
+            if arg not in outputs and os.path.isfile(arg):
+                sha1.update(BuildCache.file_digest(arg).encode('utf-8'))
+        return sha1.hexdigest()
+
+    def _record_path(self, component, target):
+        name = hashlib.sha1((component + '\0' + target).encode('utf-8'))
+        return self.dir + '/' + name.hexdigest()
+
+    @staticmethod
+    def _stat(paths):
+        # by position rather than name, as renaming an output (tesseract's
+        # .html to .hocr) leaves it up to date
+        stats = []
+        for path in paths:
+            stat = os.stat(path)
+            stats.append((stat.st_size, stat.st_mtime_ns))
+        return stats
+
+    def lookup(self, component, target, key, outputs):
+        """ Returns the recorded output of an up-to-date run, or None. """
+        try:
+            with open(self._record_path(component, target), 'rb') as f:
+                record = pickle.load(f)
+            if record['key'] != key or \
+                    record['outputs'] != BuildCache._stat(outputs):
+                return None
+        except (OSError, IOError, EOFError, pickle.UnpicklingError):
+            return None
+        return record['output']
+
+    def store(self, component, target, key, outputs, output):
+        path = self._record_path(component, target)
+        try:
+            record = {'key': key,
+                      'outputs': BuildCache._stat(outputs),
+                      'output': output}
+        except OSError as e:
+            self.book.logger.debug('Not caching ' + component + ' run for ' +
+                                   target + '; ' + str(e))
+            return
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except OSError as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            self.book.logger.debug('Failed to cache ' + component + 
+                                   ' run for ' + target + '; ' + str(e))
@@ -0,0 +1,51 @@
+from threading import Event, Lock
+
+
+class Cancelled(Exception):
+    """ Raised in leaf work whose book was aborted, to unwind it. """
+    pass
+
+
+class CancellationToken(object):
+    """ Shared by all the work of one book. Aborting the book cancels it;
+        the work checks it between leaves and stops there, and anything
+        registered with 'on_cancel' (e.g. killing the book's tool processes)
+        runs at once.
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._event = Event()
+        self._callbacks = []
+        self._lock = Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason=None):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """ Calls 'callback' when the token is cancelled, or right away if
+            it already has been.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason if self.reason else 'Cancelled.')
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
@@ -9,6 +9,7 @@ class C44(Component):
     args = ['slice', 'size', 'bpp', 'percent', 'dpi',
             'gamma', 'decibel', 'dbfrac', 'crcb',
             'crcbdelay', 'mask', 'in_file', 'out_file']
+    outputs = ('out_file',)
 
     executable = 'c44'
 
@@ -21,11 +22,19 @@ class C44(Component):
                 self.book.identifier + '_cropped',}
         self.book.add_dirs(dirs)
         
-    def run(self, leaf, in_file=None, out_file=None, slices=None, size=None, 
-            bpp=None, percent=None, dpi=None, gamma=None, decibel=None, 
-            dbfrac=None, crcb=None, crcbnorm=None, crcbhalf=None, 
-            crcbfull=None, crcbnone=None, crcbdelay=None, mask=None,
-            **kwargs):
+    def run(self, leaf, **kwargs):
+        return self.execute(self.get_kwargs(leaf, **kwargs), 
+                            return_output=True)
+
+    async def run_async(self, leaf, **kwargs):
+        return await self.execute_async(self.get_kwargs(leaf, **kwargs), 
+                                        return_output=True)
+
+    def get_kwargs(self, leaf, in_file=None, out_file=None, slices=None,
+                   size=None, bpp=None, percent=None, dpi=None, gamma=None,
+                   decibel=None, dbfrac=None, crcb=None, crcbnorm=None,
+                   crcbhalf=None, crcbfull=None, crcbnone=None, crcbdelay=None,
+                   mask=None, **kwargs):
         leafnum = "%04d" % leaf
         if not in_file:
             in_file = (self.book.dirs['cropped'] + '/' +
@@ -80,6 +89,5 @@ class C44(Component):
                        'crcbdelay': crcbdelay,
                        'mask': mask})
 
-        output = self.execute(kwargs, return_output=True)
-        return output
+        return kwargs
 
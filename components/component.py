@@ -1,10 +1,41 @@
+import os
+import asyncio
+from threading import get_ident
+
 from events import OnEvents
 from environment import Environment
 from util import Util
+from memory import MemoryBudget
 
 class Component(OnEvents):
     """ Base Class for individual processes.
+
+        'outputs' names the arguments that are the files a component writes.
+        Components that declare them have their runs checked against the 
+        book's build cache, when it has one, and skipped while up to date.
+
+        'memory' is the peak RSS, in bytes, a run is expected to need. It
+        only seeds the memory budget's estimate until a run is measured.
+
+        A leaf a component fails on is tried again up to 'retries' times,
+        waiting 'retry_delay' seconds before the first retry and twice as
+        long before each one after, before the leaf is quarantined.
+
+        'token' is the CancellationToken of the operation using the 
+        component; once it is cancelled no more processes are started.
+
+        While the operation has a 'speculator', two attempts at a leaf can
+        run at once, so each run writes its outputs under names of its own
+        and only the first to finish is renamed into place (see 
+        get_attempt).
     """
+    outputs = ()
+    memory = None
+    retries = 2
+    retry_delay = 1.0
+    token = None
+    speculator = None
+
     def __init__(self):
         super(Component, self).__init__()
         self.exec_times = []
@@ -16,6 +47,44 @@ class Component(OnEvents):
     def execute(self, kwargs, stdout=None, stdin=None,
                 return_output=False, print_output=False,
                 current_wd=None, logger=None, hook=True):
+        cmd, stdout, stdin = self.get_cmd(kwargs, stdout, stdin)
+        output, key = self.lookup_cmd(cmd, kwargs, stdout, stdin)
+        if output is None:
+            attempt = self.get_attempt(kwargs)
+            if attempt is not None:
+                cmd = self.get_cmd(attempt, stdout, stdin)[0]
+            try:
+                output = self.spawn(cmd, stdout, stdin, return_output, 
+                                    print_output, current_wd, logger)
+            except BaseException:
+                self.discard(attempt)
+                raise
+            self.publish(kwargs, attempt, output)
+            self.store_cmd(key, kwargs, stdout, output)
+        return self.finish(kwargs, output, hook)
+
+    async def execute_async(self, kwargs, stdout=None, stdin=None,
+                            return_output=False, print_output=False,
+                            current_wd=None, logger=None, hook=True):
+        """ execute as a coroutine, for running on the SubprocessDriver. """
+        cmd, stdout, stdin = self.get_cmd(kwargs, stdout, stdin)
+        output, key = self.lookup_cmd(cmd, kwargs, stdout, stdin)
+        if output is None:
+            attempt = self.get_attempt(kwargs)
+            if attempt is not None:
+                cmd = self.get_cmd(attempt, stdout, stdin)[0]
+            try:
+                output = await self.spawn_async(cmd, stdout, stdin, 
+                                                return_output, print_output,
+                                                current_wd, logger)
+            except BaseException:
+                self.discard(attempt)
+                raise
+            self.publish(kwargs, attempt, output)
+            self.store_cmd(key, kwargs, stdout, output)
+        return self.finish(kwargs, output, hook)
+
+    def get_cmd(self, kwargs, stdout, stdin):
         cmd = [self.executable]
                         
         for arg in self.args:
@@ -38,9 +107,9 @@ class Component(OnEvents):
                     for v in value:
                         if v not in (None, '') and not (not v and isinstance(v, bool)):
                             cmd.append(str(v))        
-        output = self.Util.exec_cmd(cmd, stdout, stdin,
-                                    return_output, print_output, 
-                                    current_wd, logger)
+        return cmd, stdout, stdin
+
+    def finish(self, kwargs, output, hook):
         self.exec_times.append(output['exec_time'])        
         if hook:
             retval = output['retval']
@@ -49,6 +118,146 @@ class Component(OnEvents):
             self.event_trigger(success, **kwargs)            
         return output
 
+    def lookup_cmd(self, cmd, kwargs, stdout, stdin):
+        """ Checks the book's build cache for the run. Returns its recorded
+            output if it is up to date, or None, along with the key to 
+            store the run's output under once it is made.
+        """
+        cache = self.book.build_cache if hasattr(self, 'book') else None
+        if cache is None or not self.outputs:
+            return None, None
+        component = self.__class__.__name__
+        target = ' '.join([str(kwargs.get(name)) for name in self.outputs])
+        inputs = [item for item in cmd]
+        if stdin:
+            inputs.append(stdin)
+        key = cache.get_key(inputs, self.get_output_files(kwargs, stdout))
+        output = cache.lookup(component, target, key, 
+                              self.get_output_files(kwargs, stdout))
+        if output is not None:
+            self.book.logger.debug('%s: %s is up to date', component, target)
+            output = dict(output)
+            output['exec_time'] = 0
+        return output, key
+
+    def get_attempt(self, kwargs):
+        """ The arguments to run the tool with when attempts at a leaf may
+            race: each declared output is written next to where it belongs,
+            under a name prefixed with the attempt's thread (the tool may
+            choose a format by extension, or append one to the name). None
+            when the run writes to the real paths.
+        """
+        if self.speculator is None or not self.outputs:
+            return None
+        owner = Util.owner.get()
+        prefix = '.attempt-' + str(owner if owner is not None 
+                                   else get_ident()) + '-'
+        attempt = dict(kwargs)
+        for name in self.outputs:
+            path = kwargs.get(name)
+            if path:
+                attempt[name] = os.path.join(os.path.dirname(path), 
+                                             prefix + os.path.basename(path))
+        return attempt
+
+    def publish(self, kwargs, attempt, output):
+        """ Moves what an attempt wrote into place if its run succeeded and
+            no other attempt's run of the component with the same outputs
+            got there first; otherwise throws it away.
+        """
+        if attempt is None:
+            return
+        moves = []
+        for path in self.get_output_files(attempt):
+            for name in self.outputs:
+                if kwargs.get(name) and path.startswith(attempt[name]):
+                    final = kwargs[name] + path[len(attempt[name]):]
+                    if os.path.exists(path):
+                        moves.append((path, final))
+                    break
+        target = ' '.join([str(kwargs.get(name)) for name in self.outputs])
+        if output['retval'] != 0 or not self.speculator.publish(
+                self.__class__.__name__, target, moves):
+            self.discard(attempt)
+
+    def discard(self, attempt):
+        if attempt is None:
+            return
+        for path in self.get_output_files(attempt):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def store_cmd(self, key, kwargs, stdout, output):
+        if key is None or output['retval'] != 0:
+            return
+        target = ' '.join([str(kwargs.get(name)) for name in self.outputs])
+        self.book.build_cache.store(self.__class__.__name__, target, key, 
+                                    self.get_output_files(kwargs, stdout), 
+                                    output)
+
+    def spawn(self, cmd, stdout, stdin, return_output, print_output,
+              current_wd, logger):
+        name = self.__class__.__name__
+        budget = MemoryBudget.shared()
+        if self.memory:
+            budget.declare(name, self.memory)
+        with budget.admit(name):
+            self.check_cancelled()
+            output = self.Util.exec_cmd(cmd, stdout, stdin,
+                                        return_output, print_output, 
+                                        current_wd, logger)
+        self.learn_memory(budget, name, output)
+        self.record_usage(name, output)
+        return output
+
+    async def spawn_async(self, cmd, stdout, stdin, return_output, 
+                          print_output, current_wd, logger):
+        name = self.__class__.__name__
+        budget = MemoryBudget.shared()
+        if self.memory:
+            budget.declare(name, self.memory)
+        size = budget.acquire(name, blocking=False)
+        if size is None:
+            # only wait for room on a thread of its own, not on the loop
+            loop = asyncio.get_running_loop()
+            waiting = loop.run_in_executor(None, budget.acquire, name)
+            try:
+                size = await asyncio.shield(waiting)
+            except asyncio.CancelledError:
+                waiting.add_done_callback(
+                    lambda f: budget.release(name, f.result()))
+                raise
+        try:
+            self.check_cancelled()
+            output = await self.Util.exec_cmd_async(cmd, stdout, stdin,
+                                                    return_output, 
+                                                    print_output, 
+                                                    current_wd, logger)
+        finally:
+            budget.release(name, size)
+        self.learn_memory(budget, name, output)
+        self.record_usage(name, output)
+        return output
+
+    def check_cancelled(self):
+        if self.token is not None:
+            self.token.check()
+
+    def learn_memory(self, budget, name, output):
+        budget.learn(name, output.get('max_rss'))
+
+    def record_usage(self, name, output):
+        if hasattr(self, 'book'):
+            self.book.resource_usage.add(name, output)
+
+    def get_output_files(self, kwargs, stdout=None):
+        files = [kwargs[name] for name in self.outputs if kwargs.get(name)]
+        if stdout:
+            files.append(stdout)
+        return files
+
     def get_last_exec_time(self):
         if self.exec_times:
             return self.exec_times[-1]
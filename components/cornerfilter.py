@@ -10,6 +10,7 @@ class CornerFilter(Component):
     args = ['in_file', 'out_file',
             'l', 't', 'r', 'b',
             'thumb_width', 'thumb_height']
+    outputs = ('out_file',)
     executable = Environment.current_path + '/bin/cornerFilter/cornerFilter'
 
     def __init__(self, book):
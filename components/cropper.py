@@ -10,6 +10,9 @@ class Cropper(Component):
 
     args = ['in_file', 'rot_dir', 'skew_angle',
             'l', 't', 'r', 'b', 'out_file']
+    outputs = ('out_file',)
+    # decodes, rotates and crops a full size raw image
+    memory = 256 * 1024 * 1024
 
     executable = Environment.current_path + '/bin/cropper/./cropper'
 
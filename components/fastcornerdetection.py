@@ -8,6 +8,7 @@ class FastCornerDetection(Component):
     """
 
     args = ['t', 's', 'n', 'l', 'in_file', 'out_file']
+    outputs = ('out_file',)
     executable = (Environment.current_path +
                   '/bin/cornerDetection/./fast_' +
                   Environment.platform + '_' + Environment.architecture)
@@ -8,6 +8,7 @@ class HOCR2Pdf(Component):
 
     args = ['no_image', 'sloppy', 'resolution',
             ['-i', 'in_file'], ['-o','out_file'], 'hocr_file']
+    outputs = ('out_file',)
     executable = 'hocr2pdf'
 
     def __init__(self, book):
@@ -19,9 +20,19 @@ class HOCR2Pdf(Component):
                     self.book.identifier + '_cropped'}
         self.book.add_dirs(dirs)        
 
-    def run(self, leaf, in_file=None, out_file=None, hocr_file=None,
-            no_image=None, sloppy=None, ppi=None, resolution=None, 
-            **kwargs):
+    def run(self, leaf, **kwargs):
+        stdin = kwargs.get('hocr_file')
+        return self.execute(self.get_kwargs(leaf, **kwargs), 
+                            return_output=True, stdin=stdin)
+
+    async def run_async(self, leaf, **kwargs):
+        stdin = kwargs.get('hocr_file')
+        return await self.execute_async(self.get_kwargs(leaf, **kwargs), 
+                                        return_output=True, stdin=stdin)
+
+    def get_kwargs(self, leaf, in_file=None, out_file=None, hocr_file=None,
+                   no_image=None, sloppy=None, ppi=None, resolution=None,
+                   **kwargs):
         leafnum = '%04d' % leaf
         if not in_file:
             in_file = (self.book.dirs['cropped'] + '/' +
@@ -46,6 +57,4 @@ class HOCR2Pdf(Component):
                        'sloppy': sloppy,
                        'resolution': resolution})
         
-        stdin = hocr_file            
-        output = self.execute(kwargs, return_output=True, stdin=stdin)
-        return output
+        return kwargs
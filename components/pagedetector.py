@@ -12,6 +12,9 @@ class PageDetector(Component):
         of the input image.
     """
     args = ['in_file', 'rot_dir', 'scale_factor', 'scaled_out_file']
+    outputs = ('scaled_out_file',)
+    # decodes and scales a full size raw image
+    memory = 256 * 1024 * 1024
     executable = Environment.current_path + '/bin/pageDetector/./pageDetector'
 
     def __init__(self, book):
@@ -52,6 +55,15 @@ class PageDetector(Component):
 
     def on_success(self, **kwargs):        
         leaf, output = kwargs['leaf'], kwargs['output']
+        self.make_crops()
+        if self.book.settings['respawn']:
+            PageDetector.parse_output(leaf, output['output'], 
+                                      self.book.pageCrop, self.book.pageCropScaled,
+                                      self.book.contentCrop, self.book.contentCropScaled)
+        self.book.pageCropScaled.box[leaf] = \
+            self.book.pageCrop.scale_box(leaf, scale_factor = 4)
+
+    def make_crops(self):
         if not hasattr(self.book, 'pageCropScaled'):
             self.book.pageCropScaled = Crop('pageCrop', self.book.page_count,
                                             self.book.raw_image_dimensions,
@@ -69,11 +81,6 @@ class PageDetector(Component):
                 self.book.contentCrop = Crop('contentCrop', self.book.page_count,
                                              self.book.raw_image_dimensions,
                                              self.book.scandata)
-            PageDetector.parse_output(leaf, output['output'], 
-                                      self.book.pageCrop, self.book.pageCropScaled,
-                                      self.book.contentCrop, self.book.contentCropScaled)
-        self.book.pageCropScaled.box[leaf] = \
-            self.book.pageCrop.scale_box(leaf, scale_factor = 4)
 
     @staticmethod
     def parse_output(leaf, output, 
@@ -39,6 +39,7 @@ class SWClustering(Component):
     args = ['in_file','out_file',
             'window_width','window_height',
             'skew_angle','center_x','center_y']
+    outputs = ('out_file',)
 
     executable = Environment.current_path + '/bin/clusterAnalysis/slidingWindow/./slidingWindow'
 
@@ -155,12 +156,12 @@ class SWClustering(Component):
                     try:
                         self.book.clusters[leaf].cluster[cluster_count].draw(self.book.clusters[leaf].thumb)
                     except Exception as e:
-                        self.book.logger.debug(str(e))
+                        self.book.logger.debug('%s', e)
 
                 cluster_count += 1
             else:
-                self.book.logger.debug('cluster ' + str(num) + ' dimensions are invalid on leaf ' +
-                                  str(leaf) + '-- ignoring...')
+                self.book.logger.debug('cluster %s dimensions are invalid on leaf '
+                                       '%s-- ignoring...', num, leaf)
 
                 if self.book.settings['draw_invalid_clusters'] and self.book.settings['respawn']:
                     tmp_cluster.thumb = (self.book.dirs['cornered_scaled'] + '/' +
@@ -192,9 +193,9 @@ class SWClustering(Component):
                 if self.book.settings['draw_removed_clusters'] and self.book.settings['respawn']:
                     self.filtered_clusters[leaf].cluster[num].draw(self.book.clusters[leaf].thumb,
                                                                    outline="orange")
-                    self.book.logger.debug('noise filter removed cluster ' +
-                                           str(num) + ' ('+ str(cluster.size) +
-                                           ' corners) on leaf ' + str(leaf))
+                    self.book.logger.debug('noise filter removed cluster %s (%s '
+                                           'corners) on leaf %s', 
+                                           num, cluster.size, leaf)
                                           
 
         if cluster_count is 0:
@@ -203,7 +204,7 @@ class SWClustering(Component):
 
 
     def get_content_dimensions(self, leaf):
-        self.book.logger.debug('getting content dimensions for leaf ' + str(leaf))
+        self.book.logger.debug('getting content dimensions for leaf %s', leaf)
 
         if self.book.contentCropScaled.classification[leaf] is not 'Blank':
             l = t = r = b = None
@@ -239,7 +240,7 @@ class SWClustering(Component):
                 try:
                     self.book.contentCropScaled.box[leaf].draw(self.book.clusters[leaf].thumb, outline='green')
                 except Exception as e:
-                    self.book.logger.debug(str(e))
+                    self.book.logger.debug('%s', e)
 
     def analyse_noise(self, log='noiseAnalysis'):
         self.book.logger.debug('analysing noise...')
@@ -280,10 +281,10 @@ class SWClustering(Component):
                 (box.h in self.book.pageCropScaled.meta['h']['stats_hist']['above_mean'] or
                  box.h in self.book.pageCropScaled.meta['h']['stats_hist']['below_mean'])):
                 if leaf%2==0 and self.left_reference_leaf is None:
-                    self.book.logger.debug('left reference leaf is ' + str(leaf))
+                    self.book.logger.debug('left reference leaf is %s', leaf)
                     self.left_reference_leaf = self.book.pageCropScaled.box[leaf]
                 elif leaf%2==0 and self.right_reference_leaf is None:
-                    self.book.logger.debug('right reference leaf is ' + str(leaf))
+                    self.book.logger.debug('right reference leaf is %s', leaf)
                     self.right_reference_leaf = self.book.pageCropScaled.box[leaf]
         if self.left_reference_leaf is None and self.right_reference_leaf is None:
             self.book.logger.debug('could not find suitable reference leafs...aborting noise analysis')
@@ -315,7 +316,7 @@ class SWClustering(Component):
                             try:
                                 cluster.draw(self.book.dirs['noise'] + '/left_noise.jpg', outline='gray')
                             except Exception as e:
-                                self.book.logger.debug(str(e))
+                                self.book.logger.debug('%s', e)
                     else:
                         self.right_noise[leaf][num] = cluster
                         right['l'].append(cluster.l)
@@ -325,7 +326,7 @@ class SWClustering(Component):
                             try:
                                 cluster.draw(self.book.dirs['noise'] + '/right_noise.jpg', outline='gray')
                             except Exception as e:
-                                self.book.logger.debug(str(e))
+                                self.book.logger.debug('%s', e)
 
         left_corners = zip(left['t'], left['l'])
         left_corners = sorted(left_corners)
@@ -50,6 +50,9 @@ class Tesseract(Component):
         ('Vietnamese', 'vie')])
 
     args = ['in_file','out_base','language','psm', 'hocr']
+    outputs = ('out_base',)
+    # a page of OCR with its language data loaded
+    memory = 512 * 1024 * 1024
     executable = 'tesseract'
 
     def __init__(self, book):
@@ -61,8 +64,16 @@ class Tesseract(Component):
                     self.book.identifier + '_cropped'}
         self.book.add_dirs(dirs)
 
-    def run(self, leaf, in_file=None, out_base=None, 
-            lang='eng', psm='-psm 3', hocr='hocr', **kwargs):
+    def run(self, leaf, **kwargs):
+        return self.execute(self.get_kwargs(leaf, **kwargs), 
+                            return_output=True)
+
+    async def run_async(self, leaf, **kwargs):
+        return await self.execute_async(self.get_kwargs(leaf, **kwargs), 
+                                        return_output=True)
+
+    def get_kwargs(self, leaf, in_file=None, out_base=None, lang='eng',
+                   psm='-psm 3', hocr='hocr', **kwargs):
         leafnum = '%04d' % leaf
         if not in_file:
             in_file = (self.book.dirs['cropped'] + '/' +
@@ -83,8 +94,15 @@ class Tesseract(Component):
                        'psm': psm, 
                        'hocr': hocr})
         
-        output = self.execute(kwargs, return_output=True)
-        return output
+        return kwargs
+
+    def get_output_files(self, kwargs, stdout=None):
+        # depending on the version, tesseract writes .html or .hocr
+        base = kwargs['out_base']
+        for ext in ('.hocr', '.html'):
+            if os.path.exists(base + ext):
+                return [base + ext]
+        return [base + '.hocr']
 
     def get_hocr_files(self, start=None, end=None):
         if None in (start, end):
@@ -0,0 +1,134 @@
+import time
+from threading import Condition
+from contextlib import contextmanager
+
+
+class CPUSampler(object):
+    """ Reads system wide CPU utilization and iowait from /proc/stat, as
+        fractions of the time since the previous sample. Where there is no
+        /proc/stat both are None.
+    """
+    def __init__(self):
+        self.last = self._read()
+
+    @staticmethod
+    def _read():
+        try:
+            with open('/proc/stat', 'r') as f:
+                fields = f.readline().split()[1:]
+        except (OSError, IOError):
+            return None
+        return [int(field) for field in fields]
+
+    def sample(self):
+        current = self._read()
+        if current is None or self.last is None:
+            return None, None
+        delta = [c - l for c, l in zip(current, self.last)]
+        self.last = current
+        total = sum(delta)
+        if total <= 0:
+            return None, None
+        idle = delta[3]
+        iowait = delta[4] if len(delta) > 4 else 0
+        return 1.0 - float(idle + iowait)/total, float(iowait)/total
+
+
+class ConcurrencyController(object):
+    """ Decides how many of an operation's workers may run at once.
+
+        Every 'interval' seconds (and at least two batches per worker) the
+        leaves per second done in that window are compared with the 
+        previous window: a step that raised throughput is followed by 
+        another in the same direction, one that lowered it is reversed. 
+        When throughput is flat, CPU utilization, iowait and per-leaf 
+        latency break the tie: saturated CPUs or leaves that got slower
+        without the book getting done faster mean fewer workers, idle CPUs
+        or waiting on I/O mean more. The limit stays within 'minimum' and
+        'maximum'.
+    """
+    interval = 2.0
+    tolerance = 0.05
+
+    def __init__(self, name, minimum, maximum, initial=None, logger=None):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        if initial is None:
+            initial = self.maximum
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.logger = logger
+        self.active = 0
+        self.direction = -1
+        self.cpu = CPUSampler()
+        self.last_throughput = None
+        self.last_latency = None
+        self._reset_window()
+        self._state = Condition()
+
+    def _reset_window(self):
+        self.window_start = time.time()
+        self.window_leaves = 0
+        self.window_batches = 0
+        self.window_time = 0.0
+
+    @contextmanager
+    def running(self, leaves):
+        """ Holds one of the 'limit' places while a batch of leaves runs. """
+        with self._state:
+            while self.active >= self.limit:
+                self._state.wait()
+            self.active += 1
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            with self._state:
+                self.active -= 1
+                self.window_leaves += leaves
+                self.window_batches += 1
+                self.window_time += elapsed
+                self._adjust()
+                self._state.notify_all()
+
+    def _adjust(self):
+        now = time.time()
+        # a window needs a few batches from every worker to say anything
+        if now - self.window_start < ConcurrencyController.interval or \
+                self.window_batches < 2 * self.limit:
+            return
+        throughput = self.window_leaves / (now - self.window_start)
+        latency = self.window_time / self.window_leaves
+        busy, iowait = self.cpu.sample()
+        step = 0
+        if self.last_throughput is None:
+            step = self.direction
+        elif throughput > self.last_throughput * (1 + self.tolerance):
+            step = self.direction
+        elif throughput < self.last_throughput * (1 - self.tolerance):
+            self.direction = -self.direction
+            step = self.direction
+        elif busy is not None and busy > 0.9 and iowait < 0.1:
+            step = -1
+        elif self.last_latency is not None and \
+                latency > self.last_latency * 1.5:
+            step = -1
+        elif busy is not None and (busy < 0.7 or iowait > 0.2):
+            step = 1
+        limit = min(max(self.limit + step, self.minimum), self.maximum)
+        if limit != self.limit:
+            if self.logger:
+                self.logger.debug(self.name + ': ' +
+                                  str(round(throughput, 2)) +
+                                  ' leaves/s; running ' + str(limit) +
+                                  ' workers instead of ' + str(self.limit))
+            if step:
+                self.direction = 1 if limit > self.limit else -1
+            self.limit = limit
+        elif step:
+            # at a bound; try the other way next time
+            self.direction = -step
+        self.last_throughput = throughput
+        self.last_latency = latency
+        self._reset_window()
@@ -11,6 +11,7 @@ class ImageCapture(Operation):
     
     components = [('gphoto2', 'Gphoto2'),
                   ('raw2thumb', 'Raw2Thumb')]
+    leaf_components = ()
                   
     def __init__(self, ProcessHandler, book):
         self.ProcessHandler = ProcessHandler
@@ -24,7 +24,7 @@ class Crop(Operation):
         if None in (start, end):
             start, end = 0, self.book.page_count
         for leaf in range(start, end):
-            self.book.logger.debug('Cropping leaf ' + str(leaf))
+            self.book.logger.debug('Cropping leaf %s', leaf)
             try:
                 self.Cropper.run(leaf, **kwargs)
             except (Exception, BaseException):
@@ -47,14 +47,15 @@ class PDF(Operation):
             start, end = 1, self.book.page_count-1
         hocr_files = tesseract.get_hocr_files(start, end)
         dummy_hocr = self.book.dirs['derived'] + '/html.hocr'
+        calls = []
         for leaf in range(start, end):
-            self.book.logger.debug('hocr2pdf: leaf ' + str(leaf))
+            self.book.logger.debug('hocr2pdf: leaf %s', leaf)
             leafnum = '%04d' % leaf
             if leaf in hocr_files:
                 hocr = hocr_files[leaf]
-                self.book.logger.debug('found hocr: leaf ' + str(leaf))
+                self.book.logger.debug('found hocr: leaf %s', leaf)
             else:
-                self.book.logger.debug('dummy hocr: leaf ' + str(leaf))
+                self.book.logger.debug('dummy hocr: leaf %s', leaf)
                 if not os.path.exists(dummy_hocr):
                     hocr = open(dummy_hocr, 'w')
                     hocr.write('<html/>')
@@ -64,25 +65,26 @@ class PDF(Operation):
             out_file = self.book.dirs['derived'] + '/' + \
                 self.book.identifier + '_' + leafnum + '.pdf'
             
-            kwargs.update({'hocr_file': hocr,
-                           'out_file': out_file})
-            try:
-                self.HOCR2Pdf.run(leaf, **kwargs)
-            except (Exception, BaseException):
-                raise
-            else:
-                exec_time = self.HOCR2Pdf.get_last_exec_time()
-                self.complete_process('HOCR2Pdf', leaf, exec_time)                
-            if not os.path.exists(out_file):
-                raise OSError('cannot make pdf: failed to create ' + out_file)
+            leaf_kwargs = dict(kwargs)
+            leaf_kwargs.update({'hocr_file': hocr,
+                                'out_file': out_file})
+            calls.append((leaf, leaf_kwargs))
+        self.run_concurrently('HOCR2Pdf', calls)
+        for leaf, leaf_kwargs in calls:
+            if not os.path.exists(leaf_kwargs['out_file']):
+                raise OSError('cannot make pdf: failed to create ' + 
+                              leaf_kwargs['out_file'])
+
+    def on_success(self, *args, **kwargs):
+        self.assemble_pdf_with_pypdf(**kwargs)
+        # the dummy hocr is shared by every chunk, so it is only removed 
+        # once all of them are done
+        dummy_hocr = self.book.dirs['derived'] + '/html.hocr'
         if os.path.exists(dummy_hocr):
             try:
                 os.remove(dummy_hocr)
             except OSError as e:
                 self.book.logger.warning('Failed to remove dummy hocr; ' + str(e))
-
-    def on_success(self, *args, **kwargs):
-        self.assemble_pdf_with_pypdf(**kwargs)
             
     def assemble_pdf_with_pypdf(self, **kwargs):
         self.book.logger.debug('assembling pdf with pypdf')
@@ -91,7 +93,7 @@ class PDF(Operation):
                             if re.search('_[0-9]+.pdf$', p)])
         pdf_out = PdfFileWriter()
         for pdf_file in pdf_files:
-            self.book.logger.debug('pypdf adding ' + pdf_file)
+            self.book.logger.debug('pypdf adding %s', pdf_file)
             pdf_page = PdfFileReader(open(pdf_file, 'rb'))
             pdf_out.addPage(pdf_page.getPage(0))
             try:
@@ -113,6 +115,9 @@ class Djvu(Operation):
     components = [('c44', 'C44'),
                   ('djvused', 'Djvused'),
                   ('djvm', 'Djvm')]
+    # leaves without OCR never get through Djvused, and are redone when
+    # a run is resumed
+    leaf_components = ('C44', 'Djvused')
                   
     def __init__(self, ProcessHandler, book):
         self.ProcessHandler = ProcessHandler
@@ -142,45 +147,37 @@ class Djvu(Operation):
     def c44_pipeline(self, start=None, end=None, **kwargs):
         if None in (start, end):
             start, end = 1, self.book.page_count-1
-        for leaf in range(start, end):
-            try:
-                self.C44.run(leaf, **kwargs)
-            except (Exception, BaseException):
-                raise
-            else:
-                exec_time = self.C44.get_last_exec_time()
-                self.complete_process('C44', leaf, exec_time)
+        self.run_concurrently('C44', [(leaf, dict(kwargs)) 
+                                      for leaf in range(start, end)])
         
     def djvused_add_ocr_pipeline(self, start=None, end=None, **kwargs):
         tesseract = Tesseract(self.book)
         if None in (start, end):
             start, end = 1, self.book.page_count-1
         hocr_files = tesseract.get_hocr_files()
-        self.tmpocrlisp = self.book.dirs['derived'] + '/tmpocrlisp.txt'
-        self.set_text = self.book.dirs['derived'] +"/set_text"
         for leaf in range(start, end):
             if leaf in hocr_files:
                 hocr = tesseract.parse_hocr(hocr_files[leaf])        
                 if hocr is None:
                     continue
-                self.book.logger.debug('djvused: leaf ' + str(leaf))
+                self.book.logger.debug('djvused: leaf %s', leaf)
                 ocrlisp = Tesseract.hocr2lisp(hocr)
-                
+                # leaves are handled concurrently, so each gets its own
+                # scratch files
+                leafnum = '%04d' % leaf
+                tmpocrlisp = (self.book.dirs['derived'] + '/tmpocrlisp_' + 
+                              leafnum + '.txt')
+                set_text = self.book.dirs['derived'] + '/set_text_' + leafnum
                 try:
-                    with open(self.tmpocrlisp, 'w') as f:
+                    with open(tmpocrlisp, 'w') as f:
                         f.write(ocrlisp)
+                    with open(set_text, 'w') as f:
+                        f.write("select 1; set-txt " + tmpocrlisp + "; save")
                 except IOError:
                     raise
 
-                if not os.path.exists(self.set_text):
-                    try:
-                        with open(self.set_text, 'w') as f:
-                            f.write("select 1; set-txt " + self.tmpocrlisp + "; save")
-                    except IOError:
-                        raise
-
                 kwargs.update({'options': '-f',
-                               'script': self.set_text})                
+                               'script': set_text})                
                 try:
                     self.Djvused.run(leaf, **kwargs)
                 except (Exception, BaseException):
@@ -188,6 +185,14 @@ class Djvu(Operation):
                 else:
                     exec_time = self.Djvused.get_last_exec_time()
                     self.complete_process('Djvused', leaf, exec_time)
+                finally:
+                    for f in (tmpocrlisp, set_text):
+                        try:
+                            if os.path.exists(f):
+                                os.remove(f)
+                        except OSError as e:
+                            self.book.logger.warning('Failed to remove ' + 
+                                                     f + '; ' + str(e))
 
     def on_success(self, *args, **kwargs):
         self.assemble_djvu_with_djvm(**kwargs)
@@ -204,20 +209,14 @@ class Djvu(Operation):
             exec_time = self.Djvm.get_last_exec_time()
             self.complete_process('Djvm', range(1, self.book.page_count-1), 
                                   exec_time)
-        finally:
-            for f in (self.tmpocrlisp, self.set_text):
-                try:
-                    if os.path.exists(f):
-                        os.remove(f)
-                except OSError as e:
-                    self.book.logger.warning('Failed to remove ' + 
-                                             f + '; ' + str(e))
 
 
 class PlainText(Operation):
     """ Handles Plain-text creation 
     """
     components = [('tesseract', 'Tesseract')]
+    # already skips OCR for leaves that have hocr
+    leaf_components = ()
 
     def __init__(self, ProcessHandler, book):
         self.ProcessHandler = ProcessHandler
@@ -246,15 +245,20 @@ class PlainText(Operation):
                 end = self.book.page_count-1
         files = self.Tesseract.get_hocr_files(start, end)
         if not files:
-            for leaf in range(start, end):
-                self.Tesseract.run(leaf, **kwargs)
-                exec_time = self.Tesseract.get_last_exec_time()
-                self.complete_process('Tesseract', leaf, exec_time)
+            self.run_concurrently('Tesseract', [(leaf, dict(kwargs)) 
+                                                for leaf in range(start, end)])
             files = self.Tesseract.get_hocr_files(start, end)
         else:
             self.complete_process('Tesseract', range(1, self.book.page_count), 0)
         self.files.update(files)
 
+    def get_leaf_state(self, leaf):
+        return {'file': self.files.get(leaf)}
+
+    def set_leaf_state(self, leaf, state):
+        if state['file'] is not None:
+            self.files[leaf] = state['file']
+
     def on_success(self, *args, **kwargs):
         self.assemble_ocr_text()
         
@@ -288,6 +292,8 @@ class EPUB(Operation):
     """    
     components = [('cropper', 'Cropper'),
                   ('tesseract', 'Tesseract')]
+    # already skips OCR for leaves that have hocr
+    leaf_components = ()
                               
     def __init__(self, ProcessHandler, book):
         self.ProcessHandler = ProcessHandler
@@ -302,7 +308,8 @@ class EPUB(Operation):
     
     def make_epub(self, **kwargs):
         self.book.logger.info('Creating EPUB...')
-        self.parsed_hocr = {}
+        self.hocr_text = {}
+        self.hocr_files = {}
         self.get_parsed_hocr(**kwargs)
 
     @Operation.multithreaded
@@ -311,15 +318,33 @@ class EPUB(Operation):
             start, end = 1, self.book.page_count-1
         files = self.Tesseract.get_hocr_files(start, end)
         if not files:
-            for leaf in range(start, end):
-                self.Tesseract.run(leaf, **kwargs)
-                exec_time = self.Tesseract.get_last_exec_time()
-                self.complete_process('Tesseract', leaf, exec_time)
+            self.run_concurrently('Tesseract', [(leaf, dict(kwargs)) 
+                                                for leaf in range(start, end)])
             files = self.Tesseract.get_hocr_files(start, end)
         else:
             self.complete_process('Tesseract', range(1, self.book.page_count), 0)
         for leaf, f in files.items():
-            self.parsed_hocr[leaf] = self.Tesseract.parse_hocr(f)
+            self.hocr_files[leaf] = f
+            self.hocr_text[leaf] = EPUB.get_text(self.Tesseract.parse_hocr(f))
+
+    @staticmethod
+    def get_text(page):
+        """ The words of a parsed hocr page, as lists of paragraphs of 
+            lines; unlike the tree, this can be sent back from a child.
+        """
+        if page is None:
+            return []
+        return [[[word.text for word in line.words] for line in par.lines]
+                for par in page.paragraphs]
+
+    def get_leaf_state(self, leaf):
+        return {'hocr_file': self.hocr_files.get(leaf),
+                'text': self.hocr_text.get(leaf)}
+
+    def set_leaf_state(self, leaf, state):
+        if state['hocr_file'] is not None:
+            self.hocr_files[leaf] = state['hocr_file']
+            self.hocr_text[leaf] = state['text']
 
     def hocr_to_epub(self, hocr):        
         main_doc = etree.Element('html')
@@ -333,13 +358,13 @@ class EPUB(Operation):
                     pdiv = etree.SubElement(body, 'div')
                     pdiv.set('class', 'newpage')
                     pdiv.set('id', 'page-'+str(pagination))
-            for par in page.paragraphs:
+            for par in page:
                 p = etree.SubElement(body, 'p')
                 text = []
-                for line in par.lines:
-                    for word in line.words:
-                        if word.text:
-                            text.append(word.text.lstrip('"').rstrip('"'))
+                for line in par:
+                    for word in line:
+                        if word:
+                            text.append(word.lstrip('"').rstrip('"'))
                 p.text = " ".join(text)
         tree = etree.ElementTree(main_doc)
         try:
@@ -386,7 +411,7 @@ class EPUB(Operation):
                 os.mkdir(OEBPS_dir, 0o755)
             except OSError:
                 self.join()
-        self.hocr_to_epub(self.parsed_hocr)
+        self.hocr_to_epub(self.hocr_text)
 
     def create_opf(self):
         doc = etree.Element('package')
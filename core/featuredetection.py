@@ -16,6 +16,8 @@ class FeatureDetection(Operation):
     components = [('pagedetector', 'PageDetector'),
                   ('fastcornerdetection', 'FastCornerDetection'),
                   ('swclustering', 'SWClustering')]
+    # noise analysis and the standard crop need every leaf
+    barrier = True
 
     def __init__(self, ProcessHandler, book):
         self.ProcessHandler = ProcessHandler
@@ -23,8 +25,17 @@ class FeatureDetection(Operation):
         try:
             super(FeatureDetection, self).__init__(FeatureDetection.components)
             self.init_components(self.book)
-            if self.book.settings['respawn']:
+            # a worker's book shares its directories with the one being
+            # processed, which has already cleaned them; resumed and 
+            # incremental runs need the outputs of the leaves they won't redo
+            if self.book.settings['respawn'] and \
+                    self.book.stage != 'worker' and \
+                    not self.ProcessHandler.resume and \
+                    not self.ProcessHandler.incremental:
                 self.book.clean_dirs()
+                journal = self.ProcessHandler.get_journal(self.book)
+                if journal is not None:
+                    journal.restart()
             #self.book.init_scandata()
             #self.book.init_crops(strict=True)            
         except (Exception, BaseException) as e:
@@ -35,8 +46,8 @@ class FeatureDetection(Operation):
         if None in (start, end):
             start, end = 0, self.book.page_count
         for leaf in range(start, end):
-            self.book.logger.debug('...leaf ' + str(leaf) + ' of ' +
-                                   str(self.book.page_count) + '...')                             
+            self.book.logger.debug('...leaf %s of %s...', 
+                                   leaf, self.book.page_count)
             leaf_exec_time = 0
             for component in self.components:
                 cls = component.__class__.__name__
@@ -48,15 +59,36 @@ class FeatureDetection(Operation):
                     self.join()
                 else:
                     self.complete_process(cls, leaf, leaf_exec_time)
-                    self.book.logger.debug(
-                        'leaf {} completed {}: {} Seconds'.\
-                            format(leaf, 
-                                   str(component.__class__.__name__),
-                                   str(round(exec_time, 3)) ))                    
-            self.book.logger.debug('Finished FeatureDetection processing leaf ' + 
-                                   str(leaf) + ' in ' + str(round(leaf_exec_time, 3)) + 
-                                   ' Seconds')
+                    self.book.logger.debug('leaf %s completed %s: %.3f Seconds',
+                                           leaf, cls, exec_time)
+            self.book.logger.debug('Finished FeatureDetection processing leaf '
+                                   '%s in %.3f Seconds', leaf, leaf_exec_time)
                              
+    leaf_crops = ('pageCrop', 'pageCropScaled', 
+                  'contentCrop', 'contentCropScaled')
+
+    def get_leaf_state(self, leaf):
+        state = {'crops': {}}
+        for name in FeatureDetection.leaf_crops:
+            if hasattr(self.book, name):
+                state['crops'][name] = \
+                    getattr(self.book, name).get_leaf_state(leaf)
+        state['corner_data'] = self.book.corner_data.get(leaf)
+        state['clusters'] = self.book.clusters.get(leaf)
+        state['filtered_clusters'] = self.SWClustering.filtered_clusters.get(leaf)
+        return state
+
+    def set_leaf_state(self, leaf, state):
+        self.PageDetector.make_crops()
+        for name, crop_state in state['crops'].items():
+            getattr(self.book, name).set_leaf_state(leaf, crop_state)
+        if state['corner_data'] is not None:
+            self.book.corner_data[leaf] = state['corner_data']
+        if state['clusters'] is not None:
+            self.book.clusters[leaf] = state['clusters']
+        if state['filtered_clusters'] is not None:
+            self.SWClustering.filtered_clusters[leaf] = state['filtered_clusters']
+
     def on_success(self, *args, **kwargs):
         self.SWClustering.analyse_noise()
         if self.book.settings['respawn']:
@@ -24,15 +24,8 @@ class OCR(Operation):
     def tesseract_hocr_pipeline(self, start=None, end=None, **kwargs):
         if None in (start, end):
             start, end = 1, self.book.page_count-1
-        for leaf in range(start, end):
-            #if page is blank, we skip ocr on it
-            #if not self.book.contentCrop.box[leaf].is_valid():
-            #    self.complete_process(leaf, None)
-            #    continue            
-            try:
-                self.Tesseract.run(leaf, **kwargs)
-            except (Exception, BaseException):
-                self.join()
-            else:
-                exec_time = self.Tesseract.get_last_exec_time()
-                self.complete_process('Tesseract', leaf, exec_time)
+        try:
+            self.run_concurrently('Tesseract', [(leaf, dict(kwargs)) 
+                                                for leaf in range(start, end)])
+        except (Exception, BaseException):
+            self.join()
@@ -1,16 +1,64 @@
+import os
 import inspect
+import functools
+import multiprocessing
+import concurrent.futures
 from copy import copy
+from queue import Queue, Empty
+from threading import local, get_ident
 
+import registry
 from events import OnEvents, handle_events
 from util import Util
+from memory import MemoryBudget
+from driver import SubprocessDriver
+from usage import ResourceUsage
+from cancellation import CancellationToken, Cancelled
+from speculation import Speculator
+from logwriter import LogWriter
 
 
 class Operation(OnEvents):
     """ Base Class for processing operations.
+
+        'barrier' marks an operation whose on_success does book-wide work
+        that later operations depend on; when queues are drained in 'stream'
+        mode, leaves can't flow past it into the next operation.
+
+        'leaf_components' names the components that must all have completed
+        a leaf for the operation to be done with it; None means all of its
+        components. Finished leaves are recorded in the book's journal and 
+        skipped when a run is resumed. Operations that set it to an empty 
+        tuple aren't journaled.
+
+        'priority' is the scheduling lane of the operation's leaf work (see
+        FairShare); it is set when the operation is queued.
+
+        A leaf range whose work fails is redone a leaf at a time; a leaf
+        that keeps failing is retried as its failing component's 'retries'
+        and 'retry_delay' allow (see Component) and then quarantined: it is
+        recorded in 'quarantined' and the scandata, and the rest of the
+        book carries on without it.
+
+        'token' is the book's CancellationToken. Cancelling it terminates 
+        the process groups of the operation's running tools and forked 
+        children; leaf work checks it before each range and after each leaf,
+        and once it is cancelled unwinds quietly (see 'join') instead of 
+        reporting the errors its killed tools cause.
     """
+    barrier = False
+    leaf_components = None
+    priority = 0
+
     def __init__(self, components):
         super(Operation, self).__init__()
         self._import_components(components)        
+        self._child_procs = set()
+        self._in_child = False
+        self.journal = None
+        self.token = CancellationToken()
+        self.speculator = None
+        self._local = local()
         self.init_bookkeeping()
                            
     def init_bookkeeping(self):
@@ -20,6 +68,7 @@ class Operation(OnEvents):
         """
         self.thread_count = 0
         self.completed = {'__finished__': False}
+        self.quarantined = {}
         self.aborted = False
         self.exec_times = {}
         for component in self.imports:
@@ -31,17 +80,31 @@ class Operation(OnEvents):
         self.components = []
         for component in self.imports:
             cls = component[1]
-            instance = getattr(globals()[cls], cls)(book)
+            instance = registry.components.get(cls)(book)
+            instance.token = self.token
             self.components.append(instance)
             setattr(self, cls, instance)
 
+    def set_token(self, token):
+        if token is not self.token:
+            # the tools running when the book is aborted are killed at once
+            token.on_cancel(self.terminate_child_processes)
+        self.token = token
+        for component in getattr(self, 'components', []):
+            component.token = token
+
+    def set_speculator(self, speculator):
+        self.speculator = speculator
+        for component in getattr(self, 'components', []):
+            component.speculator = speculator
+
     def _import_components(self, components):
-        self.imports = []
-        for component in components:
-            mod, cls = component
-            globals()[cls] = __import__('components.'+mod,
-                                        globals(), locals(),
-                                        [cls,], 0)
+        """ Registers where the components are found, unless a plugin 
+            already did; the registry imports them on first use.
+        """
+        for mod, cls in components:
+            registry.components.register(cls, 'components.' + mod, 
+                                         replace=False)
         self.imports = components
 
     def _get_chunk(self, threads, pagecount, chunk):
@@ -64,23 +127,421 @@ class Operation(OnEvents):
                     args = [args, ]
             if not kwargs:
                 kwargs = {}
+            # a range can be given to redo just some leaves, e.g. one spread
+            first = kwargs.pop('start', None)
+            last = kwargs.pop('end', None)
+            if first is None:
+                first = 0
+            if last is None:
+                last = self.book.page_count
             queue = self.ProcessHandler.new_queue()
-            self.thread_count = self.ProcessHandler.min_threads
+            self.thread_count = min(self.ProcessHandler.min_threads, 
+                                    max(1, last - first))
             self.book.start_time = Util.microseconds()
+            progress = self.ProcessHandler.progress
+            progress.start(self, last - first)
+            executor = leaf_executor = self._get_executor(f)
+            if self.ProcessHandler.scheduling == 'dynamic' or \
+                    self.ProcessHandler.adaptive:
+                batches = self._get_batches(last, 
+                                            self.ProcessHandler.batch_size,
+                                            first)
+                self.thread_count = min(self.thread_count, batches.qsize())
+                controller = self.ProcessHandler.get_controller(
+                    self, self.thread_count)
+                executor = self._get_worker(executor, batches, controller)
+            self.set_speculator(None)
+            if self.ProcessHandler.speculate and \
+                    self.ProcessHandler.executor == 'thread':
+                self.set_speculator(Speculator(self))
+                executor = self._get_speculating(executor, leaf_executor)
             for chunk in range(0, self.thread_count):
-                start, end = self._get_chunk(self.thread_count, self.book.page_count, chunk)
-                kwargs['start'], kwargs['end'] = start, end
+                start, end = self._get_chunk(self.thread_count, last - first, chunk)
+                kwargs['start'], kwargs['end'] = first + start, first + end
                 queue.add(self.book, self.__class__.__name__+'.'+str(chunk), 
-                          f, args, copy(kwargs))    
-            queue.drain(mode='async')
+                          executor, args, copy(kwargs))    
+            # the book's own queue reports on it once this is done
+            try:
+                queue.drain(mode='async', report=False)
+            finally:
+                progress.finish(self)
+            # an aborted book's assembly steps don't run
+            self.token.check()
+        distribute.leafwise = f
         return distribute
 
+    @staticmethod
+    def stream(stages):
+        """ Runs the multithreaded methods of several operations on one book 
+            as a single per-leaf pipeline: each batch of leaves is taken 
+            through every stage in turn before the worker pulls the next one,
+            so a leaf can be OCR'd as soon as it has been cropped. The 
+            operations' on_success (assembly) steps run once all leaves are 
+            through, in queue order.
+
+            stages is a list of (operation, function, kwargs) tuples, where 
+            function is the undecorated leaf range method.
+        """
+        first = stages[0][0]
+        ProcessHandler, book = first.ProcessHandler, first.book
+        thread_count = ProcessHandler.min_threads
+        batches = first._get_batches(book.page_count, ProcessHandler.batch_size)
+        thread_count = min(thread_count, batches.qsize())
+        for op, f, kwargs in stages:
+            op.thread_count = thread_count
+            ProcessHandler.progress.start(op, book.page_count)
+        book.start_time = Util.microseconds()
+
+        def stream_leaves():
+            while not [op for op, f, kwargs in stages 
+                       if op.aborted or op.token.cancelled]:
+                try:
+                    start, end = batches.get_nowait()
+                except Empty:
+                    return
+                for op, f, kwargs in stages:
+                    executor = op._get_executor(f)
+                    executor(op, start=start, end=end, **kwargs)
+
+        queue = ProcessHandler.new_queue()
+        for chunk in range(0, thread_count):
+            queue.add(book, first.__class__.__name__+'.'+str(chunk),
+                      stream_leaves)
+        try:
+            queue.drain(mode='async', report=False)
+            first.token.check()
+        except (Exception, BaseException):
+            for op, f, kwargs in stages:
+                op.call_failure_hooks(**kwargs)
+                op.on_exit(**kwargs)
+                op.call_exit_hooks(**kwargs)
+            raise
+        finally:
+            for op, f, kwargs in stages:
+                op.thread_count = 0
+                ProcessHandler.progress.finish(op)
+        for op, f, kwargs in stages:
+            op.event_trigger(True, **kwargs)
+
+    def _get_batches(self, pagecount, size, first=0):
+        batches = Queue()
+        for start in range(first, pagecount, size):
+            batches.put((start, min(start + size, pagecount)))
+        return batches
+
+    def _get_worker(self, f, batches, controller=None):
+        """ With 'dynamic' scheduling each chunk thread becomes a worker that 
+            keeps pulling the next batch of leaves from a queue shared by all
+            the operation's threads, so slow leaves don't leave one thread
+            finishing long after the rest. A controller, if given, limits how
+            many of them run a batch at once.
+        """
+        @functools.wraps(f)
+        def pull_batches(*args, **kwargs):
+            while not self.aborted and not self.token.cancelled:
+                try:
+                    start, end = batches.get_nowait()
+                except Empty:
+                    return
+                kwargs['start'], kwargs['end'] = start, end
+                if controller is None:
+                    f(*args, **kwargs)
+                else:
+                    with controller.running(end - start):
+                        f(*args, **kwargs)
+        return pull_batches
+
+    def _get_speculating(self, f, leaf_executor):
+        """ Once the thread's own leaves are done it stays on to start
+            another attempt at any straggler the Speculator finds while a 
+            slot is free, until the other threads are done too.
+        """
+        slots = self.ProcessHandler.slots
+        @functools.wraps(f)
+        def speculate(*args, **kwargs):
+            f(*args, **kwargs)
+            while not self.aborted and not self.token.cancelled:
+                leaf = self.speculator.pick() if slots.idle() else None
+                if leaf is None:
+                    if not self.speculator.busy():
+                        return
+                    self.token.wait(self.speculator.interval)
+                    continue
+                kwargs['start'], kwargs['end'] = leaf, leaf + 1
+                self._local.speculative = True
+                try:
+                    leaf_executor(*args, **kwargs)
+                finally:
+                    self._local.speculative = False
+        return speculate
+
+    def _get_executor(self, f):
+        """ Returns what each chunk thread will run. With the 'process' 
+            executor the chunk runs in a forked child, so its Python-side
+            work isn't serialized on the GIL; the thread only waits for the
+            child and merges the leaf state it sends back.
+
+            Either way the chunk holds one of the ProcessHandler's shared 
+            slots while it runs, which is what bounds and fair-shares the 
+            work of books processed at the same time.
+        """
+        slots = self.ProcessHandler.slots
+        if self.ProcessHandler.executor == 'process':
+            run = functools.partial(self._run_in_process, f)
+        elif self.ProcessHandler.executor == 'spool':
+            run = lambda args, kwargs: self._run_on_worker(f, kwargs)
+        else:
+            run = lambda args, kwargs: f(*args, **kwargs)
+        def run_leaves(args, kwargs):
+            self.token.check()
+            with slots.slot(self.book.identifier, self.priority):
+                self.token.check()
+                # failures are handed back here rather than reported
+                self._local.leaf_work = True
+                if self.speculator is not None:
+                    self.speculator.begin(kwargs['start'], kwargs['end'])
+                try:
+                    run(args, copy(kwargs))
+                finally:
+                    self._local.leaf_work = False
+                    if self.speculator is not None:
+                        self.speculator.end()
+        @functools.wraps(f)
+        def execute(*args, **kwargs):
+            try:
+                for start, end in self.get_pending_ranges(kwargs['start'], 
+                                                          kwargs['end']):
+                    kwargs['start'], kwargs['end'] = start, end
+                    try:
+                        run_leaves(args, kwargs)
+                    except Cancelled:
+                        raise
+                    except Exception as e:
+                        if getattr(self._local, 'speculative', False):
+                            # the first attempt is still at it (or won)
+                            self.book.logger.debug(
+                                self.__class__.__name__ + ': extra attempt '
+                                'at leaf ' + str(start) + ' ended; ' + str(e))
+                            continue
+                        self.retry_leaves(run_leaves, args, kwargs, 
+                                          start, end)
+            except Cancelled:
+                self.book.logger.debug(self.__class__.__name__ + 
+                                       ': stopped leaf work; ' + 
+                                       str(self.token.reason))
+        return execute
+
+    def retry_leaves(self, run_leaves, args, kwargs, start, end):
+        """ Redoes the unfinished leaves of a range that failed one by one, 
+            with backoff, quarantining those that fail every time.
+        """
+        for leaf in range(start, end):
+            attempt = 0
+            while not self.is_leaf_done(leaf):
+                kwargs['start'], kwargs['end'] = leaf, leaf + 1
+                try:
+                    run_leaves(args, kwargs)
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    cls = self.get_failed_component(leaf)
+                    component = getattr(self, cls, None) if cls else None
+                    retries = getattr(component, 'retries', 0)
+                    if attempt >= retries:
+                        self.quarantine(leaf, cls, e)
+                        break
+                    delay = getattr(component, 'retry_delay', 0) * 2**attempt
+                    attempt += 1
+                    self.book.logger.warning(
+                        self.__class__.__name__ + ': ' + str(cls) + 
+                        ' failed on leaf ' + str(leaf) + ' (' + str(e) + 
+                        '); retry ' + str(attempt) + ' of ' + str(retries) + 
+                        ' in ' + str(delay) + 's')
+                    self.token.wait(delay)
+                    self.token.check()
+                else:
+                    break
+
+    def get_failed_component(self, leaf):
+        for cls in self.get_leaf_components():
+            if leaf not in self.completed.get(cls, {}):
+                return cls
+        return None
+
+    def quarantine(self, leaf, cls, exception):
+        self.quarantined[leaf] = (cls, str(exception))
+        self.book.logger.error(self.__class__.__name__ + ': quarantined leaf ' +
+                               str(leaf) + ' after ' + str(cls) + 
+                               ' kept failing; ' + str(exception))
+        if self._in_child:
+            # the parent records it when the result is merged
+            return
+        try:
+            self.book.scandata.quarantine_leaf(leaf, self.__class__.__name__,
+                                               cls, str(exception))
+        except Exception as e:
+            self.book.logger.warning('Failed to record quarantined leaf ' + 
+                                     str(leaf) + ' in scandata; ' + str(e))
+
+    def get_pending_ranges(self, start, end):
+        """ Splits a leaf range into the runs of leaves that still need to be
+            done; only leaves restored from the journal are ever done here.
+        """
+        ranges = []
+        for leaf in range(start, end):
+            if self.is_leaf_done(leaf):
+                continue
+            if ranges and ranges[-1][1] == leaf:
+                ranges[-1][1] = leaf + 1
+            else:
+                ranges.append([leaf, leaf + 1])
+        return [tuple(r) for r in ranges]
+
+    def _run_in_process(self, f, args, kwargs):
+        context = multiprocessing.get_context('fork')
+        reader, writer = context.Pipe(duplex=False)
+        child = context.Process(target=self._process_target,
+                                args=(writer, f, args, kwargs))
+        child.daemon = True
+        child.start()
+        writer.close()
+        self._child_procs.add(child)
+        try:
+            result = reader.recv()
+        except EOFError:
+            result = {'completed': {}, 'leaves': {},
+                      'exception': ('Child process ' + str(child.pid) + 
+                                    ' exited unexpectedly.', '')}
+        finally:
+            reader.close()
+            child.join()
+            self._child_procs.discard(child)
+        self._merge_result(f, result)
+
+    def _run_on_worker(self, f, kwargs):
+        """ Hands the chunk to whichever bookmaker-worker claims it from the
+            spool and waits for the result. If the operation is aborted 
+            before a worker picked the task up, it is withdrawn.
+        """
+        spool = self.ProcessHandler.spool
+        name = spool.submit(self.make_task(f, kwargs))
+        result = spool.collect(name, lambda: not self.aborted)
+        if result is None:
+            spool.cancel(name)
+            return
+        self._merge_result(f, result)
+
+    def make_task(self, f, kwargs):
+        """ Describes a chunk of leaf work so that a worker with access to 
+            the same book directory can redo the setup and run it. Once an
+            operation with a 'barrier' has finished, the crops it exported 
+            to the scandata are what the rest of the book's work relies on, 
+            so the worker imports them rather than starting fresh.
+        """
+        operations = self.ProcessHandler.OperationObjects.get(
+            self.book.identifier, {})
+        import_crops = bool([op for op in operations.values() 
+                             if op.barrier and op.completed['__finished__']])
+        if import_crops:
+            # the worker reads them from the file
+            self.book.scandata.flush()
+        return {'root_dir': self.book.root_dir,
+                'settings': dict(self.book.settings),
+                'operation': self.__class__.__name__,
+                'method': f.__name__,
+                'kwargs': kwargs,
+                'import_crops': import_crops,
+                'incremental': self.ProcessHandler.incremental}
+
+    def _merge_result(self, f, result):
+        self.merge_process_result(result)
+        MemoryBudget.shared().learn_all(result.get('memory', {}))
+        self.book.resource_usage.merge(result.get('usage', {}))
+        self.token.check()
+        if result['exception']:
+            message, tb = result['exception']
+            if self.in_leaf_work():
+                self.book.logger.debug(tb)
+                raise RuntimeError(message)
+            pid = self.make_pid_string(f.__name__)
+            self.ProcessHandler.join((pid, (RuntimeError(message), tb)))
+
+    def _process_target(self, writer, f, args, kwargs):
+        """ Runs in the forked child. """
+        # lead a process group, with the tools run here in it, so the 
+        # parent can kill the lot
+        os.setpgid(0, 0)
+        Util.new_sessions = False
+        result = self.run_leaves(f, args, kwargs)
+        # the child exits without running atexit
+        LogWriter.shared().flush()
+        try:
+            writer.send(result)
+        except (Exception, BaseException):
+            exception, tb = Util.exception_info()
+            writer.send({'completed': result['completed'], 'leaves': {},
+                         'exception': (str(exception), tb)})
+        finally:
+            writer.close()
+
+    def run_leaves(self, f, args, kwargs):
+        """ Runs a chunk away from the parent (in a forked child or on a 
+            worker) and returns what the parent needs to merge back. 
+            Bookkeeping is reset first so only the work done here is sent.
+        """
+        self._in_child = True
+        self.init_bookkeeping()
+        self.book.resource_usage = ResourceUsage()
+        result = {'completed': {}, 'leaves': {}, 'exception': None}
+        try:
+            f(*args, **kwargs)
+        except (Exception, BaseException):
+            exception, tb = Util.exception_info()
+            result['exception'] = (str(exception), tb)
+        for cls, leaves in self.completed.items():
+            if cls != '__finished__':
+                result['completed'][cls] = leaves
+        for leaf in range(kwargs['start'], kwargs['end']):
+            result['leaves'][leaf] = self.get_leaf_state(leaf)
+        result['memory'] = dict(MemoryBudget.shared().estimates)
+        result['usage'] = self.book.resource_usage.get()
+        result['quarantined'] = dict(self.quarantined)
+        return result
+
+    def merge_process_result(self, result):
+        for leaf, state in result['leaves'].items():
+            if state:
+                self.set_leaf_state(leaf, state)
+        for cls, leaves in result['completed'].items():
+            for leaf, exec_time in leaves.items():
+                self.complete_process(cls, leaf, exec_time)
+        for leaf, (cls, reason) in result.get('quarantined', {}).items():
+            self.quarantine(leaf, cls, reason)
+
+    def get_leaf_state(self, leaf):
+        """ Returns the in-memory results an operation produced for a leaf, 
+            so they can be shipped back from a child process. 
+        """
+        return {}
+
+    def set_leaf_state(self, leaf, state):
+        pass
+
     def make_pid_string(self, func_name):
         return '.'.join((self.book.identifier, 
                          self.__class__.__name__, 
                          func_name))
 
+    def in_leaf_work(self):
+        return getattr(self._local, 'leaf_work', False)
+
     def join(self):
+        if self._in_child or self.in_leaf_work():
+            raise
+        if self.token.cancelled:
+            # whatever went wrong, the book was aborted; unwind the leaf
+            # work rather than report it
+            raise Cancelled(self.token.reason)
         curframe = inspect.currentframe()
         calframe = inspect.getouterframes(curframe, 2)
         pid = self.make_pid_string(calframe[1][3])
@@ -92,8 +553,11 @@ class Operation(OnEvents):
         
     def terminate_child_processes(self):
         """ Signal to subprocesses to terminate """
-        for component in self.components:
+        for component in getattr(self, 'components', []):
             component.Util.end_active_processes()     
+        for child in list(self._child_procs):
+            Util.terminate_group(child.pid, 
+                                 lambda child=child: child.exitcode is None)
 
     def complete_process(self, cls, leaf, exec_time):
         """ Bookkeeping """
@@ -102,9 +566,105 @@ class Operation(OnEvents):
             for l in leaf:
                 self.complete_process(cls, l, etime)
             return
+        elif self.speculator is not None and self.is_leaf_done(leaf):
+            # the other attempt at it already won
+            return
         else:
             self.completed[cls][leaf] = exec_time
             self.exec_times[cls].append(exec_time)
+            # a child's or worker's work is journaled when the parent 
+            # merges it
+            if self.journal is not None and not self._in_child and \
+                    cls in self.get_leaf_components():
+                state = None
+                if self.is_leaf_done(leaf):
+                    state = self.get_leaf_state(leaf)
+                self.journal.record(self.__class__.__name__, cls, leaf, 
+                                    exec_time, state)
+            if not self._in_child:
+                if self.speculator is not None and self.is_leaf_done(leaf):
+                    self.speculator.leaf_done(leaf)
+                self.ProcessHandler.progress.update(self)
+                self.ProcessHandler.slots.checkpoint()
+                self.token.check()
+
+    def run_concurrently(self, cls, calls):
+        """ Runs component 'cls' once for each (leaf, kwargs) in 'calls', 
+            with the processes in flight together on the SubprocessDriver
+            rather than one after the other, and completes each leaf as its
+            process ends.
+
+            The slot the chunk holds covers one process; every other one in
+            flight takes a slot of its own, when one is free with no one 
+            waiting for it, so the pool's budget holds for processes too.
+        """
+        component = getattr(self, cls)
+        owner = get_ident()
+        slots = self.ProcessHandler.slots
+        identifier = self.book.identifier
+        async def call(leaf, kwargs):
+            self.token.check()
+            # the tools belong to this thread's leaf attempt, not the loop's
+            Util.owner.set(owner)
+            return leaf, await component.run_async(leaf, **kwargs)
+        driver = SubprocessDriver.shared()
+        pending = list(calls)
+        # each process in flight, and whether it holds a slot of its own
+        in_flight = {}
+        try:
+            while pending or in_flight:
+                while pending and (False not in in_flight.values() or
+                                   slots.try_acquire(identifier, 
+                                                     self.priority)):
+                    extra = False in in_flight.values()
+                    leaf, kwargs = pending.pop(0)
+                    in_flight[driver.submit(call(leaf, kwargs))] = extra
+                done, _ = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if in_flight.pop(future):
+                        slots.release(identifier, lease=False)
+                for future in done:
+                    leaf, output = future.result()
+                    self.complete_process(cls, leaf, output['exec_time'])
+        finally:
+            for future, extra in in_flight.items():
+                future.cancel()
+                if extra:
+                    slots.release(identifier, lease=False)
+
+    def get_leaf_components(self):
+        if self.leaf_components is None:
+            return [component[1] for component in self.imports]
+        return self.leaf_components
+
+    def is_leaf_done(self, leaf):
+        components = self.get_leaf_components()
+        if not components:
+            return False
+        for cls in components:
+            if leaf not in self.completed.get(cls, {}):
+                return False
+        return True
+
+    def restore(self, journal):
+        """ Takes back the leaves a previous, interrupted run finished, 
+            along with the in-memory results they had produced.
+        """
+        if not self.get_leaf_components():
+            return
+        restored = set()
+        for cls, leaf, exec_time, state in \
+                journal.get_records(self.__class__.__name__):
+            if state is not None:
+                self.set_leaf_state(leaf, state)
+            self.completed[cls][leaf] = exec_time
+            self.exec_times[cls].append(exec_time)
+            restored.add(leaf)
+        if restored:
+            done = [leaf for leaf in restored if self.is_leaf_done(leaf)]
+            self.book.logger.info(self.__class__.__name__ + ': resuming with ' +
+                                  str(len(done)) + ' leaves already done')
 
     def set_finished(self):
         self.completed['__finished__'] = True
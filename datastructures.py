@@ -67,6 +67,19 @@ class Crop(StructuralMetadata):
                  'skew_active': copy(self.skew_active[leaf])}
         return state
 
+    leaf_fields = ('box', 'box_with_skew_padding', 'image_width', 
+                   'image_height', 'hand_side', 'active', 'pagination',
+                   'classification', 'page_type', 'add_to_access_formats',
+                   'rotate_degree', 'skew_angle', 'skew_conf', 'skew_active')
+
+    def get_leaf_state(self, leaf):
+        return {field: getattr(self, field)[leaf] 
+                for field in Crop.leaf_fields}
+
+    def set_leaf_state(self, leaf, state):
+        for field, value in state.items():
+            getattr(self, field)[leaf] = value
+
     def get_box_metadata(self):
         for dimension in Box.dimensions:
             p = []
@@ -93,6 +106,14 @@ class Crop(StructuralMetadata):
                 self.active[leaf] = True
         
     def xml_io(self, mode, strict=True):
+        if mode == 'export':
+            # written back once, however many leaves changed
+            with self.scandata.changing():
+                self._xml_io(mode, strict)
+        else:
+            self._xml_io(mode, strict)
+
+    def _xml_io(self, mode, strict=True):
         page_data = self.scandata.tree.find('pageData')
         pages = page_data.findall('page')
         for leaf, page in enumerate(pages):
@@ -182,8 +203,6 @@ class Crop(StructuralMetadata):
                     skewconf = page.find('skewConf')
                     if skewconf is not None and self.skew_conf[leaf] is not None:
                         skewconf.text = str(self.skew_conf[leaf])
-        if mode is 'export':
-            self.scandata.write_to_file()
 
     def delete_assertion(self, leaf):
         bookdata = self.scandata.tree.find('bookData')
@@ -200,11 +219,16 @@ class Crop(StructuralMetadata):
                     break
         if remove is not None:
             #self.pagination[leaf] = None
-            assertions[remove].getparent().remove(assertions[remove])
-            self.scandata.write_to_file()
+            with self.scandata.changing():
+                assertions[remove].getparent().remove(assertions[remove])
             self.update_pagination()
 
     def assert_page_number(self, leaf, number):
+        with self.scandata.changing():
+            self._assert_page_number(leaf, number)
+        self.update_pagination()
+
+    def _assert_page_number(self, leaf, number):
         bookdata = self.scandata.tree.find('bookData')
         page_num_data = bookdata.find('pageNumData')
         if page_num_data is None:
@@ -215,8 +239,6 @@ class Crop(StructuralMetadata):
             if entry.text == str(leaf):
                 pagenum = element.find('pageNum')
                 pagenum.text = str(number)
-                self.scandata.write_to_file()
-                self.update_pagination()
                 return
         insert_point = None
         for num, element in enumerate(assertions):
@@ -233,8 +255,6 @@ class Crop(StructuralMetadata):
         leafnum.text = str(leaf)
         pagenum = etree.SubElement(assertion, 'pageNum')
         pagenum.text = str(number)
-        self.scandata.write_to_file()
-        self.update_pagination()
 
     def update_pagination(self):
         bookdata = self.scandata.tree.find('bookData')
@@ -0,0 +1,93 @@
+import os
+import asyncio
+from collections import deque
+from threading import Thread, Lock
+
+
+class SubprocessDriver(object):
+    """ Runs coroutines that drive external tools (see
+        Component.execute_async) on one event loop, in a thread of its own,
+        so a chunk can have many short tesseract, c44 or hocr2pdf processes
+        in flight without a thread blocked on each of them. At most 'limit'
+        of the coroutines run at once.
+
+        The loop is shared by everything in the process and started on
+        first use (see 'shared'); a forked child starts a loop of its own,
+        with the same limit.
+    """
+    _shared = None
+    _shared_lock = Lock()
+
+    def __init__(self, limit=None):
+        self.limit = limit if limit else (os.cpu_count() or 1)
+        self.running = 0
+        self.loop = None
+        self._waiters = deque()
+        self._lock = Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def _get_loop(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                thread = Thread(target=self.loop.run_forever,
+                                name='SubprocessDriver')
+                thread.daemon = True
+                thread.start()
+            return self.loop
+
+    def set_limit(self, limit):
+        self.limit = max(1, limit)
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        while self._waiters and self.running < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.running += 1
+
+    async def _limited(self, coro):
+        if self.running < self.limit and not self._waiters:
+            self.running += 1
+        else:
+            waiter = self.loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # was let in just as it was cancelled
+                    self.running -= 1
+                    self._wake()
+                coro.close()
+                raise
+        try:
+            return await coro
+        finally:
+            self.running -= 1
+            self._wake()
+
+    def submit(self, coro):
+        """ Schedules 'coro' from any thread but the loop's own, returning a
+            concurrent.futures.Future for its result.
+        """
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self._limited(coro), loop)
+
+
+def _reset_shared():
+    if SubprocessDriver._shared is not None:
+        SubprocessDriver._shared = SubprocessDriver(
+            SubprocessDriver._shared.limit)
+    SubprocessDriver._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)
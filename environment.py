@@ -1,20 +1,27 @@
 import os
 import sys
 import platform
-import glob
 import re
 import datetime
 import time
 import shutil
+from io import BytesIO
 from collections import OrderedDict
 import logging
+from threading import Lock, RLock
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
-from PIL import Image
 from lxml import etree
 
 from util import Util
+from usage import ResourceUsage
 from datastructures import Crop
+from manifest import RawManifest
+from logwriter import LogWriter
+from reaper import Reaper
+from writeback import WriteBack
 
 
 class Environment(object):
@@ -37,6 +44,8 @@ class Environment(object):
     proc_mode = None
     dir_mode = 0o755
     scale_factor = 4
+    discovery_workers = 32
+    raw_dir_pattern = re.compile("(_raw_|_RAW_|_raw$|_RAW$)")
 
     def __init__(self, interface):
         Environment.interface = interface
@@ -45,29 +54,53 @@ class Environment(object):
 
     @staticmethod
     def get_books(dir_list, args, stage, capture_style=None):
-        books = []
-        if not isinstance(dir_list, list):
-            dir_list = [dir_list,]
-        for root_dir in dir_list:
-            root_dir = root_dir.rstrip('/')
-            valid_subdirs = Environment.find_valid_subdirs(root_dir)
-            if not valid_subdirs:
-                raw_dir = Environment.is_sane(root_dir)
-                if raw_dir:
-                    raw_data = Environment.get_raw_data(root_dir, raw_dir)
-                    books.append(Book(root_dir, raw_dir, raw_data, 
-                                      stage, capture_style))
-            else:
-                for subdir in valid_subdirs:
-                    raw_dir = Environment.is_sane(subdir)
-                    if raw_dir:
-                        raw_data = Environment.get_raw_data(subdir, raw_dir)
-                        books.append(Book(subdir, raw_dir, raw_data, 
-                                          stage, capture_style))
+        books = [descriptor.open(stage, capture_style) for descriptor in
+                 Environment.discover(dir_list)]
+        for book in books:
+            book.load()
         if len(books) < 1:
             Util.bail('No valid directories found for processing...')
         return books
 
+    @staticmethod
+    def discover(dir_list, workers=None):
+        """ Yields a BookDescriptor for each item found in the directories
+            of 'dir_list', each of which is either an item itself or a
+            directory of items, as they are found.
+
+            The subdirectories of a directory are looked into for a raw
+            image directory on 'workers' threads at once, as on network
+            storage the time goes on waiting for the listings; the items
+            still come out in order, each as soon as it and those before it
+            have been looked at, so processing can start on the first ones
+            while the rest of a large library is being searched. A
+            directory that can't be listed is logged and skipped.
+        """
+        if not isinstance(dir_list, list):
+            dir_list = [dir_list,]
+        workers = workers if workers else Environment.discovery_workers
+        with ThreadPoolExecutor(workers) as pool:
+            for root_dir in dir_list:
+                root_dir = root_dir.rstrip('/')
+                try:
+                    with os.scandir(root_dir) as entries:
+                        subdirs = sorted([entry.path for entry in entries
+                                          if entry.is_dir()])
+                except OSError as e:
+                    Environment.skipped(root_dir, e)
+                    continue
+                found = False
+                for subdir, raw_dir in zip(subdirs, 
+                                           pool.map(Environment.look_into,
+                                                    subdirs)):
+                    if raw_dir:
+                        found = True
+                        yield BookDescriptor(subdir, raw_dir)
+                if not found:
+                    raw_dir = Environment.is_sane(root_dir)
+                    if raw_dir:
+                        yield BookDescriptor(root_dir, raw_dir)
+
     @staticmethod
     def check_system():
         plat = sys.platform
@@ -84,31 +117,6 @@ class Environment(object):
         Environment.current_path = os.path.abspath(os.path.dirname(sys.argv[0]))
         sys.path.append(Environment.current_path)
 
-    @staticmethod
-    def find_valid_subdirs(root_dir):
-        """ We accept as the root directory a directory containing 
-            items (sub-directories) to be processed, and so we check
-            for the presence of such items and if found initialize and 
-            add them to our list of books.
-        """
-        valid_subdirs = []
-        subdirs = os.listdir(root_dir)
-        for subdir in subdirs:
-            path = root_dir + '/' + subdir
-            raw_dir = Environment.is_sane(path)
-            if raw_dir:
-                valid_subdirs.append(path)
-        return valid_subdirs
-
-                #raw_data = Environment.get_raw_data(root_dir, 
-                #                                    subdir + '/' + raw_dir)
-                #self.books.append(Book(root_dir, raw_dir, raw_data,
-                #                       self.stage, self.capture_style))
-        #if len(self.books) > 1:
-        #    return True
-        #else:
-        #    return False
-
     @staticmethod
     def create_new_book_stub(location, identifier):
         root_dir = location + '/' + identifier
@@ -116,13 +124,29 @@ class Environment(object):
         os.mkdir(root_dir, Environment.dir_mode)
         os.mkdir(raw_dir, Environment.dir_mode)
 
+    @staticmethod
+    def look_into(dir):
+        """ find_raw_dir for discover: a directory that can't be listed is
+            logged and skipped rather than ending the search.
+        """
+        try:
+            return Environment.find_raw_dir(dir)
+        except OSError as e:
+            Environment.skipped(dir, e)
+            return None
+
+    @staticmethod
+    def skipped(dir, error):
+        logging.getLogger(__name__).warning('skipping ' + dir + ': ' +
+                                            str(error))
+
     @staticmethod
     def find_raw_dir(dir):
-        dir_items = os.listdir(dir)
-        for item in dir_items:
-            if re.search("(_raw_|_RAW_|_raw$|_RAW$)", item):
-                if os.path.isdir(dir + '/' + item):
-                    return item
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                if Environment.raw_dir_pattern.search(entry.name) and \
+                        entry.is_dir():
+                    return entry.name
 
     @staticmethod
     def is_sane(root_dir):
@@ -139,25 +163,17 @@ class Environment(object):
 
     @staticmethod
     def get_raw_data(root_dir, raw_dir):
-        raw_images, raw_dimensions = \
-            Environment.get_raw_images(root_dir + '/' + raw_dir)
+        raw_images, raw_dimensions, raw_orientations = \
+            RawManifest(root_dir, raw_dir).load()
         return {'page_count': len(raw_images),
                 'images': raw_images,
-                'dimensions': raw_dimensions}
+                'dimensions': raw_dimensions,
+                'orientations': raw_orientations}
 
     @staticmethod
     def get_raw_images(dir):
-        raw_images = glob.glob(dir + '/*')
-        raw_dimensions = {}
-        for leaf, file in enumerate(raw_images):
-            if re.search("[\.(jpg|JPG|jpeg|JPEG)]$",file) is None:
-                Util.bail("non-jpg file found in "+ str(raw_dir) +
-                                 ": " + str(file))
-            else:
-                raw_dimensions[leaf] = {}
-                raw_dimensions[leaf]['width'], \
-                    raw_dimensions[leaf]['height'] = Image.open(file).size
-        raw_images.sort()
+        raw_images, raw_dimensions, raw_orientations = \
+            RawManifest(os.path.dirname(dir), os.path.basename(dir)).load()
         return raw_images, raw_dimensions
 
     @staticmethod
@@ -167,7 +183,12 @@ class Environment(object):
 
     @staticmethod
     def clean_dir(dir):
-        if os.path.isdir(dir):
+        """ Empties 'dir' at once, leaving the Reaper to delete its old
+            contents in the background; where it can't, they're deleted
+            here.
+        """
+        if os.path.isdir(dir) and \
+                not Reaper.shared().trash(dir, Environment.dir_mode):
             for f in os.listdir(dir):
                 if os.path.isdir(dir + '/' + f):
                     shutil.rmtree(dir + '/' + f)
@@ -175,23 +196,100 @@ class Environment(object):
                     os.remove(dir + '/' + f)
                   
 
+class BookDescriptor(object):
+    """ An item found by Environment.discover: where it is and nothing
+        else, so a whole library can be listed without opening any of it.
+    """
+
+    def __init__(self, root_dir, raw_dir):
+        self.root_dir = root_dir
+        self.raw_dir = raw_dir
+        self.identifier = os.path.basename(root_dir)
+
+    def open(self, stage, capture_style=None):
+        """ Returns the Book, reading its raw images' manifest; the rest of
+            it is loaded as it is used.
+        """
+        raw_data = Environment.get_raw_data(self.root_dir, self.raw_dir)
+        return Book(self.root_dir, self.raw_dir, raw_data, stage,
+                    capture_style)
+
+
 class Book(object):
     """ Holds the state of a particular item.
 
 
-    stages: new_capture, append_capture, process, edit
+    stages: new_capture, append_capture, process, edit, worker
+
+    A 'worker' book is the copy a bookmaker-worker keeps of a book being 
+    processed elsewhere; it appends to the book's logs rather than starting
+    them over, and its crops are set up per task.
+
+    Creating a Book is cheap: its directories, loggers, settings, scandata
+    and crops (the attributes in 'lazy') are set up by 'load' the first
+    time one of them is used, so a long queue of books costs next to
+    nothing until each is worked on. 'release' drops that state again, and
+    whatever the operations left on the book, once it is finished with; a
+    released book that is used again is loaded as a new one would be, but
+    appends to its logs.
+
+    The book's logs are written by the LogWriter's thread. A 'log_level' in
+    its settings.yaml (or 'set_log_level') sets how much it logs; the
+    default, DEBUG, logs everything.
 
     """
+    lazy = ('logger', 'settings', 'scandata', 'scaled_center_point', 
+            'crops', 'cropBox', 'pageCrop', 'standardCrop', 'contentCrop')
 
     def __init__(self, root_dir, raw_dir, raw_data, stage, capture_style=None):
         self.root_dir = root_dir
+        self.stage = stage
+        self.build_cache = None
+        self.resource_usage = ResourceUsage()
         self.raw_image_dir = raw_dir
         self.page_count = raw_data['page_count']
         self.raw_images = raw_data['images']
         self.raw_image_dimensions = raw_data['dimensions']
+        self.raw_image_orientations = raw_data.get('orientations', {})
         self.capture_style = capture_style
+        self.log_level = None
         self.identifier = os.path.basename(self.root_dir)
         self.scandata_file = self.root_dir + '/' + self.identifier + '_scandata.xml'
+        self.dirs = {
+            'book':          self.root_dir,
+            'raw_images':    self.root_dir + '/' + self.raw_image_dir,
+            'logs':          self.root_dir + '/' + self.identifier + '_logs',
+            'scaled':        self.root_dir + '/' + self.identifier + '_scaled',
+            }
+        self.create_time = time.time()
+        self.start_time = time.time()
+        self._lock = RLock()
+        self._loaded = False
+        self._loading = False
+        self._released = False
+        # what 'release' keeps
+        self._kept = frozenset(self.__dict__) | frozenset(['_kept'])
+
+    def __getattr__(self, name):
+        # only reached for attributes that aren't set
+        if name in Book.lazy and not self.__dict__.get('_loaded', True):
+            self.load()
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
+
+    def load(self):
+        """ Sets up the book's state for its stage. """
+        with self._lock:
+            if self._loaded or self._loading:
+                return
+            self._loading = True
+            try:
+                self._load()
+            finally:
+                self._loading = False
+            self._loaded = True
+
+    def _load(self):
         self.scaled_center_point = {}
         for leaf in range(0, self.page_count):
             self.scaled_center_point[leaf] = \
@@ -199,21 +297,18 @@ class Book(object):
                        Environment.scale_factor)/2,
                  'y': (self.raw_image_dimensions[leaf]['width']/
                        Environment.scale_factor)/2}
-        self.dirs = {
-            'book':          self.root_dir,
-            'raw_images':    self.root_dir + '/' + self.raw_image_dir,
-            'logs':          self.root_dir + '/' + self.identifier + '_logs',
-            'scaled':        self.root_dir + '/' + self.identifier + '_scaled',
-            }
         for name, dir in self.dirs.items():
             if not os.path.exists(dir):
                 Environment.make_dir(dir)
-        self.init_logger()
+        self.init_logger('a' if self.stage == 'worker' or self._released 
+                         else 'w')
         self.load_settings()
+        self._apply_log_level()
         self.log_settings()
         self.scandata = Scandata()
         self.init_scandata()
 
+        stage = self.stage
         if stage == 'new_capture':
             pass
         elif stage == 'append_capture':
@@ -225,8 +320,27 @@ class Book(object):
             #self.init_scandata()
             self.determine_capture_style()
             self.init_crops(import_from_scandata=True, strict=True)        
-        self.create_time = time.time()
-        self.start_time = time.time()
+        elif stage == 'worker':
+            self.determine_capture_style()
+
+    def release(self):
+        """ Writes out the scandata, closes the book's log files and drops
+            everything set on it since it was created.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            if 'scandata' in self.__dict__:
+                try:
+                    self.scandata.flush()
+                except Exception as e:
+                    self.logger.error(str(e))
+            LogWriter.shared().detach(self.logger)
+            for name in list(self.__dict__):
+                if name not in self._kept:
+                    del self.__dict__[name]
+            self._loaded = False
+            self._released = True
 
     def determine_capture_style(self):
         bookData = self.scandata.tree.find('bookData')
@@ -242,7 +356,7 @@ class Book(object):
             else:
                 self.capture_style = None
 
-    def init_logger(self):
+    def init_logger(self, mode='w'):
         self.logger = logging.getLogger(self.identifier)
         self.logger.setLevel(logging.DEBUG)
 
@@ -250,19 +364,34 @@ class Book(object):
         console.setLevel(logging.WARNING)
         formatter = logging.Formatter('%(name)s %(threadName)s %(levelname)s --> %(message)s\n')
         console.setFormatter(formatter)
-        self.logger.addHandler(console)
 
-        fh = logging.FileHandler(self.dirs['logs'] + '/' + self.identifier + '.log', 'w')
+        fh = logging.FileHandler(self.dirs['logs'] + '/' + self.identifier + '.log', mode)
         fh.setLevel(logging.INFO)
         formatter = logging.Formatter('%(asctime)s %(threadName)s %(levelname)s %(message)s')
         fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
 
-        debug = logging.FileHandler(self.dirs['logs'] + '/' + self.identifier + '.debug.log', 'w')
+        debug = logging.FileHandler(self.dirs['logs'] + '/' + self.identifier + '.debug.log', mode)
         debug.setLevel(logging.DEBUG)
         formatter = logging.Formatter('%(asctime)s %(threadName)s %(levelname)s %(message)s')
         debug.setFormatter(formatter)
-        self.logger.addHandler(debug)
+        LogWriter.shared().attach(self.logger, (console, fh, debug))
+
+    def set_log_level(self, level):
+        """ Sets the lowest level the book logs at, as a logging level or
+            its name; e.g. 'INFO' leaves the debug log empty and skips
+            formatting the debug messages at all. It overrides the one in
+            settings.yaml, and doesn't load the book.
+        """
+        with self._lock:
+            self.log_level = level
+            if self._loaded or self._loading:
+                self._apply_log_level()
+
+    def _apply_log_level(self):
+        level = self.log_level or self.settings.get('log_level') or \
+            logging.DEBUG
+        self.logger.setLevel(level.upper() if isinstance(level, str) 
+                             else level)
 
     def load_settings(self, args=None):
         path = self.root_dir
@@ -317,7 +446,7 @@ class Book(object):
     def log_settings(self):
         self.logger.debug('*****SETTINGS*****')
         for setting, value in self.settings.items():
-            self.logger.debug(setting + ':' + str(value))
+            self.logger.debug('%s:%s', setting, value)
         self.logger.debug('*****SETTINGS*****')
 
     def init_scandata(self):
@@ -373,18 +502,30 @@ class Book(object):
 class Scandata(object):
     """ XML storage medium for structural metadata, identical 
         to the Internet Archive's "scandata". 
+
+        Changes to the tree are made in 'changing', which marks the document
+        dirty and has the WriteBack write it out shortly after, however 
+        many more changes follow in the meantime. A write replaces the file
+        atomically and durably, through a synced temporary file with the 
+        file's mode, and 'flush' does one at once.
     """
 
     def __init__(self):
         self.filename = None
         self.tree = None
-        self.locked = False
+        self.dirty = False
+        # held while the tree is changed or serialized
+        self.lock = RLock()
+        self._writing = Lock()
                         
     def new_from_file(self, filename):
         self.filename = filename
         with open(self.filename, 'r+') as f:
             parser = etree.XMLParser(remove_blank_text=True)
-            self.tree = etree.parse(f, parser)
+            tree = etree.parse(f, parser)
+        with self.lock:
+            self.tree = tree
+            self.dirty = False
         
     def new(self, identifier, page_count, raw_image_dimensions, 
             filename, capture_style):
@@ -429,25 +570,88 @@ class Scandata(object):
             crop_box = Crop.new_crop_element(page, 'cropBox')
             page_number = etree.SubElement(page, 'pageNumber')
         self.tree = etree.ElementTree(root)
-        self.write_to_file()
+        self.dirty = True
+        self.flush()
+
+    def quarantine_leaf(self, leaf, operation, component, reason):
+        """ Marks a leaf that could not be processed, so it can be told
+            apart from one that was and looked at again later.
+        """
+        page = self.tree.find('pageData/page[@leafNum="' + str(leaf) + '"]')
+        if page is None:
+            return
+        with self.changing():
+            element = etree.SubElement(page, 'quarantined')
+            element.set('operation', str(operation))
+            element.set('component', str(component))
+            element.text = str(reason)
+
+    def get_quarantined(self):
+        quarantined = {}
+        for element in self.tree.findall('pageData/page/quarantined'):
+            leaf = int(element.getparent().get('leafNum'))
+            quarantined.setdefault(leaf, []).append(
+                (element.get('operation'), element.get('component'), 
+                 element.text))
+        return quarantined
+
+    @contextmanager
+    def changing(self):
+        """ Makes changes to the tree and schedules their write. """
+        with self.lock:
+            try:
+                yield
+            finally:
+                self.mark_dirty()
+
+    def mark_dirty(self):
+        with self.lock:
+            self.dirty = True
+        WriteBack.shared().schedule(self)
 
     def write_to_file(self):
-        while True:
-            if self.locked:
-                time.sleep(0.5)
-            self.locked = True
-            if os.path.exists(self.filename):
-                mode = 'r+b'
-            else:
-                mode = 'w+b'
+        """ Schedules a write of the whole document. """
+        self.mark_dirty()
+
+    def flush(self):
+        """ Writes the document now if it has changes not yet written;
+            returns whether it did.
+        """
+        with self._writing:
+            with self.lock:
+                if not self.dirty:
+                    return False
+                data = BytesIO()
+                self.tree.write(data, pretty_print=True)
+                self.dirty = False
+            temp = self.filename + '.' + str(os.getpid()) + '.tmp'
             try:
-                with open(self.filename, mode) as f:
-                    self.tree.write(f, pretty_print=True)
+                with open(temp, 'wb') as f:
+                    f.write(data.getvalue())
+                    if os.path.exists(self.filename):
+                        os.fchmod(f.fileno(), 
+                                  os.stat(self.filename).st_mode & 0o7777)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.rename(temp, self.filename)
+                Scandata.sync_dir(os.path.dirname(self.filename) or '.')
             except (OSError, IOError) as e:
+                with self.lock:
+                    self.dirty = True
                 raise Exception ('Failed to write to scandata! \n' + str(e))
-            else:
-                break
-            finally:
-                self.locked = False
+            return True
+
+    @staticmethod
+    def sync_dir(path):
+        """ Syncs a directory, so a rename in it survives a crash. """
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            # e.g. where directories can't be opened
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
                 
 
@@ -12,7 +12,7 @@ import cairo
 
 from environment import Environment
 from util import Util
-from processing import ProcessHandling
+from processing import ProcessHandling, FairShare
 from datastructures import Crop, Box
 from .history import History
 from .common import CommonActions as ca
@@ -1812,6 +1812,8 @@ class EditorGui(object):
             self.history.record_change(data)
             if update_scandata:
                 self.update_scandata()
+                self.recrop([leaf for side in data if side is not None
+                             for leaf in side['affected']])
         self.save_needed['l'], self.save_needed['r'] = (False, None), (False, None)
         self.save_button.set_sensitive(False)
         self.released = True
@@ -1860,6 +1862,20 @@ class EditorGui(object):
                 'standardCrop': self.book.standardCrop.return_state(leaf),
                 'contentCrop': self.book.contentCrop.return_state(leaf)}
 
+    def recrop(self, leaves):
+        """ Once the book has been cropped, redoes the leaves whose crops
+            were just saved, ahead of any batch work that is running.
+        """
+        cropped = self.book.root_dir + '/' + self.book.identifier + '_cropped'
+        if not leaves or not os.path.exists(cropped):
+            return
+        queue = self.ProcessHandler.new_queue()
+        queue.add(self.book, cls='Crop', mth='cropper_pipeline',
+                  kwargs={'start': min(leaves), 'end': max(leaves) + 1, 
+                          'crop': 'cropBox'},
+                  priority=FairShare.interactive)
+        queue.drain(mode='sync', thread=True)
+
     def update_scandata(self):
         for crop in ('pageCrop', 'standardCrop', 'contentCrop', 'cropBox'):
             self.book.crops[crop].xml_io('export')
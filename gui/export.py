@@ -686,7 +686,6 @@ class ExportGui(object):
         identifier = self.book.identifier
         if not identifier in self.ProcessHandler.OperationObjects:
             return True
-        op_obj = self.ProcessHandler.OperationObjects[identifier]
         num_tasks = len(update)
         total_fraction = 0.0
         for op, cls in {'cropper': 'Crop',
@@ -696,19 +695,18 @@ class ExportGui(object):
                         'epub': 'EPUB',
                         'text': 'PlainText'}.items():
             if op in update:
-                if not hasattr(self, op+'_fraction'):
-                    #if the other update threads have not
-                    #finished their first pass then this
-                    #won't exist.
-                    continue
-                if cls in op_obj:
-                    state = self.ProcessHandler.get_op_state\
-                        (self.book, identifier,
-                         cls, self.book.page_count)
-                    total_fraction += getattr(self, op+'_fraction')
+                state = self.ProcessHandler.progress.get_state(identifier, cls)
+                if state is not None:
+                    total_fraction += state['fraction']
         total_fraction /= num_tasks
         self.global_progress.set_fraction(total_fraction)
-        self.global_progress.set_text(str(int(total_fraction*100)) + '%')
+        string = str(int(total_fraction*100)) + '%'
+        remaining = self.ProcessHandler.get_progress(identifier)['remaining']
+        if remaining is not None and total_fraction < 1.0:
+            mins, secs = self.ProcessHandler.split_time(remaining)
+            string += (' -- Time Remaining: ' + str(mins) + ' mins ' + 
+                       str(secs) + ' secs')
+        self.global_progress.set_text(string)
         if total_fraction == 1.0:
             self.enable_interface()
             return False
@@ -0,0 +1,57 @@
+from queue import Empty
+
+import gi
+gi.require_version("Gdk", "3.0")
+from gi.repository import Gdk, GObject
+
+from poll import BasePolls
+from gui.common import CommonActions as ca
+
+
+class GUIPolls(BasePolls):
+    """ Monitors the CPU bound threads, submitting waiting processes when others 
+        finish, and will abort a process when an exception arises. In the event 
+        of an exception, all processes running in conjunction to the failed 
+        process will also be shutdown, i.e., tasks distributed across multple 
+        cores will see all their associated threads terminate. The exception will 
+        also be displayed in a dialog box and logged.
+    """
+    def __init__(self, ProcessHandler):
+        super(GUIPolls, self).__init__(ProcessHandler)
+
+    def _start_thread_poll(self):
+        if not self._is_polling_threads:
+            GObject.timeout_add(1000, self._thread_poll)
+            self._is_polling_threads = True
+        
+    def _thread_poll(self):
+        #if (not self._should_poll or 
+        #    not self.ProcessHandler._are_active_processes()):
+        #    self._is_polling_threads = False
+        #    self._should_poll = False
+        #    return False
+        self.ProcessHandler._clear_inactive()
+        self.ProcessHandler._submit_waiting()
+        return True
+
+    def _start_exception_poll(self):
+        if not self._is_polling_exceptions:
+            GObject.timeout_add(500, self._exception_poll)
+            self._is_polling_exceptions = True
+
+    def _exception_poll(self):
+        #if (not self._should_poll or 
+        #    not self.ProcessHandler._are_active_processes()):
+        #    self._is_polling_exceptions = False
+        #    self._should_poll = False
+        #    return False
+        try:
+            #print ('epoll')
+            pid, exc_info = self.ProcessHandler._exception_queue.get_nowait()
+        except Empty:
+            return True
+        else:
+            msg = self._handle_exception(pid, exc_info)
+            if msg is not None:
+                ca.dialog(message=msg)
+            return True
@@ -270,14 +270,15 @@ class ProcessingGui(object):
         if self.ProcessHandler.is_waiting(identifier):
             self.model[path][1] = 'waiting...'
             return True
-        elif self.ProcessHandler.had_error(identifier, cls='FeatureDetection'):
+        elif self.ProcessHandler.had_error(identifier, 
+                                           cls='FeatureDetection'):
             self.model[path][1] = 'ERROR'
             self.model[path][3] = '--'
             return True
         else:
             #self.books[identifier].start_time = Util.microseconds()
             self.model[path][1] = 'processing'
-            op_obj = self.ProcessHandler.OperationObjects[identifier]                
+            op_obj = self.ProcessHandler.OperationObjects.get(identifier, {})
             if not 'FeatureDetection' in op_obj:
                 return True            
             total = self.books[identifier].page_count
@@ -286,7 +287,14 @@ class ProcessingGui(object):
                                                      'FeatureDetection',
                                                      total)
             if state['finished']:
-                self.model[path][1] = 'finished'
+                if self.ProcessHandler.has_quarantined(
+                        identifier, cls='FeatureDetection'):
+                    quarantined = self.ProcessHandler.get_quarantined(
+                        identifier, cls='FeatureDetection')
+                    self.model[path][1] = ('partial (' + str(len(quarantined)) +
+                                           ' leaves failed)')
+                else:
+                    self.model[path][1] = 'finished'
                 self.model[path][3] = '--'
                 self.model[path][5] = 100.0
                 return True
@@ -0,0 +1,94 @@
+import os
+import time
+import pickle
+from threading import Lock, Timer
+
+
+class Journal(object):
+    """ An append-only, on-disk record of a book's finished leaf work, so an
+        interrupted run can be resumed rather than started over.
+
+        Each record is (operation, component, leaf, exec_time, state), where
+        state is what the operation's get_leaf_state returned once the leaf
+        was done, and None for the records before that. Records are handed
+        to the OS as they're written, so they survive the process dying,
+        and synced to disk at most every 'sync_interval' seconds, so a
+        machine crash loses no more than the last few leaves; a record cut
+        short is dropped when the journal is next opened.
+
+        Every run of the book's work appends to the journal (an editor's
+        recrop, an export), so one started while an interrupted run waits
+        to be resumed doesn't lose it; 'restart' starts it over, once a 
+        full run has wiped the work it records.
+    """
+    sync_interval = 1.0
+
+    def __init__(self, book, resume=False):
+        self.book = book
+        self.resume = resume
+        self.filename = book.root_dir + '/' + book.identifier + '_journal'
+        self.records = []
+        self.synced = time.time()
+        self._timer = None
+        self._lock = Lock()
+        if resume:
+            self.load()
+        self.file = open(self.filename, 'ab')
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r+b') as f:
+            good = 0
+            while True:
+                try:
+                    self.records.append(pickle.load(f))
+                except (EOFError, pickle.UnpicklingError,
+                        AttributeError, ValueError, IndexError):
+                    break
+                good = f.tell()
+            f.truncate(good)
+        self.book.logger.info('Resuming from journal with ' +
+                              str(len(self.records)) + ' records')
+
+    def restart(self):
+        with self._lock:
+            self.records = []
+            self.file.truncate(0)
+            self._sync()
+
+    def record(self, operation, cls, leaf, exec_time, state=None):
+        with self._lock:
+            pickle.dump((operation, cls, leaf, exec_time, state), self.file,
+                        pickle.HIGHEST_PROTOCOL)
+            self.file.flush()
+            if time.time() - self.synced >= self.sync_interval:
+                self._sync()
+            elif self._timer is None:
+                # sync what is left unsynced if nothing follows it
+                self._timer = Timer(self.sync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def sync(self):
+        with self._lock:
+            if not self.file.closed:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self.synced = time.time()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def get_records(self, operation):
+        for record in self.records:
+            if record[0] == operation:
+                yield record[1:]
+
+    def close(self):
+        with self._lock:
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
@@ -0,0 +1,134 @@
+import os
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue, Empty
+from threading import Lock, Event
+
+
+class LogWriter(object):
+    """ Writes the log records of every book from one thread of its own, so
+        the threads doing the work only ever put a record on a queue and
+        never wait on a log file or the console.
+
+        A book's logger gets a QueueHandler in place of the handlers it
+        would have written with (see 'attach'); those are kept here, by
+        logger name, and run by a QueueListener. 'detach' closes them once
+        the records logged before it are written, and 'flush' waits until
+        everything logged so far is.
+
+        There is one writer per process (see 'shared'), stopped (flushed)
+        at exit. A forked child starts one of its own, writing to the files
+        it inherited; the records its parent hadn't written yet are the
+        parent's to write, so it drops them.
+    """
+    _shared = None
+    _shared_lock = Lock()
+
+    def __init__(self):
+        self.queue = SimpleQueue()
+        self.handlers = {}
+        self.listener = None
+        self._lock = Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                atexit.register(cls._shared.stop)
+            return cls._shared
+
+    def start(self):
+        with self._lock:
+            if self.listener is None:
+                self.listener = _Listener(self)
+                self.listener.start()
+
+    def stop(self):
+        """ Writes out what is queued and stops the writer thread. """
+        with self._lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+    def attach(self, logger, handlers):
+        """ Has 'logger' write through the queue to 'handlers', in place of
+            whatever it wrote to before.
+        """
+        self.detach(logger)
+        with self._lock:
+            self.handlers[logger.name] = list(handlers)
+        logger.addHandler(QueueHandler(self.queue))
+        self.start()
+
+    def detach(self, logger):
+        """ Stops 'logger' writing through the queue; its handlers are
+            closed once what it logged has been written.
+        """
+        for handler in list(logger.handlers):
+            if isinstance(handler, QueueHandler) and \
+                    handler.queue is self.queue:
+                logger.removeHandler(handler)
+        # the records still queued need the handlers, so they are only 
+        # dropped once the listener gets to this (see _Listener.handle)
+        with self._lock:
+            handlers = self.handlers.get(logger.name)
+        if handlers:
+            self.queue.put(logging.makeLogRecord({'name': logger.name,
+                                                  'closing': handlers}))
+
+    def _closed(self, name, handlers):
+        with self._lock:
+            # unless it was attached again since
+            if self.handlers.get(name) is handlers:
+                del self.handlers[name]
+        for handler in handlers:
+            handler.close()
+
+    def flush(self, timeout=None):
+        with self._lock:
+            running = self.listener is not None
+        if running:
+            flushed = Event()
+            self.queue.put(logging.makeLogRecord({'flushed': flushed}))
+            flushed.wait(timeout)
+
+    def _after_fork(self):
+        self._lock = Lock()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+        if self.listener is not None:
+            self.listener = None
+            self.start()
+
+
+class _Listener(QueueListener):
+    """ Hands each record to the handlers of the logger it came from. """
+
+    def __init__(self, writer):
+        super(_Listener, self).__init__(writer.queue)
+        self.writer = writer
+
+    def handle(self, record):
+        if hasattr(record, 'flushed'):
+            record.flushed.set()
+            return
+        if hasattr(record, 'closing'):
+            self.writer._closed(record.name, record.closing)
+            return
+        for handler in self.writer.handlers.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def _reset_shared():
+    if LogWriter._shared is not None:
+        LogWriter._shared._after_fork()
+    LogWriter._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)
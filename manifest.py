@@ -0,0 +1,164 @@
+import os
+import re
+import pickle
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from util import Util
+
+
+def probe_jpeg(path):
+    """ Reads a JPEG's width, height and EXIF orientation from its headers,
+        without decoding it (the dimensions are not rotated by the
+        orientation): the markers are walked up to the first SOF
+        frame header, reading only the EXIF segment on the way. Returns None
+        if the file isn't a JPEG it can make sense of.
+    """
+    orientation = 1
+    with open(path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return None
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+            kind = marker[1]
+            if kind == 0xff:
+                # fill byte
+                f.seek(-1, os.SEEK_CUR)
+                continue
+            if kind == 0xd8 or 0xd0 <= kind <= 0xd7:
+                continue
+            if kind in (0xd9, 0xda):
+                # end of image, or start of scan before any frame header
+                return None
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            length = struct.unpack('>H', length)[0]
+            if kind in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                        0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                header = f.read(5)
+                if len(header) < 5:
+                    return None
+                height, width = struct.unpack('>HH', header[1:5])
+                return width, height, orientation
+            if kind == 0xe1:
+                segment = f.read(length - 2)
+                if segment.startswith(b'Exif\x00\x00'):
+                    orientation = exif_orientation(segment[6:]) or orientation
+            else:
+                f.seek(length - 2, os.SEEK_CUR)
+
+
+def exif_orientation(tiff):
+    """ The Orientation tag of the first IFD of an EXIF (TIFF) block. """
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return None
+    try:
+        offset = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+        for num in range(0, count):
+            entry = offset + 2 + num * 12
+            tag = struct.unpack(order + 'H', tiff[entry:entry + 2])[0]
+            if tag == 0x0112:
+                return struct.unpack(order + 'H',
+                                     tiff[entry + 8:entry + 10])[0]
+    except struct.error:
+        return None
+    return None
+
+
+class RawManifest(object):
+    """ The raw images of a book with the size and mtime of each file and
+        its width, height and EXIF orientation, kept in
+        <identifier>_raw_manifest next to the scandata.
+
+        The width and height are as stored in the file, before the
+        orientation is applied (so swapped for orientations 5 to 8), as
+        PIL's Image.open(path).size gave them when the images were opened
+        instead; the orientation is recorded for whatever has to rotate.
+
+        Opening a book only stats its raw images: those whose size and
+        mtime match the manifest take their dimensions from it, and only
+        new or changed ones are probed, from their headers alone (see
+        probe_jpeg) and on 'workers' threads at once, as on network storage
+        the time goes on waiting for the reads.
+    """
+    workers = 16
+
+    def __init__(self, root_dir, raw_dir):
+        self.dir = root_dir + '/' + raw_dir
+        self.filename = (root_dir + '/' + os.path.basename(root_dir) +
+                         '_raw_manifest')
+        self.records = {}
+
+    def read(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                records = pickle.load(f)
+        except (OSError, IOError, EOFError, pickle.UnpicklingError):
+            return {}
+        return records if isinstance(records, dict) else {}
+
+    def write(self):
+        tmp = self.filename + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.records, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.filename)
+        except (OSError, IOError):
+            # a read-only book still opens, it just gets probed each time
+            pass
+
+    @staticmethod
+    def probe(path):
+        dimensions = probe_jpeg(path)
+        if dimensions is None:
+            width, height = Image.open(path).size
+            dimensions = (width, height, 1)
+        return dimensions
+
+    def load(self):
+        """ Brings the manifest up to date with the raw image directory.
+            Returns the sorted image paths, with their dimensions and
+            orientations by leaf.
+        """
+        cached = self.read()
+        self.records = {}
+        stale = []
+        for entry in os.scandir(self.dir):
+            if entry.name.startswith('.'):
+                continue
+            if re.search(r"\.(jpe?g|JPE?G)$", entry.name) is None:
+                Util.bail("non-jpg file found in " + self.dir + ": " +
+                          entry.path)
+            stat = entry.stat()
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            record = cached.get(entry.name)
+            if record is not None and record[:2] == stamp:
+                self.records[entry.name] = record
+            else:
+                stale.append((entry.name, stamp))
+        if stale:
+            with ThreadPoolExecutor(self.workers) as pool:
+                probed = pool.map(lambda item:
+                                  RawManifest.probe(self.dir + '/' + item[0]),
+                                  stale)
+                for (name, stamp), dimensions in zip(stale, probed):
+                    self.records[name] = stamp + tuple(dimensions)
+        if stale or len(self.records) != len(cached):
+            self.write()
+        images, dimensions, orientations = [], {}, {}
+        for leaf, name in enumerate(sorted(self.records)):
+            size, mtime, width, height, orientation = self.records[name]
+            images.append(self.dir + '/' + name)
+            dimensions[leaf] = {'width': width, 'height': height}
+            orientations[leaf] = orientation
+        return images, dimensions, orientations
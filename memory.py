@@ -0,0 +1,193 @@
+import os
+import json
+import tempfile
+from threading import Condition, Lock
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class MemoryBudget(object):
+    """ Admits component processes only while their projected memory use
+        fits in 'limit' bytes, so running wide on a big machine slows down
+        instead of swapping.
+
+        A component's footprint is its peak RSS per run: declared by the
+        component up front, then learned from the processes it actually
+        ran (the largest seen so far). Until a component has been measured,
+        only one of its processes runs at a time. A process is always let
+        in when nothing else is running, however large its estimate.
+
+        Memory is the machine's, so the runs in flight are kept in a ledger
+        file all processes of the user on the machine share (forked
+        children of the 'process' executor, spool workers), locked while it
+        is read and written; the runs of processes that are gone are 
+        dropped from it. Waiting for room notices releases made in this 
+        process at once and the others' within 'poll' seconds. Where files 
+        can't be locked, the runs are this process's alone.
+
+        Within a process there is one budget (see 'shared'). What a forked
+        child learns is sent back with its results (see 
+        Operation.run_leaves).
+    """
+    _shared = None
+    _shared_lock = Lock()
+    poll = 0.1
+
+    def __init__(self, limit=None, ledger=None):
+        self.limit = limit
+        if ledger is None and fcntl is not None:
+            ledger = MemoryBudget.ledger_path()
+        self.ledger = ledger
+        self.estimates = {}
+        self._runs = {}
+        self._serial = 0
+        self._state = Condition()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(MemoryBudget.available())
+            return cls._shared
+
+    @staticmethod
+    def available():
+        """ Bytes of memory available for new processes, or None where this
+            can't be told.
+        """
+        try:
+            with open('/proc/meminfo', 'r') as f:
+                for line in f:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, IOError, ValueError, IndexError):
+            pass
+        return None
+
+    @staticmethod
+    def ledger_path():
+        user = str(os.getuid()) if hasattr(os, 'getuid') else 'user'
+        return os.path.join(tempfile.gettempdir(), 
+                            'bookmaker-memory-' + user)
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    @contextmanager
+    def runs(self):
+        """ The runs in flight, as [key, size] by '<pid>:<serial>'; changes
+            are written back on leaving. Called with '_state' held.
+        """
+        if self.ledger is None:
+            yield self._runs
+            return
+        fd = os.open(self.ledger, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    runs = json.loads(f.read() or '{}')
+                except ValueError:
+                    runs = {}
+                runs = dict([(run, entry) for run, entry in runs.items()
+                             if MemoryBudget._alive(int(run.split(':')[0]))])
+                yield runs
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(runs))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _after_fork(self):
+        self._runs = {}
+        self._state = Condition()
+
+    def set_limit(self, limit):
+        with self._state:
+            self.limit = limit
+            self._state.notify_all()
+
+    def learn_all(self, estimates):
+        for key, peak in estimates.items():
+            self.learn(key, peak)
+
+    def declare(self, key, peak):
+        with self._state:
+            if key not in self.estimates:
+                self.estimates[key] = peak
+
+    def learn(self, key, peak):
+        if peak is None:
+            return
+        with self._state:
+            if key not in self.estimates or peak > self.estimates[key]:
+                self.estimates[key] = peak
+                self._state.notify_all()
+
+    def _fits(self, key, runs):
+        if self.limit is None:
+            return True
+        estimate = self.estimates.get(key)
+        if estimate is None:
+            # a run being measured is in with nothing reserved
+            return [key, 0] not in runs.values()
+        if not runs:
+            return True
+        in_use = sum([size for k, size in runs.values()])
+        return in_use + estimate <= self.limit
+
+    def acquire(self, key, blocking=True):
+        """ Reserves the estimate for a run of 'key' and returns the amount
+            reserved, to be given back to 'release'. Without 'blocking',
+            returns None instead of waiting for room.
+        """
+        with self._state:
+            while True:
+                with self.runs() as runs:
+                    if self._fits(key, runs):
+                        size = self.estimates.get(key) or 0
+                        self._serial += 1
+                        run = str(os.getpid()) + ':' + str(self._serial)
+                        runs[run] = [key, size]
+                        return size
+                if not blocking:
+                    return None
+                self._state.wait(self.poll)
+
+    def release(self, key, size):
+        prefix = str(os.getpid()) + ':'
+        with self._state:
+            with self.runs() as runs:
+                for run, entry in list(runs.items()):
+                    if run.startswith(prefix) and entry == [key, size]:
+                        del runs[run]
+                        break
+            self._state.notify_all()
+
+    @contextmanager
+    def admit(self, key):
+        size = self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key, size)
+
+
+def _reset_shared():
+    if MemoryBudget._shared is not None:
+        MemoryBudget._shared._after_fork()
+    MemoryBudget._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)
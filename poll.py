@@ -1,14 +1,8 @@
-import time
 from threading import Thread
 from queue import Empty
 
-import gi
-gi.require_version("Gdk", "3.0")
-from gi.repository import Gdk, GObject
-
 from util import Util
 from environment import Environment
-from gui.common import CommonActions as ca
 
 class PollsFactory(object):
     """ Returns a polling object geared towards either shell use or the gui. The 
@@ -20,6 +14,8 @@ class PollsFactory(object):
         if Environment.interface == 'shell':
             return ShellPolls(ProcessHandler)
         elif Environment.interface == 'gui':
+            # only the gui loads GTK; the shell runs without it
+            from gui.polls import GUIPolls
             return GUIPolls(ProcessHandler)
 
 
@@ -39,6 +35,7 @@ class BasePolls(object):
 
     def stop_polls(self):
         self._should_poll = False
+        self.ProcessHandler._notify()
 
     def _start_thread_poll(self):
         pass
@@ -52,6 +49,21 @@ class BasePolls(object):
     def _exception_poll(self):
         pass
 
+    def _handle_exception(self, pid, exc_info):
+        """ Records and aborts on a reported exception. Returns the message
+            to be shown to the user, or None if an exception for the same
+            operation has already been handled.
+        """
+        exception, traceback = exc_info
+        identifier, cls = pid.split('.')[:2]
+        for _pid, _exception in self.ProcessHandler._handled_exceptions:
+            if identifier+'.'+cls in _pid:
+                return None
+        self.ProcessHandler._handled_exceptions.append((pid, exception))
+        msg = 'Exception in ' + pid + ':\n' + traceback
+        self.ProcessHandler.abort(identifier)
+        return msg
+
 
 #TODO add some progress indicator for command line users
 class ShellPolls(BasePolls):
@@ -61,109 +73,54 @@ class ShellPolls(BasePolls):
         process will also be shutdown, i.e., tasks distributed across multple 
         cores will see all their associated threads terminate. The exception will 
         also be printed to the screen and logged.
+
+        Both polls sleep on the ProcessHandler's state condition rather than a 
+        fixed interval, so they react as soon as a thread finishes or an 
+        exception is reported.
     """
     def __init__(self, ProcessHandler):
         super(ShellPolls, self).__init__(ProcessHandler)
 
     def _start_thread_poll(self):
-        if not self._is_polling_threads:
-            self._tpoll = Thread(target=self._thread_poll)
-            self._tpoll.start()
-            self._is_polling_threads = True
+        with self.ProcessHandler._state:
+            if not self._is_polling_threads:
+                self._tpoll = Thread(target=self._thread_poll)
+                self._tpoll.daemon = True
+                self._is_polling_threads = True
+                self._tpoll.start()
 
     def _thread_poll(self):
-        while True:
-            time.sleep(1.0)
-            if (not self._should_poll or 
-                not self.ProcessHandler._are_active_processes()):
-                self._is_polling_threads = False
-                break
-            self.ProcessHandler._clear_inactive()
-            self.ProcessHandler._submit_waiting()
+        PH = self.ProcessHandler
+        with PH._state:
+            while True:
+                if not self._should_poll or not PH._are_active_processes():
+                    self._is_polling_threads = False
+                    break
+                PH._clear_inactive()
+                PH._submit_waiting()
+                PH._state.wait(PH.poll_timeout)
             
     def _start_exception_poll(self):
-        if not self._is_polling_exceptions:
-            self._epoll = Thread(target=self._exception_poll)
-            self._epoll.start()
-            self._is_polling_exceptions = True
+        with self.ProcessHandler._state:
+            if not self._is_polling_exceptions:
+                self._epoll = Thread(target=self._exception_poll)
+                self._epoll.daemon = True
+                self._is_polling_exceptions = True
+                self._epoll.start()
 
     def _exception_poll(self):
+        PH = self.ProcessHandler
         while True:
-            time.sleep(1.0)
-            if (not self._should_poll or 
-                not self.ProcessHandler._are_active_processes()):
-                self._is_polling_exceptions = False
-                break
+            with PH._state:
+                while PH._exception_queue.empty():
+                    if not self._should_poll or not PH._are_active_processes():
+                        self._is_polling_exceptions = False
+                        return
+                    PH._state.wait(PH.poll_timeout)
             try:
-                pid, exc_info = self.ProcessHandler._exception_queue.get_nowait()
+                pid, exc_info = PH._exception_queue.get_nowait()
             except Empty:
-                pass
-            else:
-                exception, traceback = exc_info
-                for _pid, _exception in self.ProcessHandler._handled_exceptions:
-                    identifier, cls = pid.split('.')[:2]
-                    if identifier+'.'+cls in _pid:
-                        return True
-                self.ProcessHandler._handled_exceptions.append((pid, exception))
-                msg = 'Exception in ' + pid + ':\n' + traceback
-                identifier = pid.split('.')[0]
-                self.ProcessHandler.abort(identifier)
+                continue
+            msg = self._handle_exception(pid, exc_info)
+            if msg is not None:
                 print (msg)
-                
-
-
-class GUIPolls(BasePolls):
-    """ Monitors the CPU bound threads, submitting waiting processes when others 
-        finish, and will abort a process when an exception arises. In the event 
-        of an exception, all processes running in conjunction to the failed 
-        process will also be shutdown, i.e., tasks distributed across multple 
-        cores will see all their associated threads terminate. The exception will 
-        also be displayed in a dialog box and logged.
-    """
-    def __init__(self, ProcessHandler):
-        super(GUIPolls, self).__init__(ProcessHandler)
-
-    def _start_thread_poll(self):
-        if not self._is_polling_threads:
-            GObject.timeout_add(1000, self._thread_poll)
-            self._is_polling_threads = True
-        
-    def _thread_poll(self):
-        #if (not self._should_poll or 
-        #    not self.ProcessHandler._are_active_processes()):
-        #    self._is_polling_threads = False
-        #    self._should_poll = False
-        #    return False
-        self.ProcessHandler._clear_inactive()
-        self.ProcessHandler._submit_waiting()
-        return True
-
-    def _start_exception_poll(self):
-        if not self._is_polling_exceptions:
-            GObject.timeout_add(500, self._exception_poll)
-            self._is_polling_exceptions = True
-
-    def _exception_poll(self):
-        #if (not self._should_poll or 
-        #    not self.ProcessHandler._are_active_processes()):
-        #    self._is_polling_exceptions = False
-        #    self._should_poll = False
-        #    return False
-        try:
-            #print ('epoll')
-            pid, exc_info = self.ProcessHandler._exception_queue.get_nowait()
-        except Empty:
-            return True
-        else:
-            exception, traceback = exc_info
-            for _pid, _exception in self.ProcessHandler._handled_exceptions:
-                identifier, cls = pid.split('.')[:2]
-                if identifier+'.'+cls in _pid:
-                    return True
-            self.ProcessHandler._handled_exceptions.append((pid, exception))
-            msg = 'Exception in ' + pid + ':\n' + traceback
-            identifier = pid.split('.')[0]
-            self.ProcessHandler.abort(identifier)
-            ca.dialog(message=msg)
-            return True
-            
@@ -5,22 +5,176 @@ from copy import copy
 from collections import OrderedDict
 from datetime import date
 import multiprocessing
-from threading import Thread
+import itertools
+from threading import Thread, Condition, Lock, RLock, current_thread, local
+from contextlib import contextmanager
 from queue import Queue, Empty
 import logging
 
+import registry
 from util import Util
+from memory import MemoryBudget
+from driver import SubprocessDriver
 from environment import Environment, Scandata
-from core.featuredetection import FeatureDetection
-from core.derive import PDF
-from core.derive import Djvu
-from core.derive import EPUB
-from core.derive import PlainText
-from core.crop import Crop
-from core.ocr import OCR
-from core.capture import ImageCapture
-from gui.common import CommonActions as ca
+from core.operation import Operation
 from poll import PollsFactory
+from spool import Spool
+from journal import Journal
+from buildcache import BuildCache
+from controller import ConcurrencyController
+from cancellation import CancellationToken
+from progress import ProgressModel
+
+
+class FairShare(object):
+    """ Hands out a fixed budget of slots to the leaf work of any number of 
+        books. When slots are contended, the waiter whose book currently holds
+        the fewest slots goes next (the longest waiting one on a tie), so 
+        books being processed together interleave their leaves instead of 
+        running one after another.
+
+        Work is leased at a priority: 'batch' (0) or anything higher, such 
+        as 'interactive'. Higher priorities always go first, and may also use
+        'reserved' slots beyond the budget that batch work never gets, so an
+        operator's single-leaf job starts at once even with every slot busy.
+        Batch work holding a slot yields it between leaves ('checkpoint') 
+        while higher priority work is waiting.
+
+        Every ProcessHandling of a process shares one pool (see 'shared'), as
+        they share the machine's cores; the budget is the 'jobs' of the one
+        created last ('resize').
+    """
+    batch = 0
+    interactive = 10
+    _shared = None
+    _shared_lock = Lock()
+
+    def __init__(self, slots, reserved=1):
+        self.slots = slots
+        self.reserved = reserved
+        self.held = {}
+        self._waiters = []
+        self._ticket = 0
+        self._state = Condition()
+        self._leases = local()
+
+    @classmethod
+    def shared(cls, slots=None):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(slots if slots else 
+                                  (os.cpu_count() or 1))
+            elif slots:
+                cls._shared.resize(slots)
+            return cls._shared
+
+    def resize(self, slots):
+        """ Changes the budget; work already holding slots beyond a smaller
+            one keeps them until it releases them.
+        """
+        with self._state:
+            self.slots = max(1, slots)
+            self._state.notify_all()
+
+    def in_use(self):
+        return sum(self.held.values())
+
+    def idle(self):
+        """ Whether a slot is free with nothing waiting for one. """
+        with self._state:
+            return not self._waiters and self.in_use() < self.slots
+
+    def _is_next(self, waiter):
+        priority = waiter[0]
+        capacity = self.slots
+        if priority > FairShare.batch:
+            capacity += self.reserved
+        if self.in_use() >= capacity:
+            return False
+        best = min(self._waiters, 
+                   key=lambda w: (-w[0], self.held.get(w[2], 0), w[1]))
+        return best is waiter
+
+    def acquire(self, identifier, priority=batch):
+        with self._state:
+            self._ticket += 1
+            waiter = (priority, self._ticket, identifier)
+            self._waiters.append(waiter)
+            try:
+                while not self._is_next(waiter):
+                    self._state.wait()
+            finally:
+                self._waiters.remove(waiter)
+            self.held[identifier] = self.held.get(identifier, 0) + 1
+            if self._waiters:
+                self._state.notify_all()
+        self._get_leases().append((identifier, priority))
+
+    def try_acquire(self, identifier, priority=batch):
+        """ Takes a slot only if one is free and nothing that would go 
+            first is waiting for it. The slot isn't a lease of the calling
+            thread, which 'checkpoint' would step aside from; it is given 
+            back with release(identifier, lease=False).
+        """
+        with self._state:
+            capacity = self.slots
+            if priority > FairShare.batch:
+                capacity += self.reserved
+            if self.in_use() >= capacity or \
+                    [w for w in self._waiters if w[0] >= priority]:
+                return False
+            self.held[identifier] = self.held.get(identifier, 0) + 1
+            return True
+
+    def release(self, identifier, lease=True):
+        leases = self._get_leases() if lease else []
+        for num in range(len(leases)-1, -1, -1):
+            if leases[num][0] == identifier:
+                del leases[num]
+                break
+        with self._state:
+            if self.held.get(identifier, 0) > 0:
+                self.held[identifier] -= 1
+                if not self.held[identifier]:
+                    del self.held[identifier]
+            self._state.notify_all()
+
+    def release_all(self, identifier):
+        """ Frees the slots of an aborted book, whose threads may never get 
+            to release them. 
+        """
+        with self._state:
+            if identifier in self.held:
+                del self.held[identifier]
+            self._state.notify_all()
+
+    def checkpoint(self):
+        """ Called by leaf work between leaves; if the calling thread holds 
+            a slot that higher priority work is waiting for, it steps aside
+            and waits its turn again.
+        """
+        leases = self._get_leases()
+        if not leases:
+            return
+        identifier, priority = leases[-1]
+        with self._state:
+            if not [w for w in self._waiters if w[0] > priority]:
+                return
+        self.release(identifier)
+        self.acquire(identifier, priority)
+
+    def _get_leases(self):
+        if not hasattr(self._leases, 'held'):
+            self._leases.held = []
+        return self._leases.held
+
+    @contextmanager
+    def slot(self, identifier, priority=batch):
+        self.acquire(identifier, priority)
+        try:
+            yield
+        finally:
+            self.release(identifier)
 
 
 class ProcessHandling(object):
@@ -50,34 +204,140 @@ class ProcessHandling(object):
         simultaneously. Note that 'drain_queue' blocks in either mode; in 'sync'
         mode this is implied, while in 'async' mode 'drain_queue' checks for all
         spawned threads to indicate they are finished before exiting.
+
+        A third mode, 'stream', drains like 'sync' except that consecutive 
+        multithreaded operations on the same book are run as one per-leaf 
+        pipeline (see Operation.stream); only operations marked as a 
+        'barrier' hold back the ones queued after them until every leaf is
+        done.
+
+        'executor' selects how an operation's leaf chunks are run: 'thread'
+        runs them directly on the chunk threads, 'process' runs each chunk in
+        a forked child process and merges the results back into the book, 
+        and 'spool' queues each chunk in 'spool_dir' for bookmaker-worker 
+        processes to run (see bookmaker_worker.py), in which case 'jobs' is 
+        how many chunks may be out with the workers at once.
+        'scheduling' selects how leaves are split between those chunks: 
+        'static' gives each thread one contiguous slice up front, 'dynamic'
+        has the threads pull 'batch_size' leaves at a time from a shared 
+        queue until the book is done. With 'adaptive' set, leaves are always 
+        pulled in batches and a ConcurrencyController varies how many of an
+        operation's threads run at once, so each stage settles at the 
+        concurrency that gets it done fastest.
+
+        'jobs' is the global budget of leaf work that may run at once, over
+        all books; chunks (or batches, with dynamic scheduling) lease a slot
+        from 'slots' while they run. 'drain_queues' drains up to 'max_books'
+        books' queues at the same time, sharing those slots fairly.
+
+        Each book's finished leaves are recorded in a Journal as they 
+        complete. With 'resume' set, the journal of the previous run is read
+        back, and operations skip the leaves it shows as done; a full run
+        that starts the book's work over starts its journal over too.
+
+        With 'incremental' set, each book gets a BuildCache and component 
+        runs whose inputs and outputs haven't changed since they were last
+        made are skipped, so only the leaves that were re-shot or re-cropped
+        are redone.
+
+        Component processes are also admitted against a MemoryBudget of
+        'memory_budget' bytes (by default, the memory available at 
+        startup), using each component's learned peak RSS, so
+        a wide 'jobs' doesn't drive the machine into swap; the processes of
+        the 'process' executor and spool workers on the same machine count
+        against the same budget. Operations that
+        run many short tools per chunk do so on the SubprocessDriver, which
+        runs up to 'jobs' of them at once on a single event loop.
+
+        With 'speculate' set, threads of the 'thread' executor that run out
+        of leaves while slots are free start another attempt at a leaf
+        taking far longer than the others (see Speculator), and the first
+        attempt to finish it wins. Each attempt writes its tools' declared
+        files under names of its own, and the winner's are renamed into 
+        place (see Component.get_attempt).
+
+        'abort' cancels the book's CancellationToken: its leaf work stops at
+        the next leaf and the process groups of its tools are sent SIGTERM,
+        then SIGKILL if they are still there after Util.kill_timeout.
+        Leaves that keep failing are quarantined rather than aborting their
+        book (see Operation); 'has_quarantined' then reports it, and each
+        drained queue logs a run report of its books' resource usage and 
+        quarantined leaves.
+
+        'progress' (a ProgressModel) estimates how long each book has left 
+        from the throughput its operations are getting; see 'get_progress'.
+
+        Scheduling is event driven: every state change (a thread finishing, 
+        an exception being reported, an abort) notifies '_state', so threads
+        waiting on a free slot or for a queue to go idle wake immediately. 
+        'poll_timeout' only bounds how long a waiter sleeps before re-checking
+        that polling hasn't been stopped.
     """
+    poll_timeout = 5.0
+    _queue_numbers = itertools.count(1)
+
     _thread_count_ignore = ('drain_queue',
                            'handle_thread_exceptions',
                            'distribute',
                            'run_pipeline')
 
-    def __init__(self, max_threads=None, min_threads=None):        
+    def __init__(self, max_threads=None, min_threads=None, executor='thread',
+                 scheduling='static', batch_size=1, jobs=None, max_books=None,
+                 spool_dir=None, resume=False, incremental=False,
+                 adaptive=False, memory_budget=None, speculate=False):
         try:
             self.cores = multiprocessing.cpu_count()
         except NotImplemented:
             self.cores = 1
+        self.jobs = jobs if jobs else self.cores
+        self.max_books = max_books if max_books else self.jobs
         if max_threads:
             self.max_threads = max_threads
         else:
-            self.max_threads = self.cores
+            # threads only wait on 'slots' for the actual work, so this is
+            # just a ceiling on how many exist: enough for every slot to be
+            # busy, and for each book in progress to have one waiting
+            self.max_threads = self.jobs + self.max_books
         if min_threads:
             self.min_threads = min_threads
         else:
-            self.min_threads = self.max_threads
+            self.min_threads = self.jobs
+        self.slots = FairShare.shared(self.jobs)
+        self.memory = MemoryBudget.shared()
+        SubprocessDriver.shared().set_limit(self.jobs)
+        if memory_budget:
+            self.memory.set_limit(memory_budget)
+        if executor not in ('thread', 'process', 'spool'):
+            raise ValueError('Unknown executor \'' + str(executor) + '\'')
+        self.executor = executor
+        if executor == 'spool':
+            if not spool_dir:
+                raise ValueError('The spool executor needs a spool_dir')
+            self.spool = Spool(spool_dir)
+        else:
+            self.spool = None
+        if scheduling not in ('static', 'dynamic'):
+            raise ValueError('Unknown scheduling \'' + str(scheduling) + '\'')
+        self.scheduling = scheduling
+        self.batch_size = max(1, int(batch_size))
+        self.resume = resume
+        self.journals = {}
+        self.incremental = incremental
+        self.adaptive = adaptive
+        self.speculate = speculate
+        self.controllers = {}
+        self.tokens = {}
         self.processes = 0
         self._active_threads = {}
         self._inactive_threads = OrderedDict()
         self._item_queue = OrderedDict()
         self._waiting = set()
         self._exception_queue = Queue()
+        self._state = Condition(RLock())
         self.Polls = PollsFactory(self)
         self._handled_exceptions = []
         self.OperationObjects = {}
+        self.progress = ProgressModel(self)
         
     def _are_active_processes(self):
         if (self.processes == 0 and
@@ -106,84 +366,122 @@ class ProcessHandling(object):
         return False
 
     def _wait_till_idle(self, pids):
-        finished = set()
-        while True:
-            if not self.Polls._should_poll:
-                break            
-            active_pids = set()
-            for pid, thread in self._active_threads.items():
-                active_pids.add(pid)
-            for pid in pids:
-                identifier = pid.split('.')[0]
-                self.raise_child_exception(identifier)
-                if pid not in active_pids and pid not in self._item_queue:
-                    finished.add(pid)
-            if len(finished) == len(pids):
-                break
-            else:
-                time.sleep(1)
+        with self._state:
+            while True:
+                if not self.Polls._should_poll:
+                    break
+                finished = set()
+                for pid in pids:
+                    identifier = pid.split('.')[0]
+                    self.raise_child_exception(identifier)
+                    if (pid not in self._active_threads and 
+                        pid not in self._item_queue):
+                        finished.add(pid)
+                if len(finished) == len(pids):
+                    break
+                self._state.wait(self.poll_timeout)
+
+    def _notify(self):
+        with self._state:
+            self._state.notify_all()
 
     def _wait(self, func, pid, args, kwargs):
-        if not pid in self._item_queue:
-            self._item_queue[pid] = (func, args, kwargs)
+        with self._state:
+            if not pid in self._item_queue:
+                self._item_queue[pid] = (func, args, kwargs)
 
     def _submit_waiting(self):
-        queue = []
-        for pid, item in self._item_queue.items():
-            func, args, kwargs = item
-            if self.add_process(func, pid, args, kwargs):
-                queue.append(pid)
-                time.sleep(1)
-            else:
-                break
-        queue.reverse()
-        for pid in queue:
-            del self._item_queue[pid]
+        with self._state:
+            queue = []
+            for pid, item in self._item_queue.items():
+                func, args, kwargs = item
+                if self._already_processing(pid):
+                    break
+                self._clear_exceptions(pid)
+                if self._start_thread(func, pid, args, kwargs):
+                    queue.append(pid)
+                else:
+                    break
+            for pid in queue:
+                del self._item_queue[pid]
 
     def _clear_inactive(self):
-        inactive = {}
-        for pid, thread in self._active_threads.items():
-            if not thread.is_alive():
+        with self._state:
+            inactive = {}
+            for pid, thread in self._active_threads.items():
+                if thread.finished or not thread.is_alive():
+                    if thread.end_time is None:
+                        thread.end_time = Util.microseconds()
+                    exec_time = round((thread.end_time - 
+                                       thread.start_time)/60, 2)
+                    thread.logger.info('Thread ' + str(pid) + 
+                                       ' finished in ' + str(exec_time) + 
+                                       ' minutes')
+                    inactive[pid] = thread
+            for pid, thread in inactive.items():
+                if thread.func not in ProcessHandling._thread_count_ignore:
+                    identifier, cls = pid.split('.')[:2]
+                    operation = self.OperationObjects.get(identifier, 
+                                                          {}).get(cls)
+                    if operation is not None:
+                        operation.thread_count -= 1
+                    self.processes -= 1
+                self._inactive_threads[pid] = thread
+                del self._active_threads[pid]
+
+    def _thread_finished(self, pid):
+        """ Called from the finishing thread itself, so the slot it held is
+            handed to the next waiting item and any waiters are woken without
+            having to wait for a poll.
+        """
+        with self._state:
+            thread = self._active_threads.get(pid)
+            if thread is current_thread():
+                thread.finished = True
                 thread.end_time = Util.microseconds()
-                exec_time = round((thread.end_time - thread.start_time)/60, 2)
-                thread.logger.info('Thread ' + str(pid) + 
-                                   ' finished in ' + str(exec_time) + 
-                                   ' minutes')
-                inactive[pid] = thread
-        for pid, thread in inactive.items():
-            if thread.func not in ProcessHandling._thread_count_ignore:
-                identifier, cls = pid.split('.')[:2]
-                self.OperationObjects[identifier][cls].thread_count -= 1
-                self.processes -= 1
-            self._inactive_threads[pid] = thread
-            del self._active_threads[pid]
+            self._clear_inactive()
+            self._submit_waiting()
+            self._state.notify_all()
 
     def abort(self, identifier=None, exception=RuntimeError('Aborted.')):
-        if not identifier:
-            self._item_queue = OrderedDict()
-            self._waiting = set()
-        destroy = []
-        for pid, thread in self._active_threads.items():
+        if identifier:
+            identifiers = [identifier]
+        else:
+            identifiers = list(self.OperationObjects)
+        for _identifier in identifiers:
+            self.get_token(_identifier).cancel(str(exception))
+            self.slots.release_all(_identifier)
+        with self._state:
             if not identifier:
-                destroy.append(pid)
-            else:
-                if pid.startswith(identifier):
+                self._item_queue = OrderedDict()
+                self._waiting = set()
+            destroy = []
+            for pid, thread in self._active_threads.items():
+                if not identifier:
                     destroy.append(pid)
-        for pid in destroy:
-            self._destroy_thread(pid)
-            identifier = pid.split('.')[0]
-            if identifier in self.OperationObjects:
-                for op, cls in self.OperationObjects[identifier].items():
-                    cls.abort()
-                    self._handled_exceptions.append((pid, exception))
+                else:
+                    if pid.startswith(identifier):
+                        destroy.append(pid)
+            aborted = []
+            for pid in destroy:
+                self._destroy_thread(pid)
+                identifier = pid.split('.')[0]
+                if identifier in self.OperationObjects:
+                    for op, cls in self.OperationObjects[identifier].items():
+                        aborted.append(cls)
+                        self._handled_exceptions.append((pid, exception))
+            self._state.notify_all()
+        for cls in aborted:
+            cls.abort()
 
     def _destroy_thread(self, pid):
-        if pid in self._active_threads:
-            thread = self._active_threads[pid]
-            thread.logger.info('Destroying Thread ' + str(pid))
-            if thread.func not in ProcessHandling._thread_count_ignore:
-                self.processes -= 1
-            del self._active_threads[pid]
+        with self._state:
+            if pid in self._active_threads:
+                thread = self._active_threads[pid]
+                thread.logger.info('Destroying Thread ' + str(pid))
+                if thread.func not in ProcessHandling._thread_count_ignore:
+                    self.processes -= 1
+                del self._active_threads[pid]
 
     def _clear_exceptions(self, pid):
         remove = []
@@ -196,6 +494,10 @@ class ProcessHandling(object):
                 del self._handled_exceptions[num]
 
     def had_error(self, identifier, cls=None, mth=None):
+        """ Returns whether the work failed or was aborted. Work that 
+            finished but quarantined some leaves didn't fail; see 
+            'has_quarantined'.
+        """
         if cls: 
             _pid = '.'.join(('^', identifier, cls + '.[0-9]*'))
             if mth: 
@@ -207,11 +509,31 @@ class ProcessHandling(object):
             if re.match(_pid, pid):
                 return True
         else:
-            for cls in self.OperationObjects[identifier].values():
-                if cls.aborted:
+            for operation in self.OperationObjects.get(identifier, 
+                                                       {}).values():
+                if operation.aborted:
                     return True
         return False
 
+    def has_quarantined(self, identifier, cls=None):
+        """ Whether the book's operations (or just 'cls') quarantined any
+            leaves, i.e. finished only partially.
+        """
+        return bool(self.get_quarantined(identifier, cls))
+
+    def get_quarantined(self, identifier, cls=None):
+        """ Returns the leaves of a book quarantined by its operations (or
+            just by 'cls'), as {leaf: (operation, component, reason)}.
+        """
+        quarantined = {}
+        for name, operation in self.OperationObjects.get(identifier, 
+                                                         {}).items():
+            if cls and name != cls:
+                continue
+            for leaf, (component, reason) in operation.quarantined.items():
+                quarantined[leaf] = (name, component, reason)
+        return quarantined
+
     def raise_child_exception(self, identifier):
         for item in self._handled_exceptions:
             pid, exception = item
@@ -220,6 +542,7 @@ class ProcessHandling(object):
 
     def join(self, args):
         self._exception_queue.put(args)
+        self._notify()
         self._exception_queue.join()
 
     def _parse_args(self, args, kwargs):
@@ -230,6 +553,12 @@ class ProcessHandling(object):
         return args, kwargs
 
     def _parse_queue_data(self, data):
+        if 'func' not in data and 'operation' in data:
+            cls, mth, book = data['operation']
+            func = self._get_operation_method(cls, mth, book)
+            if data.get('priority') is not None:
+                func.__self__.priority = data['priority']
+            data['func'] = func
         d = []
         if 'func' not in data:
             raise LookupError('Failed to find \'func\' argument; nothing to do.')
@@ -247,31 +576,124 @@ class ProcessHandling(object):
             def __init__(self, ProcessHandler):
                 self.ProcessHandler = ProcessHandler
                 self.queue = OrderedDict()
-            def add(self, book, cls=None, mth=None, args=None, kwargs=None):
+            def add(self, book, cls=None, mth=None, args=None, kwargs=None,
+                    priority=None):
+                """ 'priority' sets the lane the operation's leaf work is 
+                    scheduled in, e.g. FairShare.interactive for work an 
+                    operator is waiting on.
+                """
                 if not cls or not mth:
                     raise ValueError
+                elif isinstance(mth, str):
+                    pid = '.'.join((book.identifier, cls, mth))
+                    # the operation is only made once the item is drained
+                    # (see _parse_queue_data), as making it loads the book
+                    self.queue[pid] = {'operation': (cls, mth, book),
+                                       'priority': priority,
+                                       'args': args,
+                                       'kwargs': kwargs}
                 else:
-                    if isinstance(mth, str):
-                        pid = '.'.join((book.identifier, cls, mth))
-                        f = self.ProcessHandler._get_operation_method(cls, mth, book)
-                    else:
-                        pid = '.'.join((book.identifier, cls, mth.__name__))
-                        f = mth
-                    self.queue[pid] = {'func': f,
+                    pid = '.'.join((book.identifier, cls, mth.__name__))
+                    if priority is not None and \
+                            isinstance(getattr(mth, '__self__', None), Operation):
+                        mth.__self__.priority = priority
+                    self.queue[pid] = {'func': mth,
                                        'args': args,
                                        'kwargs': kwargs}                    
-            def drain(self, mode, thread=False):
+            def drain(self, mode, thread=False, report=True, release=False):
                 if not thread:
-                    self.ProcessHandler.drain_queue(self.queue, mode)
+                    self.ProcessHandler.drain_queue(self.queue, mode, 
+                                                    report=report,
+                                                    release=release)
                 else:
                     fnc = self.ProcessHandler.drain_queue
-                    pid = '.'.join((self.__str__(), fnc.__name__))
+                    # numbered rather than named after the object, whose
+                    # address a later queue may get
+                    number = next(ProcessHandling._queue_numbers)
+                    pid = '.'.join(('<queue ' + str(number) + '>', 
+                                    fnc.__name__))
                     args = [self.queue, ]
-                    kwargs = {'mode': 'sync'}
-                    self.ProcessHandler.add_process(fnc, pid, args, kwargs)
+                    kwargs = {'mode': 'stream' if mode == 'stream' else 'sync',
+                              'release': release}
+                    if not self.ProcessHandler.add_process(fnc, pid, args, 
+                                                           kwargs):
+                        raise RuntimeError('Failed to start draining ' + pid)
+                    return pid
         return ProcessQueue(self)
 
-    def drain_queue(self, queue, mode, qpid=None, qlogger=None):
+    def drain_queues(self, queues, mode='sync'):
+        """ Drains the queues of several books at once, each on its own 
+            thread, with no more than 'max_books' in progress at a time. 
+            Their leaf work competes for the same 'slots', so throughput 
+            scales with 'jobs' across a whole collection. 'queues' may be 
+            any iterable, so books can be fed in as they are found. Each 
+            book is released (see Book.release) once its queue is drained,
+            so only the books in progress hold their state. Blocks until
+            every queue is drained.
+        """
+        pids = []
+        queues = iter(queues)
+        while True:
+            with self._state:
+                while True:
+                    self._forget_drained(pids)
+                    if len(pids) < self.max_books or \
+                            not self.Polls._should_poll:
+                        break
+                    self._state.wait(self.poll_timeout)
+            # taken only once there is room for it, as making a queue may
+            # load its book
+            queue = next(queues, None)
+            if queue is None:
+                break
+            pids.append(queue.drain(mode, thread=True, release=True))
+        self._wait_till_idle(pids)
+        with self._state:
+            self._forget_drained(pids)
+
+    def _forget_drained(self, pids):
+        """ Drops the queues in 'pids' that are drained, and their threads,
+            so a long run doesn't keep one for every book.
+        """
+        for pid in [pid for pid in pids if pid not in self._active_threads]:
+            pids.remove(pid)
+            self._inactive_threads.pop(pid, None)
+
+    def _get_stream_queue(self, queue):
+        """ Collapses runs of multithreaded operations on the same book into
+            single items that run them through Operation.stream. 
+        """
+        runs = []
+        for pid, data in queue.items():
+            func = self._parse_queue_data(data)[0]
+            identifier = pid.split('.')[0]
+            if (runs and hasattr(func, 'leafwise') and
+                runs[-1][-1][0].split('.')[0] == identifier and
+                hasattr(runs[-1][-1][1]['func'], 'leafwise') and
+                not runs[-1][-1][1]['func'].__self__.barrier):
+                runs[-1].append((pid, data))
+            else:
+                runs.append([(pid, data)])
+        stream_queue = OrderedDict()
+        for run in runs:
+            pid, data = run[0]
+            if len(run) == 1:
+                stream_queue[pid] = data
+                continue
+            stages = []
+            for _pid, _data in run:
+                func, args, kwargs = self._parse_queue_data(_data)
+                args, kwargs = self._parse_args(args, kwargs)
+                stages.append((func.__self__, func.leafwise, kwargs))
+            stream_queue[pid] = {'func': Operation.stream,
+                                 'args': [stages,]}
+        return stream_queue
+
+    def drain_queue(self, queue, mode, qpid=None, qlogger=None, report=True,
+                    release=False):
+        if mode == 'stream':
+            queue = self._get_stream_queue(queue)
+            mode = 'sync'
         self.Polls.start_polls()
         if qlogger and qpid:
             qstart = Util.microseconds()
@@ -285,13 +707,14 @@ class ProcessHandling(object):
             args, kwargs = self._parse_args(args, kwargs)
             identifier = pid.split('.')[0]
             logger = logging.getLogger(identifier)
-            if mode == 'sync':        
-                while not self.threads_available_for(pid):
-                    time.sleep(1.0)
-                    if not self.Polls._should_poll:
-                        break
-                else:
-                    self._waiting.remove(pid)
+            if mode == 'sync':
+                with self._state:
+                    while not self.threads_available_for(pid):
+                        if not self.Polls._should_poll:
+                            break
+                        self._state.wait(self.poll_timeout)
+                    else:
+                        self._waiting.remove(pid)
                 try:
                     start = Util.microseconds()
                     func(*args, **kwargs)
@@ -310,52 +733,107 @@ class ProcessHandling(object):
                 self.add_process(func, pid, args, kwargs)                
         if mode == 'async':
             self._wait_till_idle(pids)                        
+        if report:
+            self.log_run_report(pids)
         if qlogger and qpid:
             qend = Util.microseconds()
             qexec_time = str(round((qend - qstart)/60, 2))
             qlogger.info('Drained queue ' + qpid + ' in ' + 
                          qexec_time + ' minutes')
+        if release:
+            self.release_books(pids)
+
+    def release_books(self, pids):
+        """ Releases the books of 'pids' and forgets everything kept for 
+            them here: their operations, tokens and journals (which are 
+            closed), their progress, and the threads and errors of their 
+            work.
+        """
+        for identifier in OrderedDict.fromkeys([pid.split('.')[0] 
+                                                for pid in pids]):
+            prefix = identifier + '.'
+            with self._state:
+                journal = self.journals.pop(identifier, None)
+                operations = self.OperationObjects.pop(identifier, None)
+                self.tokens.pop(identifier, None)
+                for pid in [pid for pid in self._inactive_threads 
+                            if pid.startswith(prefix)]:
+                    del self._inactive_threads[pid]
+                self._handled_exceptions = [
+                    item for item in self._handled_exceptions 
+                    if not item[0].startswith(prefix)]
+            self.progress.forget(identifier)
+            if journal is not None:
+                journal.close()
+            if operations:
+                list(operations.values())[0].book.release()
         
+    def log_run_report(self, pids):
+        """ Logs what the component processes of the books in 'pids' have
+            used so far, and which of their leaves were quarantined.
+        """
+        for identifier in OrderedDict.fromkeys([pid.split('.')[0] 
+                                                for pid in pids]):
+            operations = self.OperationObjects.get(identifier)
+            if not operations:
+                continue
+            book = list(operations.values())[0].book
+            report = book.resource_usage.report()
+            if report:
+                book.logger.info('Resource usage:\n' + report)
+            quarantined = self.get_quarantined(identifier)
+            if quarantined:
+                book.logger.warning(
+                    'Quarantined ' + str(len(quarantined)) + ' leaves:\n' +
+                    '\n'.join([str(leaf) + ': ' + operation + '.' + 
+                               str(component) + ': ' + reason 
+                               for leaf, (operation, component, reason) 
+                               in sorted(quarantined.items())]))
+
     def threads_available_for(self, pid):
         if pid.startswith('<'):
             return True
-        identifier, cls = pid.split('.')[:2]
-        for _pid in self._active_threads:
-            if _pid.startswith('<'):
-                continue
-            i, c = _pid.split('.')[:2]
-            if i!=identifier and c!=cls:
-                return False
-        if self.cores - self.processes in range(1, self.max_threads+1):
-            return True
-        else:
-            return False
+        return self.processes < self.max_threads
                      
     def add_process(self, func, pid, args=None, kwargs=None):
-        if self._already_processing(pid):
-            return False
-        self._clear_exceptions(pid)
-        if not self.threads_available_for(pid):
-            self._wait(func, pid, args, kwargs)
-            return False
-        else:
+        with self._state:
+            if self._already_processing(pid):
+                return False
+            self._clear_exceptions(pid)
+            if not self._start_thread(func, pid, args, kwargs):
+                self._wait(func, pid, args, kwargs)
+                return False
+            return True
+
+    def _start_thread(self, func, pid, args=None, kwargs=None):
+        with self._state:
+            if not self.threads_available_for(pid):
+                return False
             self.Polls.start_polls()
             args, kwargs = self._parse_args(args, kwargs)
-            new_thread = Thread(target=func, name=pid, 
-                                args=args, kwargs=kwargs)
+            new_thread = Thread(target=self._run_thread, name=pid, 
+                                args=(func, pid, args, kwargs))
             new_thread.func = func.__name__
             new_thread.daemon = True
             identifier = pid.split('.')[0]
             new_thread.logger = logging.getLogger(identifier)
             new_thread.start_time = Util.microseconds()
-            new_thread.start()
+            new_thread.end_time = None
+            new_thread.finished = False
             self._active_threads[pid] = new_thread
             if new_thread.func not in ProcessHandling._thread_count_ignore:
                 self.processes += 1
+            new_thread.start()
             new_thread.logger.info('New Thread Started --> ' +
-                                   'Pid: ' + str(pid))                                   
+                                   'Pid: ' + str(pid))
             return True
 
+    def _run_thread(self, func, pid, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        finally:
+            self._thread_finished(pid)
+
     def add_operation_instance(self, instance, book):
         if not book.identifier in self.OperationObjects:
             self.OperationObjects[book.identifier] = {}
@@ -363,76 +841,98 @@ class ProcessHandling(object):
             self.OperationObjects[book.identifier][cls] = instance
 
     def _get_operation_method(self, cls, method, book):
-        if cls not in globals():
-            raise LookupError('Could not find module \'' + cls + '\'')
+        operation = registry.operations.get(cls)
         if not book.identifier in self.OperationObjects:
             self.OperationObjects[book.identifier] = {}
         if cls in self.OperationObjects[book.identifier]:
             instance = self.OperationObjects[book.identifier][cls]
         else:
-            instance = globals()[cls](self, book)
+            instance = operation(self, book)
             self.OperationObjects[book.identifier][cls] = instance
         instance.init_bookkeeping()
+        instance.set_token(self.get_token(book.identifier, renew=True))
+        if self.incremental and book.build_cache is None:
+            book.build_cache = BuildCache(book)
+        if instance.get_leaf_components():
+            instance.journal = self.get_journal(book)
+            if self.resume and instance.journal is not None:
+                instance.restore(instance.journal)
         function = getattr(self.OperationObjects[book.identifier][cls], method)
         return function
 
-    def get_time_elapsed(self, start_time):
-        current_time = time.time()
-        elapsed_secs = int(current_time - start_time)
-        elapsed_mins = int(elapsed_secs/60)
-        elapsed_secs -= elapsed_mins * 60
-        return elapsed_mins, elapsed_secs
-
-    def get_time_remaining(self, total, completed, avg_exec_time, thread_count):
-        fraction = float(completed) / (float(total))
-        remaining_page_count = total - completed
-        estimated_secs = int((int(avg_exec_time * remaining_page_count))/thread_count)
-        estimated_mins = int(estimated_secs/60)
-        estimated_secs -= estimated_mins * 60
-        return estimated_mins, estimated_secs
+    def get_controller(self, operation, maximum):
+        """ Each run of an operation gets a controller that starts from the
+            concurrency the last run of the same operation ended at.
+        """
+        if not self.adaptive:
+            return None
+        cls = operation.__class__.__name__
+        with self._state:
+            previous = self.controllers.get(cls)
+            initial = previous.limit if previous is not None else None
+            controller = ConcurrencyController(cls, 1, maximum, initial,
+                                               operation.book.logger)
+            self.controllers[cls] = controller
+        return controller
+
+    def get_token(self, identifier, renew=False):
+        """ The CancellationToken that 'abort' cancels for a book. With 
+            'renew', a cancelled one is replaced, as work queued after an
+            abort is meant to run.
+        """
+        with self._state:
+            token = self.tokens.get(identifier)
+            if token is None or (renew and token.cancelled):
+                token = CancellationToken()
+                self.tokens[identifier] = token
+            return token
+
+    def get_journal(self, book):
+        with self._state:
+            if book.identifier not in self.journals:
+                self.journals[book.identifier] = Journal(book, self.resume)
+            return self.journals[book.identifier]
+
+    def get_progress(self, identifier=None):
+        """ The ProgressModel's estimate for one book, or a snapshot of all
+            of them.
+        """
+        if identifier is not None:
+            return self.progress.get_book_state(identifier)
+        return self.progress.snapshot()
+
+    def split_time(self, seconds):
+        if seconds is None:
+            return '--', '--'
+        seconds = int(seconds)
+        return int(seconds/60), seconds - int(seconds/60) * 60
 
     def get_op_state(self, book, identifier, cls, total):
-        state = {'finished': False}
-        op_obj = self.OperationObjects[identifier][cls]
-        thread_count = self.OperationObjects[identifier][cls].thread_count
-        if op_obj.completed['__finished__']:
-            elapsed_mins, elapsed_secs = \
-                self.get_time_elapsed(book.start_time)
-            state['finished'] = True
-            state['completed'] = total
-            state['fraction'] = 1.0
-            state['estimated_mins'] = 0.0
-            state['estimated_secs'] = 0.0
-            state['elapsed_mins'] = elapsed_mins
-            state['elapsed_secs'] = elapsed_secs
-        elif thread_count > 0:
-            completed = 0
-            op_num = len(op_obj.completed) - 1
-            avg_exec_time = 0
-            for op, leaf_t, in op_obj.completed.items():
-                if op != '__finished__':
-                    c = len(leaf_t)
-                    completed += c
-                    if c > 0:
-                        avg_exec_time += op_obj.get_avg_exec_time(op)
-            fraction = float(completed)/(float(total)*op_num)
-            estimated_mins, estimated_secs = \
-                self.get_time_remaining(total, completed/op_num,
-                                        avg_exec_time,
-                                        thread_count)
-            elapsed_mins, elapsed_secs = \
-                self.get_time_elapsed(book.start_time)            
-            state['completed'] = completed
-            state['fraction'] = fraction
-            state['estimated_mins'] = estimated_mins
-            state['estimated_secs'] = estimated_secs
-            state['elapsed_mins'] = elapsed_mins
-            state['elapsed_secs'] = elapsed_secs
-        else:
-            state['completed'] = 0
-            state['fraction'] = 0.0
-            state['estimated_mins'] = '--'
-            state['estimated_secs'] = '--'
-            state['elapsed_mins'] = '--'
-            state['elapsed_secs'] = '--'
+        """ The progress of an operation in the form the GUI shows it (see 
+            ProgressModel.get_state for the rest).
+        """
+        progress = self.progress.get_state(identifier, cls)
+        if progress is None:
+            progress = {'finished': False, 'completed': 0, 'fraction': 0.0,
+                        'remaining': None, 'elapsed': None}
+        state = {'finished': progress['finished'],
+                 'completed': progress['completed'],
+                 'fraction': progress['fraction']}
+        state['estimated_mins'], state['estimated_secs'] = \
+            self.split_time(progress['remaining'])
+        state['elapsed_mins'], state['elapsed_secs'] = \
+            self.split_time(progress['elapsed'])
         return state
+
+
+def _reset_shared():
+    # a forked child keeps the slots its parent's books held, as they are
+    # still taken, but none of its waiters or locks
+    if FairShare._shared is not None:
+        FairShare._shared._waiters = []
+        FairShare._shared._state = Condition()
+        FairShare._shared._leases = local()
+    FairShare._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+from threading import Lock, Thread, Event
+
+
+class StageProgress(object):
+    """ How far one run of an operation on a book has got, and how fast its
+        components have been getting through leaves.
+    """
+    def __init__(self, operation, total, rates):
+        self.operation = operation
+        self.total = total
+        self.started = time.time()
+        self.finished = None
+        # init_bookkeeping starts a new one when the operation is queued again
+        self.completed = operation.completed
+        self.rates = dict(rates)
+        self.counts = self._get_counts()
+        self.window_start = self.started
+        self.slot_time = 0.0
+        self.last_sample = self.started
+        self.last_held = 0
+
+    def _get_counts(self):
+        completed = self.operation.completed
+        return dict([(cls, len(completed.get(cls, {}))) for cls in
+                     self.operation.get_leaf_components()])
+
+    def get_completed(self):
+        counts = self._get_counts()
+        if not counts:
+            return 0
+        return min(counts.values())
+
+
+class ProgressModel(object):
+    """ Estimates how long the operations queued on each book have left.
+
+        The throughput of each of an operation's leaf components is kept as
+        an exponentially weighted moving average ('alpha') of the leaves it
+        completed per slot-second, sampled at most every 'interval' seconds
+        from the slots the book held in the meantime. Measuring per slot
+        rather than per thread makes the rate independent of how the leaves
+        were chunked and of how many other books were sharing the cores; a
+        remaining time is then projected from the slots the book can expect
+        from now on, its fair share of 'slots' among the books with work
+        running, but no more than it has leaves left.
+
+        An operation is done when its slowest component is, and the
+        operations of a book running at the same time (streamed) overlap,
+        so a book's remaining time is the longest of those plus the time
+        its queued operations will take at the rates the last run of each
+        had. Where nothing is known yet the time remaining is None, as it
+        is until they finish for operations that don't count leaves (no
+        leaf components, e.g. EPUB).
+
+        Everything is available as plain dicts ('get_state',
+        'get_book_state', 'snapshot') and as JSON ('to_json', 'write').
+    """
+    alpha = 0.3
+    interval = 2.0
+
+    def __init__(self, ProcessHandler):
+        self.ProcessHandler = ProcessHandler
+        self.stages = {}
+        self.rates = {}
+        self._lock = Lock()
+
+    def start(self, operation, total):
+        """ Called as an operation starts distributing 'total' leaves. """
+        key = (operation.book.identifier, operation.__class__.__name__)
+        with self._lock:
+            self.stages[key] = StageProgress(operation, total,
+                                             self.rates.get(key[1], {}))
+
+    def finish(self, operation):
+        key = (operation.book.identifier, operation.__class__.__name__)
+        with self._lock:
+            stage = self.stages.get(key)
+            if stage is not None and stage.finished is None:
+                self._sample(stage, force=True)
+                stage.finished = time.time()
+
+    def forget(self, identifier):
+        """ Drops the stages of a book that is done with. """
+        with self._lock:
+            for key in [key for key in self.stages if key[0] == identifier]:
+                del self.stages[key]
+
+    def update(self, operation):
+        """ Called as leaves complete; folds in a new sample once one is
+            due.
+        """
+        key = (operation.book.identifier, operation.__class__.__name__)
+        with self._lock:
+            stage = self.stages.get(key)
+            if stage is not None and stage.finished is None:
+                self._sample(stage)
+
+    def _sample(self, stage, force=False):
+        now = time.time()
+        identifier = stage.operation.book.identifier
+        stage.slot_time += stage.last_held * (now - stage.last_sample)
+        stage.last_sample = now
+        stage.last_held = self.ProcessHandler.slots.held.get(identifier, 0)
+        if now - stage.window_start < self.interval and not force:
+            return
+        if stage.slot_time <= 0:
+            return
+        counts = stage._get_counts()
+        for cls, count in counts.items():
+            rate = (count - stage.counts.get(cls, 0)) / stage.slot_time
+            if cls in stage.rates:
+                rate = self.alpha * rate + (1 - self.alpha) * stage.rates[cls]
+            stage.rates[cls] = rate
+        stage.counts = counts
+        stage.window_start = now
+        stage.slot_time = 0.0
+        self.rates[stage.operation.__class__.__name__] = dict(stage.rates)
+
+    def get_share(self, identifier):
+        """ The slots a book can expect while the books now running share
+            them fairly.
+        """
+        running = set()
+        for key, stage in self.stages.items():
+            if stage.finished is None and stage.operation.thread_count > 0:
+                running.add(key[0])
+        running.add(identifier)
+        return float(self.ProcessHandler.slots.slots) / len(running)
+
+    def _get_remaining(self, stage, rates, share):
+        completed = stage.operation.completed
+        components = stage.operation.get_leaf_components()
+        if not components:
+            return None
+        remaining = 0.0
+        for cls in components:
+            left = stage.total - len(completed.get(cls, {}))
+            if left <= 0:
+                continue
+            if not rates.get(cls):
+                return None
+            slots = min(share, left, max(stage.operation.thread_count, 1))
+            remaining = max(remaining, left / (rates[cls] * slots))
+        return remaining
+
+    def get_state(self, identifier, cls):
+        """ Returns the progress of operation 'cls' on a book, or None if it
+            hasn't been queued.
+        """
+        with self._lock:
+            return self._get_state(identifier, cls)
+
+    def _get_state(self, identifier, cls):
+        operation = self.ProcessHandler.OperationObjects.get(
+            identifier, {}).get(cls)
+        if operation is None:
+            return None
+        stage = self.stages.get((identifier, cls))
+        finished = operation.completed['__finished__']
+        state = {'identifier': identifier, 'operation': cls,
+                 'finished': finished, 'running': False,
+                 'total': None, 'completed': 0, 'fraction': 0.0,
+                 'elapsed': None, 'remaining': None, 'rates': {}}
+        if stage is None or stage.completed is not operation.completed:
+            # queued, but not started on yet in this run
+            state['remaining'] = self._get_queued_remaining(operation)
+            if finished:
+                state['fraction'] = 1.0
+                state['remaining'] = 0.0
+            return state
+        if stage.finished is None:
+            self._sample(stage)
+        completed = stage.get_completed()
+        end = stage.finished if stage.finished is not None else time.time()
+        state['running'] = stage.finished is None and \
+            operation.thread_count > 0
+        state['total'] = stage.total
+        state['completed'] = completed
+        state['elapsed'] = end - stage.started
+        state['rates'] = dict(stage.rates)
+        if finished:
+            state['fraction'] = 1.0
+            state['remaining'] = 0.0
+        else:
+            if stage.total:
+                state['fraction'] = min(1.0, float(completed) / stage.total)
+            state['remaining'] = self._get_remaining(
+                stage, stage.rates, self.get_share(identifier))
+        return state
+
+    def _get_queued_remaining(self, operation):
+        cls = operation.__class__.__name__
+        rates = self.rates.get(cls)
+        if not rates:
+            return None
+        total = operation.book.page_count
+        slots = min(self.get_share(operation.book.identifier), total)
+        remaining = 0.0
+        for component in operation.get_leaf_components():
+            if not rates.get(component):
+                return None
+            remaining = max(remaining, total / (rates[component] * slots))
+        return remaining
+
+    def get_book_state(self, identifier):
+        with self._lock:
+            operations = [self._get_state(identifier, cls) for cls in
+                          self.ProcessHandler.OperationObjects.get(identifier,
+                                                                   {})]
+        operations = [state for state in operations if state is not None]
+        running = [state['remaining'] for state in operations
+                   if state['running']]
+        queued = [state['remaining'] for state in operations
+                  if not state['running'] and not state['finished']]
+        if None in running or None in queued:
+            remaining = None
+        else:
+            remaining = max(running + [0.0]) + sum(queued)
+        fraction = 0.0
+        if operations:
+            fraction = sum([state['fraction'] for state in operations]) / \
+                len(operations)
+        return {'identifier': identifier, 'fraction': fraction,
+                'remaining': remaining, 'operations': operations}
+
+    def snapshot(self):
+        return {'time': time.time(),
+                'books': [self.get_book_state(identifier) for identifier in
+                          list(self.ProcessHandler.OperationObjects)]}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=1, sort_keys=True)
+
+    def write(self, filename):
+        """ Replaces 'filename' with the current snapshot as JSON. """
+        temp = filename + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.to_json())
+        os.rename(temp, filename)
+
+    def publish(self, filename, every=None):
+        """ Writes the snapshot to 'filename' every 'every' seconds
+            (by default 'interval') from a thread of its own, until the
+            returned Event is set.
+        """
+        every = every if every else self.interval
+        stop = Event()
+        def run():
+            while not stop.wait(every):
+                try:
+                    self.write(filename)
+                except (OSError, IOError):
+                    pass
+        thread = Thread(target=run, name='ProgressModel')
+        thread.daemon = True
+        thread.start()
+        return stop
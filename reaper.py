@@ -0,0 +1,128 @@
+import os
+import sys
+import shutil
+import time
+from queue import Queue
+from threading import Thread, Lock, get_native_id
+
+
+class Reaper(object):
+    """ Deletes directories in the background, so clearing out a book's
+        intermediate files before a respawn doesn't hold up its processing.
+
+        'trash' renames a directory into a trash directory beside it,
+        '.bookmaker_trash' (a rename on the same filesystem, however many
+        files it holds), and leaves an empty one in its place; a thread of
+        the Reaper's own then deletes what was trashed, at the lowest CPU
+        priority and pausing for 'pause' seconds every 'batch' files, so it
+        takes what the leaf work leaves over. Whatever it doesn't get to
+        before the process exits is deleted the next time something is
+        trashed beside it.
+
+        There is one Reaper per process (see 'shared'); a forked child
+        leaves the deleting to its parent's, and starts its own if it
+        trashes anything.
+    """
+    _shared = None
+    _shared_lock = Lock()
+    trash_name = '.bookmaker_trash'
+    batch = 200
+    pause = 0.01
+
+    def __init__(self):
+        self.queue = Queue()
+        self.thread = None
+        self.trash_dirs = set()
+        self._lock = Lock()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def trash(self, dir, mode=0o755):
+        """ Empties 'dir' by moving it to the trash; returns False (having
+            done nothing) where it can't be moved, e.g. onto another
+            filesystem.
+        """
+        trash_dir = os.path.join(os.path.dirname(dir), self.trash_name)
+        target = os.path.join(trash_dir, os.path.basename(dir) + '.' +
+                              str(os.getpid()) + '.' +
+                              str(int(time.time() * 1000000)))
+        try:
+            if not os.path.isdir(trash_dir):
+                os.mkdir(trash_dir, mode)
+            os.rename(dir, target)
+        except OSError:
+            return False
+        os.mkdir(dir, mode)
+        with self._lock:
+            if trash_dir not in self.trash_dirs:
+                # left over from a run that exited before reaping them
+                self.trash_dirs.add(trash_dir)
+                for name in os.listdir(trash_dir):
+                    path = os.path.join(trash_dir, name)
+                    if path != target:
+                        self.queue.put(path)
+        self.queue.put(target)
+        self.start()
+        return True
+
+    def start(self):
+        with self._lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name='Reaper')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def wait(self):
+        """ Blocks until everything trashed so far is deleted. """
+        self.queue.join()
+
+    def _run(self):
+        if sys.platform.startswith('linux'):
+            # Linux keeps a nice value per thread, so the rest of the 
+            # process is unaffected
+            try:
+                os.setpriority(os.PRIO_PROCESS, get_native_id(), 19)
+            except OSError:
+                pass
+        while True:
+            path = self.queue.get()
+            try:
+                self.delete(path)
+            finally:
+                self.queue.task_done()
+
+    def delete(self, path):
+        count = 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    pass
+                count += 1
+                if count % self.batch == 0:
+                    time.sleep(self.pause)
+            for name in dirs:
+                try:
+                    os.rmdir(os.path.join(root, name))
+                except OSError:
+                    # e.g. a symlink to a directory
+                    try:
+                        os.remove(os.path.join(root, name))
+                    except OSError:
+                        pass
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _reset_shared():
+    if Reaper._shared is not None:
+        Reaper._shared = Reaper()
+    Reaper._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)
@@ -0,0 +1,128 @@
+import os
+import importlib
+from threading import Lock, RLock
+
+
+class Registry(object):
+    """ Maps the names of components or operations to their classes, which
+        are imported the first time they are asked for and cached from then
+        on, so a run only loads what it uses.
+
+        A name is registered with the class itself, a module path (the class
+        being the module's attribute of the same name) or 'module:attribute'.
+        Plugins can add or replace entries without any change here: either
+        as package entry points in 'group' (e.g. 'bookmaker.components'), or
+        as modules listed in the BOOKMAKER_PLUGINS environment variable
+        (comma separated) that call 'register' when imported. Both are
+        loaded on the first lookup.
+
+        Lookups are safe from any thread: the import machinery runs each
+        module once, and the cache is only written under a lock.
+    """
+    plugin_variable = 'BOOKMAKER_PLUGINS'
+    _plugins_loaded = False
+    _plugins_loading = False
+    _plugins_lock = RLock()
+
+    def __init__(self, group, kind):
+        self.group = group
+        self.kind = kind
+        self.sources = {}
+        self.classes = {}
+        self._lock = Lock()
+
+    def register(self, name, source, replace=True):
+        """ Registers 'name'; with 'replace' off an existing entry (e.g. one
+            a plugin made) is kept.
+        """
+        with self._lock:
+            if not replace and name in self.sources:
+                return
+            self.sources[name] = source
+            self.classes.pop(name, None)
+
+    def get(self, name):
+        cls = self.classes.get(name)
+        if cls is not None:
+            return cls
+        Registry.load_plugins()
+        with self._lock:
+            source = self.sources.get(name)
+        if source is None:
+            raise LookupError('Could not find ' + self.kind + ' \'' +
+                              str(name) + '\'')
+        cls = self._load(name, source)
+        with self._lock:
+            # a plugin may have replaced it in the meantime
+            if self.sources.get(name) is source:
+                self.classes[name] = cls
+        return cls
+
+    def names(self):
+        Registry.load_plugins()
+        with self._lock:
+            return sorted(self.sources)
+
+    def _load(self, name, source):
+        if isinstance(source, str):
+            module, _, attribute = source.partition(':')
+            return getattr(importlib.import_module(module),
+                           attribute or name)
+        if hasattr(source, 'load') and not isinstance(source, type):
+            # an entry point
+            return source.load()
+        return source
+
+    def _load_entry_points(self):
+        # imported here as it takes longer than the rest of startup
+        try:
+            from importlib.metadata import entry_points
+        except ImportError:
+            return
+        found = entry_points()
+        if hasattr(found, 'select'):
+            found = found.select(group=self.group)
+        else:
+            found = found.get(self.group, [])
+        for entry_point in found:
+            self.register(entry_point.name, entry_point)
+
+    @classmethod
+    def load_plugins(cls):
+        if cls._plugins_loaded:
+            return
+        with cls._plugins_lock:
+            # a plugin looking something up as it is imported gets what
+            # has been registered so far
+            if cls._plugins_loaded or cls._plugins_loading:
+                return
+            cls._plugins_loading = True
+            for registry in (components, operations):
+                registry._load_entry_points()
+            for module in os.environ.get(cls.plugin_variable, '').split(','):
+                if module.strip():
+                    importlib.import_module(module.strip())
+            cls._plugins_loaded = True
+
+
+components = Registry('bookmaker.components', 'component')
+operations = Registry('bookmaker.operations', 'operation')
+
+for name, module in (('FeatureDetection', 'core.featuredetection'),
+                     ('PDF', 'core.derive'),
+                     ('Djvu', 'core.derive'),
+                     ('EPUB', 'core.derive'),
+                     ('PlainText', 'core.derive'),
+                     ('Crop', 'core.crop'),
+                     ('OCR', 'core.ocr'),
+                     ('ImageCapture', 'core.capture')):
+    operations.register(name, module)
+
+
+def _reset_locks():
+    Registry._plugins_lock = RLock()
+    for registry in (components, operations):
+        registry._lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks)
@@ -0,0 +1,138 @@
+import os
+import time
+from threading import Lock, get_ident
+
+from util import Util
+
+
+class Speculator(object):
+    """ Finds the leaves of an operation that are taking far longer than
+        the rest, so a thread with nothing left to do can start a second
+        attempt at one and the book's assembly step isn't held up waiting
+        for a single pathological image.
+
+        The chunk threads tell it which range they are working through
+        ('begin' and 'end') and the operation which leaves are done
+        ('leaf_done'); a thread's current leaf is the first of its range not
+        yet done, and has been running since the one before it was. A leaf
+        is a straggler once it has run for 'factor' times the 'percentile'th
+        percentile of the time the leaves done so far took (their
+        components' exec times), once at least 'min_samples' are done.
+
+        Each leaf gets at most one extra attempt, and whichever attempt
+        finishes the leaf first wins: the tool processes the other one
+        started are killed, which makes it fail and move on, and whatever
+        it completes after that is ignored. A straggler stuck in Python 
+        rather than in a tool can't be stopped that way and still has to
+        finish on its own.
+
+        While it is in use the operation's components write their declared
+        files under names private to the attempt, and 'publish' renames the
+        files of whichever attempt finishes a run first into place, so a killed attempt never leaves a file cut short.
+    """
+    percentile = 90
+    factor = 2.0
+    min_samples = 5
+    interval = 0.5
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.ranges = {}
+        self.attempts = {}
+        self.published = set()
+        self._lock = Lock()
+
+    def begin(self, start, end):
+        with self._lock:
+            self.ranges[get_ident()] = [start, end, time.time()]
+
+    def end(self):
+        with self._lock:
+            self.ranges.pop(get_ident(), None)
+
+    def busy(self):
+        """ Whether any thread is still working through leaves. """
+        with self._lock:
+            return bool(self.ranges)
+
+    def leaf_done(self, leaf):
+        """ Called by the thread that completed 'leaf'; stops any other
+            attempt at it and moves the threads that were on it along.
+        """
+        now = time.time()
+        winner = get_ident()
+        losers = set()
+        with self._lock:
+            for ident, current in self.ranges.items():
+                if current[0] != leaf:
+                    continue
+                if ident != winner:
+                    losers.add(ident)
+                while current[0] < current[1] and \
+                        self.operation.is_leaf_done(current[0]):
+                    current[0] += 1
+                current[2] = now
+            attempt = self.attempts.get(leaf)
+            if attempt is not None and attempt != winner:
+                losers.add(attempt)
+        for ident in losers:
+            Util.kill_owned(ident)
+        if losers and leaf in self.attempts:
+            which = 'extra' if self.attempts[leaf] == winner else 'first'
+            self.operation.book.logger.info(
+                self.operation.__class__.__name__ + ': the ' + which +
+                ' attempt at leaf ' + str(leaf) + ' won; stopped the other')
+
+    def publish(self, cls, target, moves):
+        """ Renames the files an attempt's run of component 'cls' wrote 
+            for 'target' into place, given as (private, final) paths, unless
+            another attempt's already were. Returns whether they were.
+        """
+        with self._lock:
+            if (cls, target) in self.published:
+                return False
+            for private, final in moves:
+                os.rename(private, final)
+            self.published.add((cls, target))
+            return True
+
+    def get_threshold(self):
+        operation = self.operation
+        components = operation.get_leaf_components()
+        if not components:
+            return None
+        durations = []
+        for leaf in list(operation.completed.get(components[0], {})):
+            if operation.is_leaf_done(leaf):
+                durations.append(sum([operation.completed[cls][leaf]
+                                      for cls in components]))
+        if len(durations) < self.min_samples:
+            return None
+        durations.sort()
+        index = int(round(self.percentile / 100.0 * (len(durations) - 1)))
+        return self.factor * durations[index]
+
+    def pick(self):
+        """ Returns the longest running straggler that has no extra attempt
+            yet and marks it as getting one from the calling thread, or
+            None if there isn't one.
+        """
+        threshold = self.get_threshold()
+        if threshold is None:
+            return None
+        now = time.time()
+        with self._lock:
+            stragglers = [(now - since, leaf) for leaf, end, since in
+                          self.ranges.values() if leaf < end and
+                          leaf not in self.attempts and
+                          now - since > threshold and
+                          not self.operation.is_leaf_done(leaf)]
+            if not stragglers:
+                return None
+            elapsed, leaf = max(stragglers)
+            self.attempts[leaf] = get_ident()
+        self.operation.book.logger.info(
+            self.operation.__class__.__name__ + ': leaf ' + str(leaf) +
+            ' has run ' + str(round(elapsed, 1)) + 's (threshold ' +
+            str(round(threshold, 1)) + 's); starting another attempt')
+        return leaf
@@ -0,0 +1,202 @@
+import os
+import time
+import pickle
+import uuid
+from threading import Thread, Event
+from contextlib import contextmanager
+
+
+class Spool(object):
+    """ A job queue kept in a directory, so that bookmaker-worker processes
+        on this machine or on any other with the same filesystem mounted can
+        share a book's leaf work.
+
+        Tasks are written to 'tasks', claimed by renaming them into
+        'claimed' (rename is atomic, so only one worker wins) and answered
+        in 'results'. Files are always written under a temporary name and
+        renamed into place, so nobody reads a half written one.
+
+        A claim is a lease: the worker touches its claimed task every 
+        'heartbeat' seconds while it runs it (see 'holding'), and a claim
+        that hasn't been touched for 'lease' seconds, because its worker
+        died or lost the filesystem, is put back in 'tasks' for another
+        worker by whoever is collecting results. The lease is long enough
+        that the clocks of the machines sharing the spool needn't agree 
+        closely.
+
+        A task cancelled after it was claimed has its result thrown away
+        when it comes in; results nobody collected within a lease (e.g. of
+        a task that ended up run twice) are removed.
+    """
+    poll_interval = 0.1
+    heartbeat = 5.0
+    lease = 60.0
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.dirs = {}
+        for name in ('tasks', 'claimed', 'results'):
+            self.dirs[name] = self.root + '/' + name
+            os.makedirs(self.dirs[name], exist_ok=True)
+
+    def _write(self, path, obj):
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def submit(self, task):
+        """ Queues a task and returns the name to collect its result by.
+            Names sort by submission time, so workers take tasks in order.
+        """
+        name = '%020d-%s' % (time.time() * 1e6, uuid.uuid4().hex)
+        self._write(self.dirs['tasks'] + '/' + name + '.task', task)
+        return name
+
+    def cancel(self, name):
+        """ Withdraws task 'name', or if a worker has already claimed it,
+            marks it so that its result is thrown away.
+        """
+        try:
+            os.remove(self.dirs['tasks'] + '/' + name + '.task')
+            return
+        except OSError:
+            pass
+        marker = self.dirs['results'] + '/' + name + '.cancelled'
+        open(marker, 'wb').close()
+        # the result may have come in just before the marker did
+        if os.path.exists(self.dirs['results'] + '/' + name + '.result'):
+            self._discard(name)
+
+    def _discard(self, name):
+        for ext in ('.result', '.cancelled'):
+            try:
+                os.remove(self.dirs['results'] + '/' + name + ext)
+            except OSError:
+                pass
+
+    def collect(self, name, should_wait):
+        """ Blocks until the result of task 'name' is in, or 'should_wait'
+            returns False, in which case None is returned. Expired claims
+            are requeued while it waits.
+        """
+        path = self.dirs['results'] + '/' + name + '.result'
+        checked = time.time()
+        while not os.path.exists(path):
+            if not should_wait():
+                return None
+            if time.time() - checked >= self.heartbeat:
+                self.expire()
+                checked = time.time()
+            time.sleep(Spool.poll_interval)
+        result = self._read(path)
+        os.remove(path)
+        return result
+
+    def expire(self):
+        """ Requeues the claims whose lease has run out, unless their task
+            was cancelled, and removes results left uncollected for longer
+            than a lease.
+        """
+        now = time.time()
+        for filename in os.listdir(self.dirs['claimed']):
+            path = self.dirs['claimed'] + '/' + filename
+            try:
+                if now - os.stat(path).st_mtime < self.lease:
+                    continue
+            except OSError:
+                continue
+            name = filename.rsplit('__', 1)[-1][:-len('.task')]
+            if os.path.exists(self.dirs['results'] + '/' + name + 
+                              '.cancelled'):
+                self._remove(path)
+                self._discard(name)
+                continue
+            try:
+                os.rename(path, self.dirs['tasks'] + '/' + name + '.task')
+            except OSError:
+                pass
+        for filename in os.listdir(self.dirs['results']):
+            path = self.dirs['results'] + '/' + filename
+            try:
+                if now - os.stat(path).st_mtime >= self.lease:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def claim(self, worker):
+        """ Takes the oldest unclaimed task for 'worker'. Returns a
+            (name, task) tuple, or None if there is nothing to do.
+        """
+        for filename in sorted(os.listdir(self.dirs['tasks'])):
+            if not filename.endswith('.task'):
+                continue
+            name = filename[:-len('.task')]
+            claimed = self._claimed_path(worker, name)
+            try:
+                os.rename(self.dirs['tasks'] + '/' + filename, claimed)
+                # the lease runs from now, not from when it was queued
+                os.utime(claimed)
+                return name, self._read(claimed)
+            except OSError:
+                continue
+        return None
+
+    @contextmanager
+    def holding(self, worker, name):
+        """ Keeps 'worker''s claim on task 'name' from expiring while the
+            block runs.
+        """
+        done = Event()
+        def beat():
+            while not done.wait(self.heartbeat):
+                try:
+                    os.utime(self._claimed_path(worker, name))
+                except OSError:
+                    # requeued; the result still counts if it comes first
+                    return
+        thread = Thread(target=beat, name='Heartbeat')
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+
+    def finish(self, worker, name, result):
+        self._write(self.dirs['results'] + '/' + name + '.result', result)
+        if os.path.exists(self.dirs['results'] + '/' + name + '.cancelled'):
+            self._discard(name)
+        # gone if the claim expired and was requeued; the task has its
+        # result now, so nobody needs to run it again
+        self._remove(self._claimed_path(worker, name))
+        self._remove(self.dirs['tasks'] + '/' + name + '.task')
+
+    def requeue(self, worker):
+        """ Puts back the tasks a worker of the same name had claimed but
+            never finished, e.g. because it was killed.
+        """
+        prefix = worker + '__'
+        for filename in os.listdir(self.dirs['claimed']):
+            if filename.startswith(prefix):
+                try:
+                    os.rename(self.dirs['claimed'] + '/' + filename,
+                              self.dirs['tasks'] + '/' + 
+                              filename[len(prefix):])
+                except OSError:
+                    # expired and requeued already
+                    pass
+
+    def _claimed_path(self, worker, name):
+        return self.dirs['claimed'] + '/' + worker + '__' + name + '.task'
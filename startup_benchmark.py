@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+""" Measures how long the command line takes to import, and checks that it
+    doesn't load the GUI stack (so it can run on headless nodes).
+"""
+
+import os, sys, argparse
+import subprocess
+
+# modules the shell path must never import
+gui_modules = ('gi', 'gui', 'cairo')
+
+
+def measure(module):
+    """ Imports 'module' in a fresh interpreter; returns the cumulative
+        import times in microseconds, by module, and the names of every
+        module it loaded.
+    """
+    code = ('import sys, ' + module + '; '
+            'print("\\n".join(sorted(sys.modules)))')
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    if p.returncode != 0:
+        errors = [line for line in p.stderr.splitlines()
+                  if not line.startswith('import time:')]
+        raise RuntimeError('Importing ' + module + ' failed:\n' + 
+                           '\n'.join(errors))
+    times = {}
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue
+        times[fields[2].strip()] = cumulative
+    return times, p.stdout.split()
+
+
+def main(args):
+    totals = []
+    for run in range(0, args.runs):
+        times, modules = measure(args.module)
+        totals.append(times.get(args.module, 0) / 1000.0)
+    totals.sort()
+    median = totals[len(totals)//2]
+    print('import ' + args.module + ': ' + str(round(median, 1)) +
+          ' ms median, ' + str(round(totals[0], 1)) + ' ms best of ' +
+          str(args.runs))
+    slowest = sorted([(t, name) for name, t in times.items()
+                      if name != args.module], reverse=True)[:args.top]
+    for t, name in slowest:
+        print('  ' + str(round(t / 1000.0, 1)).rjust(8) + ' ms  ' + name)
+    failed = False
+    loaded = [name for name in modules
+              if name.split('.')[0] in gui_modules]
+    if loaded:
+        print('GUI modules loaded: ' + ', '.join(loaded))
+        failed = True
+    if args.budget and median > args.budget:
+        print('Over the budget of ' + str(args.budget) + ' ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser('./startup_benchmark')
+    parser.add_argument('--module', default='bookmaker',
+                        help='Module to import (default: bookmaker)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of fresh interpreters to time')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of the slowest imports to list')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Fail if the median import takes longer than '
+                        'this many milliseconds')
+    args = parser.parse_args()
+    main(args)
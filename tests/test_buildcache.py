@@ -0,0 +1,82 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+from buildcache import BuildCache
+
+
+class Book(object):
+
+    def __init__(self, root_dir):
+        self.identifier = 'book'
+        self.root_dir = root_dir
+        self.logger = logging.getLogger('test_buildcache')
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = BuildCache(Book(self.dir))
+        self.input = self.dir + '/in.jpg'
+        self.output = self.dir + '/out.jpg'
+        self.write(self.input, 'image')
+        self.write(self.output, 'cropped')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def key(self):
+        return self.cache.get_key(['cropper', self.input, self.output],
+                                  [self.output])
+
+    def store(self):
+        self.cache.store('Cropper', self.output, self.key(), [self.output],
+                         {'retval': 0, 'output': 'ok'})
+
+    def lookup(self):
+        return self.cache.lookup('Cropper', self.output, self.key(),
+                                 [self.output])
+
+    def test_hit(self):
+        self.store()
+        self.assertEqual(self.lookup(), {'retval': 0, 'output': 'ok'})
+
+    def test_miss(self):
+        self.assertIsNone(self.lookup())
+
+    def test_changed_input_is_stale(self):
+        self.store()
+        self.write(self.input, 'reshot')
+        self.assertIsNone(self.lookup())
+
+    def test_changed_output_is_stale(self):
+        self.store()
+        self.write(self.output, 'edited by hand')
+        self.assertIsNone(self.lookup())
+
+    def test_failing_store_doesnt_raise(self):
+        shutil.rmtree(self.cache.dir)
+        self.store()
+        # and leaves no temporary file behind
+        self.assertEqual(sorted(os.listdir(self.dir)), ['in.jpg', 'out.jpg'])
+
+    def test_digests_are_bounded(self):
+        saved = BuildCache.max_digests
+        BuildCache.max_digests = 1
+        try:
+            BuildCache.file_digest(self.input)
+            BuildCache.file_digest(self.output)
+            self.assertEqual(list(BuildCache._digests), [self.output])
+        finally:
+            BuildCache.max_digests = saved
+
+
+if __name__ == '__main__':
+    unittest.main()
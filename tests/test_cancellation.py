@@ -0,0 +1,164 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+from threading import Thread
+
+import registry
+from util import Util
+from usage import ResourceUsage
+from processing import ProcessHandling, FairShare
+from cancellation import CancellationToken, Cancelled
+from core.operation import Operation
+from components.component import Component
+
+
+class Book(object):
+
+    def __init__(self, root_dir):
+        self.identifier = 'book'
+        self.root_dir = root_dir
+        self.page_count = 4
+        self.build_cache = None
+        self.start_time = time.time()
+        self.settings = {}
+        self.resource_usage = ResourceUsage()
+        self.logger = logging.getLogger('test_cancellation')
+
+    def release(self):
+        pass
+
+
+class Stuck(Component):
+    """ Marks that it started, then waits on a child of its own. """
+    args = ['flag', 'script']
+    executable = 'sh'
+    retries = 0
+    # known, so both chunks' runs are let in at once
+    memory = 1024 * 1024
+
+    def __init__(self, book):
+        super(Stuck, self).__init__()
+        self.book = book
+
+    def run(self, leaf):
+        script = ('touch ' + self.book.root_dir + '/started_' + str(leaf) +
+                  '; sleep 30 & sleep 30')
+        return self.execute({'flag': '-c', 'script': script})
+
+
+class Stalling(Operation):
+    components = []
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Stalling, self).__init__(Stalling.components)
+        self.imports = [('stuck', 'Stuck')]
+        self.init_bookkeeping()
+        self.Stuck = Stuck(book)
+        self.components = [self.Stuck]
+
+    @Operation.multithreaded
+    def work(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            try:
+                self.Stuck.run(leaf)
+            except (Exception, BaseException):
+                self.join()
+            else:
+                self.complete_process('Stuck', leaf, 0)
+
+registry.operations.register('Stalling', Stalling)
+
+
+def group_exists(pgid):
+    try:
+        os.killpg(pgid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+class TestCancellation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def started(self):
+        return sorted([name for name in os.listdir(self.dir)
+                       if name.startswith('started_')])
+
+    def test_abort_kills_tools_and_starts_no_more(self):
+        P = ProcessHandling(jobs=2)
+        P.slots = FairShare(2, reserved=0)
+        queue = P.new_queue()
+        queue.add(Book(self.dir), cls='Stalling', mth='work')
+        drain = Thread(target=queue.drain, args=('sync',))
+        drain.daemon = True
+        drain.start()
+        deadline = time.time() + 10
+        while len(self.started()) < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(self.started()), 2)
+        groups = [pid for pid, proc in list(Util._live.items())
+                  if proc.args[0] == 'sh']
+        self.assertEqual(len(groups), 2)
+        P.abort('book')
+        drain.join(10)
+        P.Polls.stop_polls()
+        self.assertFalse(drain.is_alive())
+        # the tools' own children went with them
+        deadline = time.time() + Util.kill_timeout + 2
+        while [pid for pid in groups if group_exists(pid)] and \
+                time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([pid for pid in groups if group_exists(pid)], [])
+        # each chunk's second leaf never got its tool started
+        self.assertEqual(self.started(), ['started_0', 'started_2'])
+
+    def test_cancelling_the_token_kills_running_tools(self):
+        operation = Stalling(ProcessHandling(jobs=1), Book(self.dir))
+        token = CancellationToken()
+        operation.set_token(token)
+        errors = []
+        def run():
+            try:
+                operation.Stuck.run(0)
+            except Exception as e:
+                errors.append(e)
+        thread = Thread(target=run)
+        thread.start()
+        while not self.started():
+            time.sleep(0.05)
+        token.cancel('Aborted.')
+        thread.join(Util.kill_timeout + 5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(errors), 1)
+
+    def test_cancelled_component_spawns_nothing(self):
+        token = CancellationToken()
+        component = Stuck(Book(self.dir))
+        component.token = token
+        token.cancel('Aborted.')
+        with self.assertRaises(Cancelled):
+            component.run(0)
+        self.assertEqual(self.started(), [])
+
+    def test_on_cancel_runs_once(self):
+        token = CancellationToken()
+        calls = []
+        token.on_cancel(lambda: calls.append(1))
+        token.cancel()
+        token.cancel()
+        token.on_cancel(lambda: calls.append(2))
+        self.assertEqual(calls, [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from controller import ConcurrencyController
+
+
+class Sampler(object):
+
+    def __init__(self, busy, iowait):
+        self.busy, self.iowait = busy, iowait
+
+    def sample(self):
+        return self.busy, self.iowait
+
+
+class TestConcurrencyController(unittest.TestCase):
+
+    def flat_window(self, busy, iowait, latency=1.0, last_latency=1.0):
+        """ Runs _adjust on a window as fast as the previous one. """
+        controller = ConcurrencyController('test', 1, 8, initial=4)
+        controller.cpu = Sampler(busy, iowait)
+        controller.last_throughput = 10.0
+        controller.last_latency = last_latency
+        controller.window_start = time.time() - 10
+        controller.window_leaves = 100
+        controller.window_batches = 2 * controller.limit
+        controller.window_time = latency * 100
+        controller._adjust()
+        return controller
+
+    def test_saturated_cpus_mean_fewer_workers(self):
+        controller = self.flat_window(0.95, 0.0)
+        self.assertEqual(controller.limit, 3)
+        self.assertEqual(controller.direction, -1)
+
+    def test_slower_leaves_mean_fewer_workers(self):
+        controller = self.flat_window(0.8, 0.1, latency=2.0)
+        self.assertEqual(controller.limit, 3)
+        self.assertEqual(controller.direction, -1)
+
+    def test_idle_cpus_mean_more_workers(self):
+        controller = self.flat_window(0.5, 0.0)
+        self.assertEqual(controller.limit, 5)
+        self.assertEqual(controller.direction, 1)
+
+    def test_waiting_on_io_means_more_workers(self):
+        controller = self.flat_window(0.8, 0.3)
+        self.assertEqual(controller.limit, 5)
+
+    def test_otherwise_stays(self):
+        controller = self.flat_window(0.8, 0.1)
+        self.assertEqual(controller.limit, 4)
+        self.assertEqual(controller.window_leaves, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
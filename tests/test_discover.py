@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from environment import Environment
+
+
+class TestDiscover(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(self.root + '/book/book_raw_jpg')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_unlistable_directory_is_logged_and_skipped(self):
+        missing = self.root + '/missing'
+        with self.assertLogs('environment', 'WARNING') as logs:
+            books = list(Environment.discover([missing, self.root]))
+        self.assertIn('skipping ' + missing, logs.output[0])
+        self.assertEqual([book.root_dir for book in books],
+                         [self.root + '/book'])
+
+
+if __name__ == '__main__':
+    unittest.main()
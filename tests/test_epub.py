@@ -0,0 +1,43 @@
+import pickle
+import unittest
+from unittest import mock
+
+from core.derive import EPUB
+
+
+class Node(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def page(*paragraphs):
+    return Node(paragraphs=[Node(lines=[Node(words=[Node(text=word) 
+                                                    for word in line])
+                                        for line in par])
+                            for par in paragraphs])
+
+
+class TestEPUB(unittest.TestCase):
+
+    def test_leaf_state_carries_the_text(self):
+        child = EPUB.__new__(EPUB)
+        child.hocr_files = {3: 'leaf3.hocr'}
+        child.hocr_text = {3: EPUB.get_text(page([['"a"', '"b"'], ['"c"']],
+                                                 [['"d"']]))}
+        state = pickle.loads(pickle.dumps(child.get_leaf_state(3)))
+        parent = EPUB.__new__(EPUB)
+        parent.hocr_files, parent.hocr_text = {}, {}
+        parent.Tesseract = mock.Mock()
+        parent.set_leaf_state(3, state)
+        # the parent doesn't parse the file again
+        self.assertFalse(parent.Tesseract.parse_hocr.called)
+        self.assertEqual(parent.hocr_text[3], 
+                         [[['"a"', '"b"'], ['"c"']], [['"d"']]])
+
+    def test_unparsable_page_has_no_text(self):
+        self.assertEqual(EPUB.get_text(None), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import time
+import logging
+import unittest
+
+from processing import FairShare, ProcessHandling
+from usage import ResourceUsage
+from core.operation import Operation
+from components.component import Component
+
+
+class TestFairShare(unittest.TestCase):
+
+    def test_try_acquire_stays_in_the_budget(self):
+        slots = FairShare(2, reserved=0)
+        slots.acquire('a')
+        self.assertTrue(slots.try_acquire('a'))
+        self.assertFalse(slots.try_acquire('b'))
+        slots.release('a', lease=False)
+        self.assertEqual(slots.held, {'a': 1})
+        slots.release('a')
+        self.assertEqual(slots.held, {})
+
+
+class Book(object):
+
+    def __init__(self):
+        self.identifier = 'book'
+        self.page_count = 4
+        self.build_cache = None
+        self.resource_usage = ResourceUsage()
+        self.logger = logging.getLogger('test_fairshare')
+
+
+class Sleep(Component):
+    args = ['seconds']
+    executable = 'sleep'
+
+    def __init__(self, book):
+        super(Sleep, self).__init__()
+        self.book = book
+
+    async def run_async(self, leaf, **kwargs):
+        return await self.execute_async({'seconds': '0.3'}, hook=False)
+
+
+class Sleeping(Operation):
+    components = []
+    leaf_components = ()
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Sleeping, self).__init__(Sleeping.components)
+        self.Sleep = Sleep(book)
+        self.components = [self.Sleep]
+        self.imports = [('sleep', 'Sleep')]
+        self.init_bookkeeping()
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_processes_in_flight_hold_slots(self):
+        P = ProcessHandling(jobs=2)
+        P.slots = FairShare(2, reserved=0)
+        operation = Sleeping(P, Book())
+        start = time.time()
+        with P.slots.slot('book'):
+            operation.run_concurrently('Sleep', [(leaf, {}) 
+                                                 for leaf in range(4)])
+        elapsed = time.time() - start
+        P.Polls.stop_polls()
+        # two at a time, the chunk's slot and one more
+        self.assertGreaterEqual(elapsed, 0.55)
+        self.assertEqual(sorted(operation.completed['Sleep']), [0, 1, 2, 3])
+        self.assertEqual(P.slots.held, {})
+
+
+class Leaves(Operation):
+    """ Records the order leaves are done in, across books. """
+    components = []
+    order = []
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Leaves, self).__init__(Leaves.components)
+        self.components = []
+
+    @Operation.multithreaded
+    def work(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            time.sleep(0.02)
+            Leaves.order.append((self.book.identifier, leaf))
+            self.complete_process('Leaves', leaf, 0.02)
+
+    def init_bookkeeping(self):
+        super(Leaves, self).init_bookkeeping()
+        self.completed['Leaves'] = {}
+        self.exec_times['Leaves'] = []
+
+    def get_leaf_components(self):
+        return ()
+
+import registry
+registry.operations.register('Leaves', Leaves)
+
+
+class LeavesBook(Book):
+
+    def __init__(self, identifier, page_count):
+        super(LeavesBook, self).__init__()
+        self.identifier = identifier
+        self.page_count = page_count
+        self.start_time = time.time()
+        self.settings = {}
+
+    def release(self):
+        pass
+
+
+class TestInteractive(unittest.TestCase):
+
+    def test_interactive_job_goes_ahead_at_checkpoint(self):
+        Leaves.order = []
+        P = ProcessHandling(jobs=1)
+        P.slots = FairShare(1, reserved=0)
+        batch = P.new_queue()
+        batch.add(LeavesBook('batch', 40), cls='Leaves', mth='work')
+        batch_pid = batch.drain('sync', thread=True)
+        while not Leaves.order:
+            time.sleep(0.01)
+        spread = P.new_queue()
+        spread.add(LeavesBook('spread', 10), cls='Leaves', mth='work',
+                   kwargs={'start': 4, 'end': 6},
+                   priority=FairShare.interactive)
+        queued = len(Leaves.order)
+        spread.drain('sync')
+        P._wait_till_idle([batch_pid])
+        P.Polls.stop_polls()
+        # the batch book yielded its only slot at its next leaf
+        done = Leaves.order.index(('spread', 5))
+        self.assertLessEqual(done - queued, 3)
+        self.assertEqual(len([leaf for leaf in Leaves.order 
+                              if leaf[0] == 'batch']), 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
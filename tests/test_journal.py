@@ -0,0 +1,65 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+from journal import Journal
+
+
+class FakeBook(object):
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.identifier = 'book'
+        self.logger = logging.getLogger('test_journal')
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.book = FakeBook(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_syncs_in_batches(self):
+        journal = Journal(self.book)
+        with mock.patch('os.fsync') as fsync:
+            for leaf in range(100):
+                journal.record('Op', 'Component', leaf, 0.1)
+            self.assertEqual(fsync.call_count, 0)
+            journal.close()
+            self.assertEqual(fsync.call_count, 1)
+
+    def test_resume_reads_back_records(self):
+        journal = Journal(self.book)
+        for leaf in range(10):
+            journal.record('Op', 'Component', leaf, 0.1, {'leaf': leaf})
+        journal.close()
+        resumed = Journal(self.book, resume=True)
+        self.assertEqual([record[1] for record in 
+                          resumed.get_records('Op')], list(range(10)))
+        resumed.close()
+
+    def test_later_runs_append(self):
+        journal = Journal(self.book)
+        journal.record('Op', 'Component', 0, 0.1)
+        journal.close()
+        # e.g. the editor recropping a spread of the interrupted book
+        Journal(self.book).close()
+        resumed = Journal(self.book, resume=True)
+        self.assertEqual(len(list(resumed.get_records('Op'))), 1)
+        resumed.restart()
+        resumed.record('Op', 'Component', 1, 0.1)
+        resumed.close()
+        restarted = Journal(self.book, resume=True)
+        self.assertEqual([record[1] for record in 
+                          restarted.get_records('Op')], [1])
+        restarted.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import io
+import logging
+import unittest
+
+from logwriter import LogWriter
+
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = LogWriter()
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def test_detach_writes_what_was_queued(self):
+        logger = logging.getLogger('test_logwriter.detach')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        self.writer.attach(logger, (handler,))
+        for i in range(2000):
+            logger.debug('line %d', i)
+        self.writer.detach(logger)
+        self.writer.flush(10)
+        self.assertEqual(len(stream.getvalue().splitlines()), 2000)
+        self.assertNotIn(logger.name, self.writer.handlers)
+
+    def test_attach_again_keeps_new_handlers(self):
+        logger = logging.getLogger('test_logwriter.reattach')
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        first, second = io.StringIO(), io.StringIO()
+        self.writer.attach(logger, (logging.StreamHandler(first),))
+        logger.debug('before')
+        self.writer.attach(logger, (logging.StreamHandler(second),))
+        logger.debug('after')
+        self.writer.detach(logger)
+        self.writer.flush(10)
+        self.assertIn('after', second.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import struct
+import shutil
+import tempfile
+import unittest
+
+from manifest import probe_jpeg, RawManifest
+
+
+def jpeg(width, height, orientation):
+    """ The headers of a JPEG: an EXIF segment and a baseline SOF. """
+    ifd = struct.pack('>H', 1) + struct.pack('>HHIHH', 0x0112, 3, 1,
+                                             orientation, 0)
+    tiff = b'MM' + struct.pack('>HI', 42, 8) + ifd + struct.pack('>I', 0)
+    exif = b'Exif\x00\x00' + tiff
+    sof = struct.pack('>BHHB', 8, height, width, 3) + b'\x00' * 9
+    return (b'\xff\xd8' +
+            b'\xff\xe1' + struct.pack('>H', len(exif) + 2) + exif +
+            b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof +
+            b'\xff\xd9')
+
+
+class TestRawManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(self.root + '/raw')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_dimensions_are_not_rotated(self):
+        path = self.root + '/raw/0001.jpg'
+        with open(path, 'wb') as f:
+            f.write(jpeg(400, 300, 6))
+        self.assertEqual(probe_jpeg(path), (400, 300, 6))
+
+    def test_only_jpegs(self):
+        for name in ('0001.jpg', '0002.JPEG', '0003.jpeg'):
+            with open(self.root + '/raw/' + name, 'wb') as f:
+                f.write(jpeg(400, 300, 1))
+        images, dimensions, orientations = \
+            RawManifest(self.root, 'raw').load()
+        self.assertEqual(len(images), 3)
+        self.assertEqual(dimensions[1], {'width': 400, 'height': 300})
+        with open(self.root + '/raw/0004.png', 'wb') as f:
+            f.write(b'')
+        with self.assertRaises(SystemExit):
+            RawManifest(self.root, 'raw').load()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+from threading import Thread
+
+import registry
+from memory import MemoryBudget
+from util import Util
+from usage import ResourceUsage
+from processing import ProcessHandling
+from core.operation import Operation
+from components.component import Component
+
+
+MB = 1024 * 1024
+
+
+class Sleeper(Component):
+    args = ['seconds']
+    executable = 'sleep'
+
+
+class BigSleeper(Sleeper):
+    memory = 600 * MB
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.budget = MemoryBudget(1024 * MB, ledger=self.dir + '/ledger')
+        self.saved = MemoryBudget._shared
+        MemoryBudget._shared = self.budget
+
+    def tearDown(self):
+        MemoryBudget._shared = self.saved
+        shutil.rmtree(self.dir)
+
+    def test_big_tool_waits_for_room(self):
+        self.budget.declare('BigSleeper', BigSleeper.memory)
+        first = self.budget.acquire('BigSleeper')
+        self.assertIsNone(self.budget.acquire('BigSleeper', blocking=False))
+
+        started = []
+        def run():
+            BigSleeper().execute({'seconds': '0'}, hook=False)
+            started.append(time.time())
+        thread = Thread(target=run)
+        thread.start()
+        time.sleep(0.3)
+        self.assertEqual(started, [])
+        released = time.time()
+        self.budget.release('BigSleeper', first)
+        thread.join(10)
+        self.assertEqual(len(started), 1)
+        self.assertGreaterEqual(started[0], released)
+
+    def test_lone_run_is_always_admitted(self):
+        self.budget.declare('Huge', 4096 * MB)
+        size = self.budget.acquire('Huge', blocking=False)
+        self.assertEqual(size, 4096 * MB)
+        self.budget.release('Huge', size)
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'reads /proc')
+    def test_learns_the_tools_own_peak(self):
+        # a big interpreter forking a small tool: what is learned is the 
+        # tool's peak, not the interpreter's
+        ballast = b"x" * (200 * MB)
+        Sleeper().execute({'seconds': '0.3'}, hook=False)
+        self.assertLess(self.budget.estimates['Sleeper'], 100 * MB)
+        del ballast
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'reads /proc')
+    def test_measures_a_big_tool(self):
+        cmd = [sys.executable, '-c',
+               'import time; b = bytearray(150 * 1024 * 1024); '
+               'b[::4096] = b"x" * len(b[::4096]); time.sleep(0.5)']
+        output = Util().exec_cmd(cmd)
+        self.assertGreater(output['max_rss'], 150 * MB)
+
+    def test_runs_of_other_processes_count(self):
+        self.budget.declare('BigSleeper', BigSleeper.memory)
+        size = self.budget.acquire('BigSleeper')
+        pid = os.fork()
+        if pid == 0:
+            admitted = MemoryBudget._shared.acquire('BigSleeper', 
+                                                    blocking=False)
+            os._exit(0 if admitted is None else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.budget.release('BigSleeper', size)
+
+    def test_runs_of_dead_processes_dont(self):
+        self.budget.declare('BigSleeper', BigSleeper.memory)
+        pid = os.fork()
+        if pid == 0:
+            MemoryBudget._shared.acquire('BigSleeper')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        size = self.budget.acquire('BigSleeper', blocking=False)
+        self.assertEqual(size, BigSleeper.memory)
+        self.budget.release('BigSleeper', size)
+
+    def test_forked_executor_shares_the_budget(self):
+        P = ProcessHandling(jobs=2, executor='process')
+        queue = P.new_queue()
+        queue.add(Book(self.dir), cls='BigSleeping', mth='work')
+        start = time.time()
+        queue.drain('sync')
+        elapsed = time.time() - start
+        P.Polls.stop_polls()
+        self.assertIs(P.had_error('book', cls='BigSleeping'), False)
+        # two 600MB runs don't fit in 1024MB at once, in whichever process
+        self.assertGreaterEqual(elapsed, 1.0)
+
+
+class Book(object):
+
+    def __init__(self, root_dir):
+        self.identifier = 'book'
+        self.root_dir = root_dir
+        self.page_count = 2
+        self.build_cache = None
+        self.start_time = time.time()
+        self.settings = {}
+        self.resource_usage = ResourceUsage()
+        self.logger = logging.getLogger('test_memory')
+
+    def release(self):
+        pass
+
+
+class BigSleeping(Operation):
+    """ Runs a BigSleeper on each leaf. """
+    components = []
+    leaf_components = ('BigSleeper',)
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(BigSleeping, self).__init__(BigSleeping.components)
+        self.components = []
+
+    @Operation.multithreaded
+    def work(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            output = BigSleeper().execute({'seconds': '0.5'}, hook=False)
+            self.complete_process('BigSleeper', leaf, output['exec_time'])
+
+    def init_bookkeeping(self):
+        super(BigSleeping, self).init_bookkeeping()
+        self.completed['BigSleeper'] = {}
+        self.exec_times['BigSleeper'] = []
+
+registry.operations.register('BigSleeping', BigSleeping)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import time
+import unittest
+
+from progress import ProgressModel
+
+
+class Slots(object):
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.held = {}
+
+
+class ProcessHandler(object):
+
+    def __init__(self, slots):
+        self.slots = Slots(slots)
+        self.OperationObjects = {}
+
+
+class Book(object):
+
+    def __init__(self, identifier, page_count=100):
+        self.identifier = identifier
+        self.page_count = page_count
+
+
+class Operation(object):
+    leaf_components = ('A',)
+
+    def __init__(self, book):
+        self.book = book
+        self.thread_count = 0
+        self.completed = {'__finished__': False}
+        for cls in self.leaf_components:
+            self.completed[cls] = {}
+
+    def get_leaf_components(self):
+        return self.leaf_components
+
+    def complete(self, count):
+        done = self.completed['A']
+        for leaf in range(len(done), len(done) + count):
+            done[leaf] = 0.1
+
+
+def operation(name, P, book, leaf_components=('A',)):
+    cls = type(name, (Operation,), {'leaf_components': leaf_components})
+    instance = cls(book)
+    P.OperationObjects.setdefault(book.identifier, {})[name] = instance
+    return instance
+
+
+class TestProgressModel(unittest.TestCase):
+
+    def setUp(self):
+        self.P = ProcessHandler(4)
+        self.model = ProgressModel(self.P)
+        self.book = Book('book')
+
+    def run_window(self, op, held, seconds, leaves):
+        """ Pretends 'op' held 'held' slots for the last 'seconds' and got
+            'leaves' more leaves done.
+        """
+        stage = self.model.stages[(op.book.identifier, 
+                                   op.__class__.__name__)]
+        stage.last_held = held
+        stage.last_sample = stage.window_start = time.time() - seconds
+        op.complete(leaves)
+        self.model.update(op)
+
+    def test_rate_is_an_ewma_per_slot_second(self):
+        op = operation('Crop', self.P, self.book)
+        op.thread_count = 2
+        self.model.start(op, 100)
+        self.run_window(op, 2, 5, 20)
+        rates = self.model.get_state('book', 'Crop')['rates']
+        self.assertAlmostEqual(rates['A'], 2.0, delta=0.05)
+        self.run_window(op, 2, 5, 10)
+        rates = self.model.get_state('book', 'Crop')['rates']
+        self.assertAlmostEqual(rates['A'], 0.3 * 1.0 + 0.7 * 2.0, delta=0.05)
+
+    def test_projection_uses_the_fair_share(self):
+        op = operation('Crop', self.P, self.book)
+        op.thread_count = 4
+        self.model.start(op, 100)
+        self.run_window(op, 4, 5, 20)
+        # 80 leaves left at 1 leaf per slot-second, on all 4 slots
+        state = self.model.get_state('book', 'Crop')
+        self.assertAlmostEqual(state['remaining'], 20.0, delta=0.5)
+        other = operation('Crop', self.P, Book('other'))
+        other.thread_count = 4
+        self.model.start(other, 100)
+        # now two books share the 4 slots
+        state = self.model.get_state('book', 'Crop')
+        self.assertAlmostEqual(state['remaining'], 40.0, delta=1.0)
+
+    def test_book_state_adds_queued_to_longest_running(self):
+        crop = operation('Crop', self.P, self.book)
+        ocr = operation('OCR', self.P, self.book)
+        pdf = operation('PDF', self.P, self.book)
+        for op in (crop, ocr):
+            op.thread_count = 4
+            self.model.start(op, 100)
+        self.run_window(crop, 4, 5, 20)
+        self.run_window(ocr, 4, 5, 60)
+        # PDF's last run went at 2 leaves per slot-second
+        self.model.rates['PDF'] = {'A': 2.0}
+        state = self.model.get_book_state('book')
+        crop_left = 80 / (1.0 * 4)
+        self.assertAlmostEqual(state['remaining'], crop_left + 100 / 8.0,
+                               delta=1.0)
+        # nothing known about a queued operation: no estimate
+        del self.model.rates['PDF']
+        self.assertIsNone(self.model.get_book_state('book')['remaining'])
+
+    def test_operation_without_leaf_components_has_no_estimate(self):
+        op = operation('EPUB', self.P, self.book, leaf_components=())
+        op.thread_count = 1
+        self.model.start(op, 100)
+        state = self.model.get_state('book', 'EPUB')
+        self.assertTrue(state['running'])
+        self.assertIsNone(state['remaining'])
+        self.assertIsNone(self.model.get_book_state('book')['remaining'])
+        op.completed['__finished__'] = True
+        self.model.finish(op)
+        self.assertEqual(self.model.get_state('book', 'EPUB')['remaining'],
+                         0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
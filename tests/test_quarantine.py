@@ -0,0 +1,75 @@
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import registry
+from usage import ResourceUsage
+from processing import ProcessHandling
+from core.operation import Operation
+
+
+class Book(object):
+
+    def __init__(self, identifier, root_dir):
+        self.identifier = identifier
+        self.root_dir = root_dir
+        self.page_count = 6
+        self.build_cache = None
+        self.start_time = time.time()
+        self.settings = {}
+        self.resource_usage = ResourceUsage()
+        self.logger = logging.getLogger('test_quarantine')
+
+    def release(self):
+        pass
+
+
+class Flaky(Operation):
+    """ Fails on leaf 3, every time. """
+    components = []
+    leaf_components = ('Flaky',)
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Flaky, self).__init__(Flaky.components)
+        self.components = []
+
+    @Operation.multithreaded
+    def work(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            if leaf == 3:
+                raise RuntimeError('bad leaf')
+            self.complete_process('Flaky', leaf, 0)
+
+    def init_bookkeeping(self):
+        super(Flaky, self).init_bookkeeping()
+        self.completed['Flaky'] = {}
+        self.exec_times['Flaky'] = []
+
+registry.operations.register('Flaky', Flaky)
+
+
+class TestQuarantine(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_partial_book_didnt_fail(self):
+        P = ProcessHandling(jobs=2)
+        queue = P.new_queue()
+        queue.add(Book('flaky', self.dir), cls='Flaky', mth='work')
+        queue.drain('sync')
+        P.Polls.stop_polls()
+        self.assertIs(P.had_error('flaky', cls='Flaky'), False)
+        self.assertTrue(P.has_quarantined('flaky', cls='Flaky'))
+        self.assertEqual(list(P.get_quarantined('flaky')), [3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import gc
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+import tracemalloc
+
+import registry
+from environment import Book
+from processing import ProcessHandling
+from core.operation import Operation
+
+
+class Touch(Operation):
+    """ Does a little leaf work with the book's state. """
+    components = []
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Touch, self).__init__(Touch.components)
+        self.components = []
+
+    @Operation.multithreaded
+    def work(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            self.book.scaled_center_point[leaf]
+            self.complete_process('Touch', leaf, 0)
+
+    def init_bookkeeping(self):
+        super(Touch, self).init_bookkeeping()
+        self.completed['Touch'] = {}
+        self.exec_times['Touch'] = []
+
+    def get_leaf_components(self):
+        return ()
+
+registry.operations.register('Touch', Touch)
+
+
+class TestRelease(unittest.TestCase):
+
+    pages = 8
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.count = 0
+        self.P = ProcessHandling(jobs=2)
+
+    def tearDown(self):
+        self.P.Polls.stop_polls()
+        shutil.rmtree(self.dir)
+
+    def make_book(self):
+        self.count += 1
+        root = os.path.join(self.dir, 'book%04d' % self.count)
+        os.makedirs(os.path.join(root, 'raw'))
+        # settings.yaml is written on first load; no need for it here
+        dimensions = dict((leaf, {'width': 400, 'height': 600}) 
+                          for leaf in range(self.pages))
+        return Book(root, 'raw', {'page_count': self.pages, 
+                                  'images': {}, 
+                                  'dimensions': dimensions},
+                    'new_capture')
+
+    def queues(self, books):
+        for book in books:
+            queue = self.P.new_queue()
+            queue.add(book, cls='Touch', mth='work')
+            yield queue
+
+    def run_books(self, n):
+        books = [self.make_book() for i in range(n)]
+        self.P.drain_queues(self.queues(books))
+        return books
+
+    def test_queueing_doesnt_load(self):
+        book = self.make_book()
+        book.set_log_level('INFO')
+        queue = self.P.new_queue()
+        queue.add(book, cls='Touch', mth='work')
+        self.assertFalse(book._loaded)
+        self.assertNotIn(book.identifier, self.P.OperationObjects)
+
+    def test_released_books_leave_nothing(self):
+        books = self.run_books(3)
+        for book in books:
+            self.assertFalse(book._loaded)
+            self.assertNotIn('scandata', book.__dict__)
+            identifier = book.identifier
+            self.assertNotIn(identifier, self.P.OperationObjects)
+            self.assertNotIn(identifier, self.P.tokens)
+            self.assertNotIn(identifier, self.P.journals)
+            self.assertFalse([key for key in self.P.progress.stages 
+                              if key[0] == identifier])
+        self.assertFalse(self.P._inactive_threads)
+
+    def test_memory_stays_flat(self):
+        # nothing but the books' own handlers is to keep their records
+        root = logging.getLogger()
+        saved, root.handlers = root.handlers, []
+        self.run_books(10)
+        gc.collect()
+        tracemalloc.start()
+        try:
+            self.run_books(10)
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            self.run_books(50)
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+            root.handlers = saved
+        # all that is left of a book is its logger, which the logging 
+        # module keeps, not its state
+        self.assertLess((after - before) / 50, 4 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from environment import Scandata
+
+
+class TestScandata(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'book_scandata.xml')
+        self.scandata = Scandata()
+        self.scandata.new('book', 2, {0: {'width': 400, 'height': 600},
+                                      1: {'width': 400, 'height': 600}},
+                          self.filename, 'Dual')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_flush_only_writes_changes(self):
+        self.assertFalse(self.scandata.flush())
+        self.scandata.quarantine_leaf(1, 'Op', 'Component', 'crash')
+        self.assertTrue(self.scandata.flush())
+        self.assertFalse(self.scandata.flush())
+        with open(self.filename) as f:
+            self.assertIn('crash', f.read())
+
+    def test_write_keeps_mode(self):
+        os.chmod(self.filename, 0o640)
+        self.scandata.mark_dirty()
+        self.scandata.flush()
+        self.assertEqual(stat.S_IMODE(os.stat(self.filename).st_mode), 0o640)
+
+    def test_write_is_synced(self):
+        self.scandata.mark_dirty()
+        with mock.patch('os.fsync') as fsync:
+            self.scandata.flush()
+        # the temporary file, then the directory
+        self.assertEqual(fsync.call_count, 2)
+        self.assertEqual(os.listdir(self.dir), ['book_scandata.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import registry
+from usage import ResourceUsage
+from processing import ProcessHandling, FairShare
+from core.operation import Operation
+from components.component import Component
+
+
+# the first run on a leaf with a 'slow' marker writes part of its file and
+# hangs; any other run writes the whole file straight away
+TOOL = """#!/bin/sh
+if rm "$1" 2>/dev/null; then
+    echo partial > "$2"
+    sleep 30
+fi
+echo whole > "$2"
+"""
+
+
+class Book(object):
+
+    def __init__(self, root_dir):
+        self.identifier = 'book'
+        self.root_dir = root_dir
+        self.page_count = 12
+        self.build_cache = None
+        self.start_time = time.time()
+        self.settings = {}
+        self.resource_usage = ResourceUsage()
+        self.logger = logging.getLogger('test_speculation')
+
+    def release(self):
+        pass
+
+
+class Writer(Component):
+    args = ['slow', 'out_file']
+    outputs = ('out_file',)
+    retries = 0
+
+    def __init__(self, book):
+        super(Writer, self).__init__()
+        self.book = book
+        self.executable = book.root_dir + '/tool'
+
+    def run(self, leaf):
+        kwargs = {'leaf': leaf,
+                  'slow': self.book.root_dir + '/slow_' + str(leaf),
+                  'out_file': self.book.root_dir + '/out_' + str(leaf)}
+        return self.execute(kwargs)
+
+
+class Writing(Operation):
+    components = []
+
+    def __init__(self, ProcessHandler, book):
+        self.ProcessHandler = ProcessHandler
+        self.book = book
+        super(Writing, self).__init__(Writing.components)
+        self.imports = [('writer', 'Writer')]
+        self.init_bookkeeping()
+        self.Writer = Writer(book)
+        self.components = [self.Writer]
+
+    @Operation.multithreaded
+    def pipeline(self, start=None, end=None, **kwargs):
+        for leaf in range(start, end):
+            try:
+                self.Writer.run(leaf)
+            except (Exception, BaseException):
+                self.join()
+            else:
+                self.complete_process('Writer', leaf,
+                                      self.Writer.get_last_exec_time())
+
+registry.operations.register('Writing', Writing)
+
+
+class TestSpeculation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(self.dir + '/tool', 'w') as f:
+            f.write(TOOL)
+        os.chmod(self.dir + '/tool', 0o755)
+        open(self.dir + '/slow_2', 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_slow_leaf_is_beaten_by_its_extra_attempt(self):
+        P = ProcessHandling(jobs=2, speculate=True)
+        P.slots = FairShare(2, reserved=0)
+        queue = P.new_queue()
+        queue.add(Book(self.dir), cls='Writing', mth='pipeline')
+        start = time.time()
+        queue.drain('sync')
+        elapsed = time.time() - start
+        P.Polls.stop_polls()
+        self.assertLess(elapsed, 20)
+        self.assertIs(P.had_error('book', cls='Writing'), False)
+        for leaf in range(12):
+            with open(self.dir + '/out_' + str(leaf)) as f:
+                self.assertEqual(f.read(), 'whole\n')
+        # the killed attempt's file was thrown away, not left half written
+        self.assertEqual([name for name in os.listdir(self.dir)
+                          if name.startswith('.attempt-')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
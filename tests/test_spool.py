@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from threading import Thread
+
+from spool import Spool
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spool = Spool(self.dir)
+        self.spool.heartbeat = 0.05
+        self.spool.lease = 0.3
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def listing(self, name):
+        return os.listdir(self.spool.dirs[name])
+
+    def test_claim_and_finish(self):
+        first = self.spool.submit({'leaf': 0})
+        second = self.spool.submit({'leaf': 1})
+        self.assertEqual(self.spool.claim('a'), (first, {'leaf': 0}))
+        self.assertEqual(self.spool.claim('b'), (second, {'leaf': 1}))
+        self.assertIsNone(self.spool.claim('c'))
+        self.spool.finish('a', first, {'done': 0})
+        self.assertEqual(self.spool.collect(first, lambda: True), {'done': 0})
+        self.assertEqual(self.listing('results'), [])
+        self.assertEqual(len(self.listing('claimed')), 1)
+
+    def test_dead_workers_claim_is_requeued(self):
+        name = self.spool.submit({'leaf': 0})
+        # 'a' claims it and dies without a heartbeat
+        self.spool.claim('a')
+        def second_worker():
+            while True:
+                claimed = self.spool.claim('b')
+                if claimed is not None:
+                    break
+                time.sleep(0.01)
+            self.spool.finish('b', claimed[0], {'worker': 'b'})
+        thread = Thread(target=second_worker)
+        thread.start()
+        result = self.spool.collect(name, lambda: True)
+        thread.join(5)
+        self.assertEqual(result, {'worker': 'b'})
+        self.assertEqual(self.listing('claimed'), [])
+
+    def test_heartbeat_keeps_the_claim(self):
+        name = self.spool.submit({'leaf': 0})
+        self.spool.claim('a')
+        with self.spool.holding('a', name):
+            time.sleep(2 * self.spool.lease)
+            self.spool.expire()
+        self.assertEqual(self.listing('tasks'), [])
+        self.assertEqual(len(self.listing('claimed')), 1)
+
+    def test_cancelled_before_claim(self):
+        name = self.spool.submit({'leaf': 0})
+        self.spool.cancel(name)
+        self.assertIsNone(self.spool.claim('a'))
+
+    def test_result_of_cancelled_claim_is_thrown_away(self):
+        name = self.spool.submit({'leaf': 0})
+        self.spool.claim('a')
+        self.spool.cancel(name)
+        self.spool.finish('a', name, {'done': 0})
+        self.assertEqual(self.listing('results'), [])
+        self.assertEqual(self.listing('claimed'), [])
+
+    def test_cancel_after_the_result_came_in(self):
+        name = self.spool.submit({'leaf': 0})
+        self.spool.claim('a')
+        self.spool.finish('a', name, {'done': 0})
+        self.spool.cancel(name)
+        self.assertEqual(self.listing('results'), [])
+
+    def test_uncollected_results_are_removed(self):
+        name = self.spool.submit({'leaf': 0})
+        self.spool.claim('a')
+        self.spool.finish('a', name, {'done': 0})
+        time.sleep(self.spool.lease)
+        self.spool.expire()
+        self.assertEqual(self.listing('results'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from threading import Lock
+
+
+class ResourceUsage(object):
+    """ What a book's component processes used, totalled per component:
+        the number of runs, their wall time ('exec_time'), user and system
+        CPU time, blocks read and written, major page faults and 
+        involuntary context switches, along with the largest peak RSS of
+        any one run.
+
+        Put side by side these tell a slow stage apart: CPU time well short
+        of wall time with many blocks moved means it waited on the disk,
+        major faults mean it was swapping, and a shortfall with neither but
+        many involuntary switches means it was starved of CPU.
+    """
+    totals = ('exec_time', 'utime', 'stime', 'inblock', 'oublock', 'majflt',
+              'nivcsw')
+
+    def __init__(self):
+        self.components = {}
+        self._lock = Lock()
+
+    def _new_entry(self):
+        entry = dict.fromkeys(ResourceUsage.totals, 0)
+        entry['runs'] = 0
+        entry['max_rss'] = 0
+        return entry
+
+    def add(self, component, output):
+        """ Counts one run from the output dict of Component.execute. """
+        with self._lock:
+            if component not in self.components:
+                self.components[component] = self._new_entry()
+            entry = self.components[component]
+            entry['runs'] += 1
+            for field in ResourceUsage.totals:
+                if output.get(field) is not None:
+                    entry[field] += output[field]
+            if output.get('max_rss') is not None:
+                entry['max_rss'] = max(entry['max_rss'], output['max_rss'])
+
+    def merge(self, components):
+        """ Adds in the totals of another ResourceUsage's 'components', e.g.
+            those sent back by a forked child or a worker.
+        """
+        with self._lock:
+            for component, other in components.items():
+                if component not in self.components:
+                    self.components[component] = self._new_entry()
+                entry = self.components[component]
+                for field in ResourceUsage.totals + ('runs',):
+                    entry[field] += other[field]
+                entry['max_rss'] = max(entry['max_rss'], other['max_rss'])
+
+    def get(self, component=None):
+        with self._lock:
+            if component is not None:
+                return dict(self.components.get(component,
+                                                self._new_entry()))
+            return dict([(name, dict(entry)) for name, entry in
+                         self.components.items()])
+
+    def report(self):
+        lines = []
+        for component, entry in sorted(self.get().items()):
+            cpu = entry['utime'] + entry['stime']
+            if entry['exec_time']:
+                share = str(int(round(100 * cpu / entry['exec_time']))) + '%'
+            else:
+                share = '-'
+            lines.append(component + ': ' + str(entry['runs']) + ' runs, ' +
+                         str(round(entry['exec_time'], 2)) + 's wall, ' +
+                         str(round(entry['utime'], 2)) + 's user, ' +
+                         str(round(entry['stime'], 2)) + 's sys (' + share +
+                         ' CPU), peak RSS ' +
+                         str(entry['max_rss'] // (1024 * 1024)) + 'MB, ' +
+                         str(entry['inblock']) + ' blocks in, ' +
+                         str(entry['oublock']) + ' out, ' +
+                         str(entry['majflt']) + ' major faults, ' +
+                         str(entry['nivcsw']) + ' involuntary switches')
+        return '\n'.join(lines)
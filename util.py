@@ -6,64 +6,341 @@ import re
 import math
 import time
 import traceback
+import asyncio
+import atexit
+import contextvars
+from threading import Timer, Thread, Event, get_ident
+from contextlib import contextmanager
 
 class Util(object):
     """ Used mostly to manage system calls, including  spawning, terminating,
     and collecting process execution time and output. 
     """
 
+    usage_fields = ('utime', 'stime', 'max_rss', 
+                    'inblock', 'oublock', 'majflt', 'nivcsw')
+
+    # seconds a process group gets to exit after SIGTERM before SIGKILL
+    kill_timeout = 5.0
+    # each tool gets a process group of its own, so it can be killed along
+    # with anything it started; forked children that are group leaders 
+    # themselves turn this off (see Operation._process_target)
+    new_sessions = True
+    # every process being waited on, by any instance; single dict 
+    # operations are atomic, so no lock is taken (one held across a fork 
+    # would deadlock the child)
+    _live = {}
+    # who a tool is started for, e.g. a leaf attempt, so it can be stopped
+    # on its own (see kill_owned); by default the thread starting it
+    owner = contextvars.ContextVar('owner', default=None)
+    # the peak RSS of each live process, in bytes, as last seen in /proc
+    # by the sampler (see 'sample_peaks'), and how often it looks
+    _peaks = {}
+    _sampler = None
+    peak_interval = 0.1
+
     def __init__(self):
         self.active_procs = {}
 
+    def start_process(self, cmd, stdout, stdin, pipe, current_wd):
+        with Util.open_streams(stdout, stdin, pipe) as streams:
+            p = subprocess.Popen(cmd, cwd=current_wd, 
+                                 stdout=streams[0], stdin=streams[1],
+                                 start_new_session=Util.new_sessions)
+        owner = Util.owner.get()
+        p.owner = owner if owner is not None else get_ident()
+        self.active_procs[p.pid] = p
+        Util._live[p.pid] = p
+        Util.sample_peak(p.pid)
+        Util.start_sampler()
+        return p
+
+    def forget_process(self, p):
+        self.active_procs.pop(p.pid, None)
+        Util._live.pop(p.pid, None)
+        Util._peaks.pop(p.pid, None)
+
     def exec_cmd(self, cmd, stdout=None, stdin=None,
                  return_output=False, print_output=False,
                  current_wd=None, logger=None):
-        devnull = open(os.devnull, 'w')
-        if stdout:
-            stdout = open(stdout, 'wb')
-        elif return_output or print_output:
-            stdout = subprocess.PIPE
-        else:
-            stdout = devnull
-        if stdin:
-            stdin = open(stdin, 'rb')
-
         start = Util.microseconds()
+        p = self.start_process(cmd, stdout, stdin, 
+                               return_output or print_output, current_wd)
+        try:
+            output, usage = Util.wait(p)
+        finally:
+            self.forget_process(p)
+        end = Util.microseconds()
+        return Util.make_result(p, output, usage, end - start,
+                                return_output, print_output)
 
-        if current_wd is not None:
-            p = subprocess.Popen(cmd, cwd=current_wd, 
-                                 stdout=stdout, stdin=stdin)
-        else:
-            p = subprocess.Popen(cmd, stdout=stdout, stdin=stdin)
-        pid = p.pid
-        self.active_procs[pid] = p
-        output = p.communicate()
+    async def exec_cmd_async(self, cmd, stdout=None, stdin=None,
+                             return_output=False, print_output=False,
+                             current_wd=None, logger=None):
+        """ exec_cmd as a coroutine: the process's output and exit are 
+            waited on by the running event loop rather than by a blocked
+            thread, so one loop can look after many of them. If the 
+            coroutine is cancelled the process is killed.
+        """
+        loop = asyncio.get_running_loop()
+        start = Util.microseconds()
+        p = self.start_process(cmd, stdout, stdin, 
+                               return_output or print_output, current_wd)
+        try:
+            out = None
+            if p.stdout is not None:
+                out = await Util.read_async(loop, p.stdout)
+            if hasattr(os, 'pidfd_open'):
+                await Util.exited_async(loop, p)
+                usage = Util.reap(p)
+            else:
+                usage = await loop.run_in_executor(None, Util.reap, p)
+        except asyncio.CancelledError:
+            if p.returncode is None:
+                Util.signal_group(p.pid, signal.SIGKILL)
+                Util.reap(p)
+            raise
+        finally:
+            self.forget_process(p)
         end = Util.microseconds()
+        return Util.make_result(p, (out, None), usage, end - start,
+                                return_output, print_output)
+
+    @staticmethod
+    @contextmanager
+    def open_streams(stdout, stdin, pipe):
+        """ The stdout and stdin to spawn a process with: the named files,
+            a pipe if its output is wanted, and otherwise the null device.
+            Files opened here are closed on leaving, as the child has its
+            own copies by then.
+        """
+        opened = []
+        try:
+            if stdout:
+                stdout = open(stdout, 'wb')
+                opened.append(stdout)
+            elif pipe:
+                stdout = subprocess.PIPE
+            else:
+                stdout = subprocess.DEVNULL
+            if stdin:
+                stdin = open(stdin, 'rb')
+                opened.append(stdin)
+            yield stdout, stdin
+        finally:
+            for f in opened:
+                f.close()
+
+    @staticmethod
+    def make_result(p, output, usage, exec_time, 
+                    return_output, print_output):
         if print_output:
             for o in output:
                 if o:
                     print (o.decode('utf-8'))            
-        del self.active_procs[pid]
+        result = {'exec_time': exec_time,
+                  'pid': p.pid,
+                  'retval': p.returncode}
+        result.update(usage)
         if return_output:
-            return {'output': output[0].decode('utf-8'),
-                    'exec_time': end - start,
-                    'pid': pid,
-                    'retval': p.returncode}
+            result['output'] = output[0].decode('utf-8')
+        return result
+
+    @staticmethod
+    def wait(p):
+        """ Like p.communicate(), but reaps the process with wait4 so what
+            it used (see 'reap') is returned alongside the output.
+        """
+        out = None
+        if p.stdout is not None:
+            out = p.stdout.read()
+            p.stdout.close()
+        return (out, None), Util.reap(p)
+
+    @staticmethod
+    def reap(p):
+        """ Waits for the process to exit, sets its returncode and returns 
+            the resources it used: user and system CPU seconds ('utime', 
+            'stime'), peak RSS in bytes ('max_rss'), blocks read and 
+            written ('inblock', 'oublock'), major page faults ('majflt')
+            and involuntary context switches ('nivcsw'). Where they can't
+            be had they are None.
+
+            The peak RSS wait4 gives counts the copy of this process the
+            child was forked as, so where /proc has it, it is the peak the
+            sampler last saw instead (see 'sample_peaks').
+        """
+        try:
+            _, status, rusage = os.wait4(p.pid, 0)
+        except (AttributeError, ChildProcessError):
+            # no wait4 here, or end_active_processes polled it first
+            p.wait()
+            usage = dict.fromkeys(Util.usage_fields)
+            usage['max_rss'] = Util._peaks.get(p.pid)
+            return usage
+        if os.WIFSIGNALED(status):
+            p.returncode = -os.WTERMSIG(status)
         else:
-            return {'exec_time': end - start,
-                    'pid': pid,
-                    'retval': p.returncode}
-
-    def end_active_processes(self):
-        try:        
-            for pid, proc in self.active_procs.items():
-                proc.terminate()
-                time.sleep(0.5)
-                alive = proc.poll()
-                if alive is None:
-                    os.kill(pid, signal.SIGINT)
-        except:
+            p.returncode = os.WEXITSTATUS(status)
+        max_rss = Util._peaks.get(p.pid)
+        if max_rss is None:
+            max_rss = Util.rss_bytes(rusage.ru_maxrss)
+        return {'utime': rusage.ru_utime,
+                'stime': rusage.ru_stime,
+                'max_rss': max_rss,
+                'inblock': rusage.ru_inblock,
+                'oublock': rusage.ru_oublock,
+                'majflt': rusage.ru_majflt,
+                'nivcsw': rusage.ru_nivcsw}
+
+    @staticmethod
+    def rss_bytes(max_rss):
+        # ru_maxrss is in kilobytes, other than on OS X
+        if sys.platform != 'darwin':
+            max_rss *= 1024
+        return max_rss
+
+    @staticmethod
+    def sample_peak(pid):
+        """ Reads the peak RSS (VmHWM) of a live process from /proc. Popen
+            returns once the child has exec'd, so this is the tool's own
+            peak and not that of the copy of us it was forked as.
+        """
+        try:
+            with open('/proc/' + str(pid) + '/status', 'r') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        Util._peaks[pid] = int(line.split()[1]) * 1024
+                        return
+        except (OSError, IOError, ValueError, IndexError):
             pass
+
+    @staticmethod
+    def start_sampler():
+        sampler = Util._sampler
+        if sampler is None or not sampler[0].is_alive():
+            thread = Thread(target=Util.sample_peaks, name='PeakSampler')
+            thread.daemon = True
+            Util._sampler = (thread, Event())
+            thread.start()
+        Util._sampler[1].set()
+
+    @staticmethod
+    def sample_peaks():
+        """ Samples the peak RSS of every live process each 
+            'peak_interval' seconds, and waits while there are none. 
+            VmHWM only grows, so the last sample taken before a process 
+            exits is its peak as far as we can tell; a tool that exits 
+            before it is first sampled is left with what it had at start.
+        """
+        thread, wake = Util._sampler
+        while True:
+            if not Util._live:
+                wake.clear()
+                if not Util._live:
+                    wake.wait()
+            for pid in list(Util._live):
+                Util.sample_peak(pid)
+            time.sleep(Util.peak_interval)
+
+    @staticmethod
+    async def read_async(loop, pipe):
+        """ Reads a pipe to the end without blocking the loop. """
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        data = bytearray()
+        done = loop.create_future()
+        def readable():
+            try:
+                chunk = os.read(fd, 65536)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if not done.done():
+                    done.set_exception(e)
+                return
+            if chunk:
+                data.extend(chunk)
+            elif not done.done():
+                done.set_result(None)
+        loop.add_reader(fd, readable)
+        try:
+            await done
+        finally:
+            loop.remove_reader(fd)
+            pipe.close()
+        return bytes(data)
+
+    @staticmethod
+    async def exited_async(loop, p):
+        """ Returns once the process has exited (without reaping it). """
+        try:
+            fd = os.pidfd_open(p.pid)
+        except OSError:
+            # already reaped
+            return
+        done = loop.create_future()
+        loop.add_reader(fd, lambda: done.done() or done.set_result(None))
+        try:
+            await done
+        finally:
+            loop.remove_reader(fd)
+            os.close(fd)
+
+    def end_active_processes(self, timeout=None):
+        """ Terminates the process group of every process started here that
+            is still running. Doesn't wait for them to exit (see 
+            'terminate_group').
+        """
+        for proc in list(self.active_procs.values()):
+            Util.terminate_group(proc.pid, lambda proc=proc: 
+                                 proc.returncode is None, timeout)
+
+    @staticmethod
+    def terminate_group(pid, is_alive, timeout=None):
+        """ Sends SIGTERM to the process group led by 'pid' (or to just the 
+            process, if it doesn't lead one) and, if 'is_alive()' still says
+            it's running 'timeout' seconds later, SIGKILL. Returns at once.
+        """
+        if timeout is None:
+            timeout = Util.kill_timeout
+        if not is_alive():
+            return
+        Util.signal_group(pid, signal.SIGTERM)
+        def kill():
+            if is_alive():
+                Util.signal_group(pid, signal.SIGKILL)
+        timer = Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    @staticmethod
+    def signal_group(pid, sig):
+        try:
+            os.killpg(pid, sig)
+        except (ProcessLookupError, PermissionError):
+            try:
+                os.kill(pid, sig)
+            except OSError:
+                pass
+
+    @staticmethod
+    def kill_owned(owner):
+        """ Kills the process groups of the running tools started for 
+            'owner'.
+        """
+        for proc in list(Util._live.values()):
+            if proc.returncode is None and getattr(proc, 'owner', None) == owner:
+                Util.signal_group(proc.pid, signal.SIGKILL)
+
+    @staticmethod
+    def end_all_processes():
+        """ As tools run in process groups of their own, they don't get the
+            SIGINT of a Ctrl-C; this ends whatever is left on the way out.
+        """
+        for proc in list(Util._live.values()):
+            if proc.returncode is None:
+                Util.signal_group(proc.pid, signal.SIGTERM)
                 
     @staticmethod
     def exception_info():
@@ -133,3 +410,11 @@ class Util(object):
         return freq
 
 
+def _forget_parent_processes():
+    Util._live = {}
+    Util._peaks = {}
+    Util._sampler = None
+
+atexit.register(Util.end_all_processes)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_parent_processes)
@@ -0,0 +1,96 @@
+import os
+import time
+import atexit
+import logging
+from threading import Thread, Condition, Lock
+
+from util import Util
+
+
+class WriteBack(object):
+    """ Writes changed documents (e.g. Scandata) back to disk from a thread
+        of its own, 'delay' seconds after the first change that made each
+        dirty, so a burst of changes (a crop exported leaf by leaf, an
+        editor click exporting four crops) costs a single write, and the
+        thread that made them doesn't wait for it.
+
+        A document has a 'flush' method that writes it if it has unwritten
+        changes; 'schedule' queues it. What is still queued at exit is
+        written then, and anything that has to be on disk sooner (e.g.
+        before another process reads it) can be flushed directly.
+
+        There is one WriteBack per process (see 'shared'); a forked child
+        starts with nothing queued, its parent's documents being the
+        parent's to write.
+    """
+    _shared = None
+    _shared_lock = Lock()
+    delay = 0.5
+
+    def __init__(self):
+        self.pending = {}
+        self.thread = None
+        self._state = Condition()
+
+    @classmethod
+    def shared(cls):
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+                atexit.register(cls._shared.flush_all)
+            return cls._shared
+
+    def schedule(self, document):
+        with self._state:
+            if document in self.pending:
+                return
+            self.pending[document] = time.time() + self.delay
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name='WriteBack')
+                self.thread.daemon = True
+                self.thread.start()
+            self._state.notify()
+
+    def _run(self):
+        while True:
+            with self._state:
+                while not self.pending:
+                    self._state.wait()
+                document, due = min(self.pending.items(),
+                                    key=lambda item: item[1])
+                now = time.time()
+                if due > now:
+                    self._state.wait(due - now)
+                    continue
+                del self.pending[document]
+            self._flush(document)
+
+    def flush_all(self):
+        """ Writes everything queued now. """
+        with self._state:
+            documents = list(self.pending)
+            self.pending.clear()
+        for document in documents:
+            self._flush(document)
+
+    def _flush(self, document):
+        try:
+            document.flush()
+        except Exception:
+            # it is still dirty, so the next flush tries again
+            exception, tb = Util.exception_info()
+            logging.getLogger(__name__).error(tb)
+
+    def _after_fork(self):
+        self.pending = {}
+        self.thread = None
+        self._state = Condition()
+
+
+def _reset_shared():
+    if WriteBack._shared is not None:
+        WriteBack._shared._after_fork()
+    WriteBack._shared_lock = Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_shared)